@@ -0,0 +1,34 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PreferenceStore import load_preference_store
+from Solver import create_course_schedule
+from TimeGrid import load_time_grid
+
+
+def schedule_term(problem, options):
+    return create_course_schedule(*problem, **options)
+
+
+def schedule_all_terms(preferences_file='student-preferences.json', courses_file='courses.json',
+                       max_processes=None, cache_file=None, **options):
+    # The preference file is loaded once, then the terms are solved concurrently in a process pool.
+    # Results are keyed by termId. Any other keyword argument is passed on to create_course_schedule.
+    store = load_preference_store(preferences_file, courses_file, cache_file)
+    problems = {termId: store.term_problem(termId) for termId in store.terms()}
+    if max_processes is None:
+        max_processes = min(len(problems), os.cpu_count() or 1)
+    # Share the cores between the concurrent solves instead of letting every CP-SAT solve claim all of them
+    options.setdefault('num_workers', max(1, (os.cpu_count() or 1) // max(1, max_processes)))
+
+    with ProcessPoolExecutor(max_workers=max(1, max_processes)) as executor:
+        futures = {termId: executor.submit(schedule_term, problem, options) for termId, problem in problems.items()}
+        return {termId: future.result() for termId, future in futures.items()}
+
+
+if __name__ == '__main__':
+    engine = sys.argv[1] if len(sys.argv) > 1 else 'cp_sat'
+    results = schedule_all_terms(engine=engine, cache_file='student-preferences.npz', time_grid=load_time_grid())
+    for termId, result in results.items():
+        print(f"Term {termId}: {result['status']}, preference sets assigned: {result['preference_counts']}")
@@ -0,0 +1,161 @@
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PreferenceStore import build_preference_store
+from ScheduleValidator import validate_schedule
+
+
+def generate_school(num_students, num_courses=40, min_sections=2, max_sections=4, max_seats=None,
+                    num_preference_sets=4, courses_per_set=4, popularity_skew=1.0, seat_ratio=1.5,
+                    num_terms=1, seed=0):
+    # Synthetic school shaped like student-preferences.json and courses.json.
+    # Course popularity follows a Zipf law with exponent popularity_skew (0 means uniform). Without a fixed
+    # max_seats, every course gets seat_ratio times its expected demand spread over its sections.
+    rnd = random.Random(seed)
+    popularity_rank = list(range(1, num_courses + 1))
+    rnd.shuffle(popularity_rank)
+    weights = [1.0 / rank ** popularity_skew for rank in popularity_rank]
+    total_weight = sum(weights)
+
+    courses_data = []
+    for c in range(num_courses):
+        sections = rnd.randint(min_sections, max_sections)
+        seats = max_seats
+        if seats is None:
+            expected_demand = num_students * courses_per_set * weights[c] / total_weight
+            seats = max(1, math.ceil(seat_ratio * expected_demand / sections))
+        courses_data.append({"id": c + 1, "name": f"Course {c + 1}", "code": f"C{c + 1:03d}",
+                             "maxSeats": seats, "maxSections": sections})
+
+    course_ids = [course["id"] for course in courses_data]
+    preferences_data = []
+    for student in range(num_students):
+        terms = []
+        for term in range(num_terms):
+            preference_sets = []
+            for _ in range(num_preference_sets):
+                preference_set = []
+                while len(preference_set) < min(courses_per_set, num_courses):
+                    c = rnd.choices(course_ids, weights)[0]
+                    if c not in preference_set:
+                        preference_set.append(c)
+                preference_sets.append(preference_set)
+            terms.append({"termId": term + 1, "coursesPreferences": preference_sets})
+        preferences_data.append({"studentId": student + 1, "terms": terms})
+    return preferences_data, courses_data
+
+
+def run_case(solver_name, engine, school, time_limit=None, num_workers=0):
+    # Runs in a fresh process so ru_maxrss is the peak resident set size of this run alone
+    import DifferentScheduleSolver
+    import Solver
+
+    problem = build_preference_store(*generate_school(**school)).term_problem(1)
+    start = time.perf_counter()
+    if solver_name == 'DifferentScheduleSolver':
+        result = DifferentScheduleSolver.create_course_schedule(2, *problem, engine=engine, time_limit=time_limit,
+                                                                num_workers=num_workers)
+    else:
+        result = Solver.create_course_schedule(*problem, engine=engine, time_limit=time_limit,
+                                               num_workers=num_workers)
+    wall_time = time.perf_counter() - start
+    # Every schedule is checked independently of the engine, the decomposition and column_generation engines
+    # place whole sets
+    validate_start = time.perf_counter()
+    validation = validate_schedule(result, *problem, whole_sets=engine in ('decomposition', 'column_generation'))
+    validate_time = time.perf_counter() - validate_start
+
+    record = {
+        'solver': solver_name,
+        'engine': engine,
+        'students': school['num_students'],
+        'courses': school.get('num_courses', 40),
+        'seed': school.get('seed', 0),
+        'status': result['status'],
+        'wall_time': wall_time,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'valid': validation['valid'],
+        'violation_counts': validation['violation_counts'],
+        'mean_rank': validation['mean_rank'],
+        'validate_time': validate_time
+    }
+    record.update(result['statistics'])
+    return record
+
+
+def run_benchmarks(sizes, engines=('cp_sat', 'decomposition'), solvers=('Solver', 'DifferentScheduleSolver'),
+                   time_limit=None, num_workers=0, **school):
+    context = multiprocessing.get_context('spawn')
+    records = []
+    for num_students in sizes:
+        for solver_name in solvers:
+            for engine in engines:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    case = dict(school, num_students=num_students)
+                    records.append(executor.submit(run_case, solver_name, engine, case, time_limit,
+                                                   num_workers).result())
+    return records
+
+
+def environment():
+    # Identifies the code and tools a benchmark ran with, so result files can be compared across commits
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        from importlib.metadata import version
+        ortools_version = version('ortools')
+    except Exception:
+        ortools_version = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'ortools': ortools_version
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark create_course_schedule on synthetic schools.')
+    parser.add_argument('--sizes', default='25,50,100,200', help='comma separated numbers of students')
+    parser.add_argument('--engines', default='cp_sat,decomposition')
+    parser.add_argument('--solvers', default='Solver,DifferentScheduleSolver')
+    parser.add_argument('--courses', type=int, default=40)
+    parser.add_argument('--min-sections', type=int, default=2)
+    parser.add_argument('--max-sections', type=int, default=4)
+    parser.add_argument('--max-seats', type=int, default=None)
+    parser.add_argument('--preference-sets', type=int, default=4)
+    parser.add_argument('--courses-per-set', type=int, default=4)
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of course popularity')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--time-limit', type=float, default=60.0)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-results.jsonl', help='JSON lines file results are appended to')
+    args = parser.parse_args()
+
+    records = run_benchmarks([int(size) for size in args.sizes.split(',')], args.engines.split(','),
+                             args.solvers.split(','), args.time_limit, args.workers,
+                             num_courses=args.courses, min_sections=args.min_sections,
+                             max_sections=args.max_sections, max_seats=args.max_seats,
+                             num_preference_sets=args.preference_sets, courses_per_set=args.courses_per_set,
+                             popularity_skew=args.skew, seed=args.seed)
+    run_environment = environment()
+    with open(args.output, 'a') as file:
+        for record in records:
+            file.write(json.dumps(dict(run_environment, **record)) + '\n')
+    for record in records:
+        print(f"{record['solver']:<24} {record['engine']:<14} {record['students']:>6} students  "
+              f"{record['status']:<12} build {record['build_time']:8.3f}s  solve {record['solve_time']:8.3f}s  "
+              f"rss {record['peak_rss_kb'] / 1024:8.1f} MB  vars {record['num_variables']:>9}  "
+              f"constraints {record['num_constraints']:>9}  objective {record['objective']}"
+              f"{'' if record['valid'] else '  INVALID'}")
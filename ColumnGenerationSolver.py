@@ -0,0 +1,362 @@
+import itertools
+import time
+
+import numpy as np
+from ortools.linear_solver import pywraplp
+from ortools.sat.python import cp_model
+
+from CpSatSolver import lexicographic_weights, weights_fit, profile_groups
+from DecompositionSolver import greedy_timetable
+from Metrics import phase, record_solver
+from ScheduleResult import schedule_result, print_solution, model_statistics
+from TimeGrid import default_time_grid, course_block_domains
+
+# Reduced costs below this, relative to the value of placing a student, do not add a column
+REDUCED_COST_TOLERANCE = 1e-9
+# Patterns per preference set added once the dives have fixed the timetable
+SET_PATTERNS = 16
+
+
+def pattern_values(num_students, preferences, maximize, objective):
+    # values[k] is what a student placed in their (k+1)-th preference set adds to the master objective, and
+    # placed what placing them at all adds: one more placed student outweighs every preference level, as
+    # the engine places every student, and the levels below that follow the objective
+    num_levels = max(map(len, preferences), default=0)
+    if objective == 'first_choices':
+        weights = lexicographic_weights(num_students, 2)
+        return [weights[0] + (weights[1] if k < maximize else 0) for k in range(num_levels)], weights[0]
+    if objective in ('weighted', 'lexicographic'):
+        if not weights_fit(num_students, num_levels + 1):
+            raise ValueError("The column_generation engine needs the lexicographic weights to fit CP-SAT's "
+                             "integer range, use the decomposition engine for this many students")
+        weights = lexicographic_weights(num_students, num_levels + 1)
+        return [weights[0] + weights[k + 1] for k in range(num_levels)], weights[0]
+    raise ValueError(f"Unknown objective: {objective}")
+
+
+def price_pattern(courses, costs):
+    # Cheapest assignment of courses to distinct time blocks, costs[c] being the dual price of a seat of
+    # course c in every block (inf where it cannot run). In an optimal assignment no course needs a block
+    # beyond its len(courses) cheapest ones, one of those is always free, so the search only branches
+    # over those, cheapest first, and prunes on the best assignment found so far.
+    # Returns (cost, {course: block}), cost inf when there is no assignment.
+    n = len(courses)
+    candidates = []
+    for c in courses:
+        row = costs[c]
+        blocks = np.argpartition(row, n - 1)[:n] if n < len(row) else np.arange(len(row))
+        blocks = blocks[np.argsort(row[blocks], kind='stable')]
+        candidates.append([(float(row[t]), int(t)) for t in blocks if row[t] < np.inf])
+    # Courses with the fewest usable blocks first
+    order = sorted(range(n), key=lambda j: len(candidates[j]))
+    best = [np.inf, None]
+    chosen = [0] * n
+    used = set()
+
+    def search(depth, cost):
+        if depth == n:
+            best[0], best[1] = cost, {courses[j]: chosen[j] for j in range(n)}
+            return
+        j = order[depth]
+        for block_cost, t in candidates[j]:
+            if cost + block_cost >= best[0]:
+                break
+            if t in used:
+                continue
+            used.add(t)
+            chosen[j] = t
+            search(depth + 1, cost + block_cost)
+            used.discard(t)
+
+    search(0, 0.0)
+    return best[0], best[1]
+
+
+def column_generation_course_schedule(students, courses, preferences, sections, section_capacity, maximize=1,
+                                      num_workers=0, time_limit=None, max_iterations=500, verbose=False,
+                                      gap_limit=None, on_solution=None, objective='first_choices', time_grid=None,
+                                      allowed_blocks=None):
+    # Like the decomposition engine, this one places every student in exactly one whole preference set.
+    # A pattern is one preference set of a profile group (students with identical preference lists, see
+    # profile_groups) together with a time block for each of its courses. The master problem
+    #   lambda[p]   members of the group placed in pattern p
+    #   open[c, t]  a section of course c runs at time block t, sections numbered by block
+    # places at most the group's members in its patterns, seats at most section_capacity[c] students in an
+    # open block and opens at most sections[c] blocks per course. GLOP solves its linear relaxation starting
+    # from the patterns of a greedy timetable on everyone's first set, and the duals of the seat rows price
+    # new patterns per group and set (price_pattern). Once none improves the relaxation, courses are fixed
+    # to their most open blocks one dive at a time, and when the timetable is whole CP-SAT places every
+    # student over the patterns generated for it. The schedule is only optimal for that timetable: status
+    # 'OPTIMAL' means it meets the Lagrangian bound of the root relaxation, which holds for any schedule.
+    # max_iterations caps the pricing rounds over all dives, and with a time_limit at most half of it goes
+    # to pricing and the rest to CP-SAT. Without a schedule for everyone the result is 'NOT OPTIMAL' with no
+    # schedule.
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    num_courses = len(courses)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    # A course never has more sections than blocks it can be scheduled in
+    sections = [min(sections[c], len(domains[c])) for c in range(num_courses)]
+    values, placed_value = pattern_values(len(students), preferences, maximize, objective)
+    start = time.monotonic()
+    deadline = None if time_limit is None else start + time_limit
+    pricing_deadline = None if time_limit is None else start + time_limit / 2
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    statistics = model_statistics()
+    statistics['phases'] = {}
+    phases = statistics['phases']
+    result = schedule_result('NOT OPTIMAL', students, preferences, statistics=statistics)
+    groups = profile_groups(preferences)
+    usable = [c for c in range(num_courses) if sections[c] > 0 and section_capacity[c] > 0]
+
+    # Master LP rows: one per group, one per course and block of its domain for the seats, one per course
+    # for the sections
+    build_start = time.perf_counter()
+    lp = pywraplp.Solver.CreateSolver('GLOP')
+    group_rows = [lp.Constraint(-lp.infinity(), len(members), f'group[{g}]')
+                  for g, (_, members) in enumerate(groups)]
+    seat_rows = {}
+    section_rows = {}
+    open_vars = {}
+    for c in usable:
+        section_rows[c] = lp.Constraint(-lp.infinity(), sections[c], f'sections[{c}]')
+        for t in domains[c]:
+            open_vars[c, t] = lp.NumVar(0, 1, f'open[{c},{t}]')
+            seat_rows[c, t] = lp.Constraint(-lp.infinity(), 0, f'seats[{c},{t}]')
+            seat_rows[c, t].SetCoefficient(open_vars[c, t], -section_capacity[c])
+            section_rows[c].SetCoefficient(open_vars[c, t], 1)
+    objective_row = lp.Objective()
+    objective_row.SetMaximization()
+    # columns[n] = (group, set, {course: block}) with its LP variable in column_vars[n], column_of finds a
+    # column by its key
+    columns = []
+    column_vars = []
+    column_of = {}
+
+    def add_column(g, k, blocks):
+        key = (g, k, tuple(sorted(blocks.items())))
+        if key in column_of:
+            return False
+        column_of[key] = len(columns)
+        var = lp.NumVar(0, lp.infinity(), f'lambda[{len(columns)}]')
+        group_rows[g].SetCoefficient(var, 1)
+        for c, t in blocks.items():
+            seat_rows[c, t].SetCoefficient(var, 1)
+        objective_row.SetCoefficient(var, values[k])
+        columns.append((g, k, blocks))
+        column_vars.append(var)
+        return True
+
+    # Initial patterns from the greedy timetable of everyone's first set
+    with phase(phases, 'greedy'):
+        first_sets = {}
+        for g, (profile, members) in enumerate(groups):
+            if profile:
+                first_sets.setdefault(tuple(sorted(c - 1 for c in profile[0])), []).extend(members)
+        course_blocks, student_blocks = greedy_timetable(courses, sections, section_capacity,
+                                                         list(first_sets.items()), total_blocks, domains)
+        group_of = {i: g for g, (_, members) in enumerate(groups) for i in members}
+        for i, blocks in student_blocks.items():
+            add_column(group_of[i], 0, blocks)
+    statistics['build_time'] += time.perf_counter() - build_start
+
+    # Pricing rounds, first at the root and then after every dive: once no pattern improves the LP, the
+    # course whose sections are closest to integral (and every course already integral) is fixed to its most
+    # open blocks and the patterns priced again, until the whole timetable is fixed. Only the root rounds
+    # bound the full problem.
+    best_bound = None
+    iterations = 0
+    dives = 0
+    fixed_open = {}
+    costs = np.zeros((num_courses, total_blocks))
+    tolerance = REDUCED_COST_TOLERANCE * placed_value
+    while iterations < max_iterations and len(fixed_open) < len(open_vars):
+        if pricing_deadline is not None and time.monotonic() >= pricing_deadline:
+            break
+        with phase(phases, 'master_lp'):
+            solve_start = time.perf_counter()
+            if pricing_deadline is not None:
+                lp.SetTimeLimit(int(1000 * max(0.0, pricing_deadline - time.monotonic())) + 1)
+            lp_status = lp.Solve()
+            statistics['solve_time'] += time.perf_counter() - solve_start
+        if lp_status != pywraplp.Solver.OPTIMAL:
+            break
+        iterations += 1
+        with phase(phases, 'pricing'):
+            # Every dual is read before the first new column invalidates the solution
+            costs = np.full((num_courses, total_blocks), np.inf)
+            for (c, t), row in seat_rows.items():
+                if fixed_open.get((c, t), 1):
+                    costs[c, t] = max(0.0, row.dual_value())
+            group_duals = [max(0.0, row.dual_value()) for row in group_rows]
+            lp_value = objective_row.Value()
+            bound = lp_value
+            added = 0
+            for g, (profile, members) in enumerate(groups):
+                best_gain = 0.0
+                for k, preference_set in enumerate(profile):
+                    cost, blocks = price_pattern([c - 1 for c in preference_set], costs)
+                    if blocks is None:
+                        continue
+                    gain = values[k] - group_duals[g] - cost
+                    best_gain = max(best_gain, gain)
+                    if gain > tolerance and add_column(g, k, blocks):
+                        added += 1
+                # Lagrangian bound: no pattern of the group gains more than best_gain over the LP duals
+                bound += len(members) * best_gain
+        if not dives:
+            best_bound = bound if best_bound is None else min(best_bound, bound)
+        if verbose:
+            print(f"Iteration {iterations}: LP {lp_value:.1f}, bound {best_bound:.1f}, {added} new patterns, "
+                  f"{len(columns)} in all, {dives} dives")
+        if added:
+            continue
+
+        with phase(phases, 'dive'):
+            # How far each free course is from opening its sections[c] most open blocks (those with any
+            # seats at all) and nothing else. Solution values are all read before any bound changes.
+            distance, rounded = {}, {}
+            for c in usable:
+                if (c, domains[c][0]) in fixed_open:
+                    continue
+                opened = {t: open_vars[c, t].solution_value() for t in domains[c]}
+                top = sorted(domains[c], key=lambda t: -opened[t])[:sections[c]]
+                rounded[c] = {t: int(t in top and opened[t] > 1e-6) for t in domains[c]}
+                distance[c] = sum(abs(rounded[c][t] - opened[t]) for t in domains[c])
+            fix = [c for c in distance if distance[c] < 1e-6]
+            fractional = [c for c in distance if distance[c] >= 1e-6]
+            if fractional:
+                fix.append(min(fractional, key=lambda c: distance[c]))
+            for c in fix:
+                for t in domains[c]:
+                    fixed_open[c, t] = rounded[c][t]
+                    open_vars[c, t].SetBounds(rounded[c][t], rounded[c][t])
+            dives += 1
+
+    # On the fixed timetable, the SET_PATTERNS cheapest patterns of every set at the last duals go to the
+    # integer master too, the priced ones alone are seldom enough to place everyone
+    lp_counts = []
+    if len(fixed_open) == len(open_vars):
+        with phase(phases, 'enumerate'):
+            open_blocks = {c: [t for t in domains[c] if fixed_open[c, t]] for c in usable}
+            for g, (profile, members) in enumerate(groups):
+                for k, preference_set in enumerate(profile):
+                    set_courses = [c - 1 for c in preference_set]
+                    if any(c not in open_blocks for c in set_courses):
+                        continue
+                    patterns = [blocks for blocks in itertools.product(*(open_blocks[c] for c in set_courses))
+                                if len(set(blocks)) == len(blocks)]
+                    patterns.sort(key=lambda blocks: sum(costs[c, t] for c, t in zip(set_courses, blocks)))
+                    for blocks in patterns[:SET_PATTERNS]:
+                        add_column(g, k, dict(zip(set_courses, blocks)))
+        # The LP over all of them, rounded, is where the integer master starts
+        with phase(phases, 'master_lp'):
+            solve_start = time.perf_counter()
+            if pricing_deadline is not None:
+                lp.SetTimeLimit(int(1000 * remaining()) + 1)
+            lp_status = lp.Solve()
+            statistics['solve_time'] += time.perf_counter() - solve_start
+        if lp_status == pywraplp.Solver.OPTIMAL:
+            lp_counts = [round(var.solution_value()) for var in column_vars]
+    statistics['iterations'] = iterations
+    statistics['dives'] = dives
+    statistics['columns'] = len(columns)
+    statistics['num_variables'] = lp.NumVariables()
+    statistics['num_constraints'] = lp.NumConstraints()
+
+    # Integer master over the generated patterns, with every student placed and the objective in the units
+    # of the other engines
+    base = placed_value * len(students)
+    with phase(phases, 'master_ip'):
+        build_start = time.perf_counter()
+        model = cp_model.CpModel()
+        count = [model.NewIntVar(0, len(groups[g][1]), f'lambda[{n}]') for n, (g, _, _) in enumerate(columns)]
+        is_open = {key: model.NewBoolVar(f'open[{key[0]},{key[1]}]') for key in open_vars}
+        group_columns = [[] for _ in groups]
+        seat_columns = {key: [] for key in open_vars}
+        for n, (g, k, blocks) in enumerate(columns):
+            group_columns[g].append(count[n])
+            for key in blocks.items():
+                seat_columns[key].append(count[n])
+        for g, (_, members) in enumerate(groups):
+            model.Add(sum(group_columns[g]) == len(members))
+        for (c, t), seated in seat_columns.items():
+            model.Add(sum(seated) <= section_capacity[c] * is_open[c, t])
+        for c in usable:
+            model.Add(sum(is_open[c, t] for t in domains[c]) <= sections[c])
+        value = sum((values[k] - placed_value) * count[n] for n, (_, k, _) in enumerate(columns))
+        model.Maximize(value)
+        # The root bound holds for every pattern, it spares CP-SAT proving it again. The weights are integers,
+        # so it rounds down, with slack for the LP tolerances, and never exceeds everyone in their best set.
+        if best_bound is not None:
+            best_value = sum(len(members) * (max(values[:len(profile)]) - placed_value)
+                             for profile, members in groups if profile)
+            best_bound = min(best_value, int(np.floor(best_bound - base + 1e-9 * abs(best_bound) + 1e-6)))
+            model.Add(value <= best_bound)
+        # With every course fixed by the dives only the patterns are left to choose, otherwise the search
+        # starts from the greedy timetable
+        if len(fixed_open) == len(open_vars):
+            for key, var in is_open.items():
+                model.Add(var == fixed_open[key])
+            for n, lp_count in enumerate(lp_counts):
+                model.AddHint(count[n], lp_count)
+        else:
+            greedy_counts = [0] * len(columns)
+            for i, blocks in student_blocks.items():
+                greedy_counts[column_of[group_of[i], 0, tuple(sorted(blocks.items()))]] += 1
+            for n in range(len(columns)):
+                model.AddHint(count[n], greedy_counts[n])
+            for key, var in is_open.items():
+                model.AddHint(var, key[1] in course_blocks[key[0]])
+        statistics['build_time'] += time.perf_counter() - build_start
+        solver = cp_model.CpSolver()
+        solver.parameters.num_workers = num_workers
+        if time_limit is not None:
+            solver.parameters.max_time_in_seconds = remaining()
+        if gap_limit is not None:
+            solver.parameters.relative_gap_limit = gap_limit
+        solve_start = time.perf_counter()
+        status = solver.Solve(model)
+        statistics['solve_time'] += time.perf_counter() - solve_start
+        record_solver(statistics, solver, status)
+        statistics['num_variables'] += len(model.Proto().variables)
+        statistics['num_constraints'] += len(model.Proto().constraints)
+    if status == cp_model.MODEL_INVALID:
+        raise ValueError(f"CP-SAT rejected the model: {model.Validate()}")
+
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        objective_value = round(solver.ObjectiveValue())
+        statistics['objective'] = objective_value
+        # CP-SAT's own bound only holds for the generated patterns, the root bound for every schedule
+        statistics['best_bound'] = best_bound
+
+        course_blocks = {c: sorted(t for t in domains[c] if (c, t) in is_open and solver.Value(is_open[c, t]))
+                         for c in range(num_courses)}
+        section_of_block = {(c, t): s for c in course_blocks for s, t in enumerate(course_blocks[c])}
+        # Members of a group take its patterns in turn
+        schedule, preference_sets = {}, {}
+        next_member = [0] * len(groups)
+        for n, (g, k, blocks) in enumerate(columns):
+            for _ in range(solver.Value(count[n])):
+                i = groups[g][1][next_member[g]]
+                next_member[g] += 1
+                schedule[students[i]] = [{
+                    'course': c + 1,
+                    'section': section_of_block[c, t] + 1,
+                    'time_block': t + 1
+                } for c, t in sorted(blocks.items())]
+                preference_sets[students[i]] = k + 1
+        section_blocks = {c + 1: {s + 1: t + 1 for s, t in enumerate(course_blocks[c])}
+                          for c in course_blocks if course_blocks[c]}
+        optimal = best_bound is not None and objective_value >= best_bound
+        result = schedule_result('OPTIMAL' if optimal else 'FEASIBLE', students, preferences, schedule,
+                                 preference_sets, section_blocks, statistics)
+        if on_solution is not None:
+            on_solution(result)
+
+    if verbose:
+        print_solution(result)
+    return result
@@ -0,0 +1,93 @@
+from Metrics import merge_phases, merge_solver
+from ScheduleResult import schedule_result, model_statistics
+
+
+def independent_components(students, courses, preferences):
+    # Connected components of the student-course graph: two courses are linked when one student requested
+    # both, in any of their preference sets. Sections of different courses may share a time block, so
+    # nothing but a student couples two courses and the components can be scheduled separately.
+    # Returns (student indices, 0-based course indices) pairs, largest first. Students without any
+    # preference join the first component, courses nobody requested are left out.
+    parent = list(range(len(courses)))
+
+    def find(c):
+        while parent[c] != c:
+            parent[c] = parent[parent[c]]
+            c = parent[c]
+        return c
+
+    requested = []
+    for i in range(len(students)):
+        student_courses = sorted({c - 1 for preference_set in preferences[i] for c in preference_set})
+        requested.append(student_courses)
+        for c in student_courses[1:]:
+            parent[find(c)] = find(student_courses[0])
+
+    members = {}
+    for i in range(len(students)):
+        if requested[i]:
+            members.setdefault(find(requested[i][0]), ([], set()))[0].append(i)
+    for c in {c for student_courses in requested for c in student_courses}:
+        members[find(c)][1].add(c)
+    parts = sorted(((part_students, sorted(part_courses)) for part_students, part_courses in members.values()),
+                   key=lambda part: -len(part[0]))
+    unplaced = [i for i in range(len(students)) if not requested[i]]
+    if not parts:
+        return [(unplaced, [])]
+    parts[0] = (sorted(parts[0][0] + unplaced), parts[0][1])
+    return parts
+
+
+def component_problem(part, students, courses, preferences, sections, section_capacity, allowed_blocks=None):
+    # Positional arguments of create_course_schedule for one component, its courses renumbered from 1,
+    # and allowed_blocks with the renumbered course ids
+    part_students, part_courses = part
+    number = {c: j + 1 for j, c in enumerate(part_courses)}
+    problem = ([students[i] for i in part_students], list(range(1, len(part_courses) + 1)),
+               [[[number[c - 1] for c in preference_set] for preference_set in preferences[i]] for i in part_students],
+               [sections[c] for c in part_courses], [section_capacity[c] for c in part_courses])
+    part_allowed = {number[c]: allowed_blocks[courses[c]] for c in part_courses
+                    if allowed_blocks and courses[c] in allowed_blocks}
+    return problem, part_allowed
+
+
+def merge_component_results(parts, students, courses, preferences, results, objective='first_choices'):
+    # One result for the whole input, courses numbered as in the input again. Any component without a
+    # schedule leaves the whole input without one, with the conflicts of every component.
+    statistics = model_statistics()
+    for key in ('build_time', 'solve_time', 'num_variables', 'num_constraints'):
+        statistics[key] = sum(result['statistics'].get(key, 0) for result in results)
+    # Objective values of different components only add up for the first_choices count
+    for key in ('objective', 'best_bound'):
+        values = [result['statistics'].get(key) for result in results]
+        if objective == 'first_choices' and None not in values:
+            statistics[key] = sum(values)
+    statistics['components'] = len(parts)
+    # Phases and search statistics are summed over the components, solved in parallel
+    statistics['phases'] = {}
+    for result in results:
+        merge_phases(statistics['phases'], result['statistics'].get('phases', {}))
+        merge_solver(statistics, result['statistics'])
+
+    if any(result['status'] == 'NOT OPTIMAL' for result in results):
+        conflicts = []
+        for (part_students, part_courses), result in zip(parts, results):
+            for conflict in result['conflicts']:
+                if 'courses' in conflict and isinstance(conflict['courses'], list):
+                    conflict = dict(conflict, courses=[courses[part_courses[j - 1]] for j in conflict['courses']])
+                conflicts.append(conflict)
+        return schedule_result('NOT OPTIMAL', students, preferences, statistics=statistics, conflicts=conflicts)
+
+    schedule = {}
+    preference_sets = {}
+    section_blocks = {}
+    for (part_students, part_courses), result in zip(parts, results):
+        for student, entries in result['schedule'].items():
+            schedule[student] = [dict(entry, course=part_courses[entry['course'] - 1] + 1) for entry in entries]
+        preference_sets.update(result['preference_sets'])
+        for course, blocks in result['section_blocks'].items():
+            section_blocks[part_courses[course - 1] + 1] = blocks
+    status = 'OPTIMAL' if all(result['status'] == 'OPTIMAL' for result in results) else 'FEASIBLE'
+    return schedule_result(status, students, preferences, {student: schedule[student] for student in students},
+                           {student: preference_sets[student] for student in students},
+                           dict(sorted(section_blocks.items())), statistics)
@@ -0,0 +1,788 @@
+import time
+from collections.abc import Mapping
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+from Feasibility import course_seats, explain_infeasibility
+from Metrics import phase, record_solver
+from ScheduleCache import cache_key
+from ScheduleResult import schedule_result, print_solution, model_statistics
+from TimeGrid import default_time_grid, course_block_domains, time_domain_key
+
+
+def index_requested_courses(num_students, num_courses, preferences):
+    # student_courses[i] is the sorted union of the (0-based) courses in the preference sets of student i,
+    # course_students[c] lists the students who requested course c in any of their preference sets
+    student_courses = []
+    course_students = [[] for _ in range(num_courses)]
+    for i in range(num_students):
+        requested = sorted({c - 1 for preference_set in preferences[i] for c in preference_set})
+        student_courses.append(requested)
+        for c in requested:
+            course_students[c].append(i)
+    return student_courses, course_students
+
+
+def preference_levels(x, preferences):
+    # levels[k] counts the students placed in their (k+1)-th preference set
+    levels = []
+    for k in range(max((len(p) for p in preferences), default=0)):
+        levels.append(sum(x[i, k] for i in range(len(preferences)) if k < len(preferences[i])))
+    return levels
+
+
+def lexicographic_weights(num_students, num_levels):
+    # One more student at level k outweighs every student at the later levels combined
+    return [(num_students + 1) ** (num_levels - 1 - k) for k in range(num_levels)]
+
+
+def weights_fit(num_students, num_levels):
+    # The weighted objective only fits CP-SAT's integer range while the first weight times the students does
+    return lexicographic_weights(num_students, num_levels)[0] * (num_students + 1) < 2 ** 62 if num_levels else True
+
+
+def set_objective(model, x, preferences, maximize=1, objective='first_choices', num_students=None):
+    # Replaces the objective only, so a built (or cached) model can be reused with another objective mode.
+    # num_students sets the weights when x counts groups of students rather than single ones.
+    model.ClearObjective()
+    num_students = len(preferences) if num_students is None else num_students
+    # 'first_choices': maximize the total number of students attending one of their first `maximize` preferred sets
+    # 'weighted': maximize first-choice placements, then second-choice and so on, in a single weighted objective
+    # 'lexicographic': same order, solved level by level by solve_lexicographically, starting with the first level
+    if objective == 'first_choices':
+        model.Maximize(sum(x[i, k] for i in range(len(preferences)) for k in range(min(maximize, len(preferences[i])))))
+    elif objective == 'weighted':
+        levels = preference_levels(x, preferences)
+        if not weights_fit(num_students, len(levels)):
+            raise ValueError(f"Weighted objective overflows for {num_students} students and {len(levels)} "
+                             f"preference levels, use objective='lexicographic'")
+        model.Maximize(sum(w * level for w, level in zip(lexicographic_weights(num_students, len(levels)), levels)))
+    elif objective == 'lexicographic':
+        model.Maximize(preference_levels(x, preferences)[0])
+    else:
+        raise ValueError(f"Unknown objective: {objective}")
+
+
+def add_section_constraints(model, z, sections, domains, symmetry_breaking=True, phases=None):
+    # Each section of courses is assigned to at most one time block
+    with phase(phases, 'section_blocks', model):
+        for c in range(len(sections)):
+            for s in range(sections[c]):
+                model.AddAtMostOne(z[c, s, t] for t in domains[c])
+
+    # No multiple section of a same course can be assigned to the same time block
+    with phase(phases, 'section_overlap', model):
+        for c in range(len(sections)):
+            for t in domains[c]:
+                model.AddAtMostOne(z[c, s, t] for s in range(sections[c]))
+
+    # Sections of a course are interchangeable (same capacity, same rules), so only keep the permutation
+    # where used sections come first and are ordered by time block: if section s+1 sits at block t,
+    # section s must sit at an earlier block. Students follow their section's block, so this removes
+    # the student-to-section permutations as well and every optimal schedule keeps an equivalent one.
+    if symmetry_breaking:
+        with phase(phases, 'symmetry_breaking', model):
+            for c in range(len(sections)):
+                for s in range(sections[c] - 1):
+                    for t in domains[c]:
+                        model.AddBoolOr([z[c, s, u] for u in domains[c] if u < t]).OnlyEnforceIf(z[c, s + 1, t])
+
+
+def build_course_schedule_model(students, courses, preferences, sections, section_capacity, maximize=1,
+                                symmetry_breaking=True, objective='first_choices', time_grid=None,
+                                allowed_blocks=None, capacity_literals=None, formulation='standard', phases=None,
+                                rows=None):
+    # Time blocks come from time_grid (the 5-day, 5-block week with lunch in block 3 of constraints.json
+    # by default), and each course only gets variables for the blocks of its domain.
+    # formulation='aggregated' builds the same schedules with fewer rows: one capacity row per section and
+    # block links the students to the section, instead of one implication per student variable, and a
+    # student's courses are only counted once, in the row every student has.
+    # Given a phases dict, the time, memory and rows of every variable and constraint family are added to it.
+    # Given a rows dict, the capacity row of section s of course c is kept under ('capacity', c, s) and the
+    # row fixing how many courses student i takes under ('courses_taken', i), so that ScheduleSession can
+    # change their bounds and terms in place (standard formulation only).
+    if formulation not in ('standard', 'aggregated'):
+        raise ValueError(f"Unknown formulation: {formulation}")
+    if formulation == 'aggregated' and capacity_literals is not None:
+        raise ValueError("capacity_literals need the standard formulation")
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    in_domain = [set(domain) for domain in domains]
+    model = cp_model.CpModel()
+
+    # Variables
+    # Student Preference Assignment
+    x = {}
+    with phase(phases, 'preference_variables', model):
+        for i in range(len(students)):
+            for k in range(len(preferences[i])):
+                x[i, k] = model.NewBoolVar(f'x[{i},{k}]')
+
+    # course section time block assignment
+    z = {}
+    with phase(phases, 'section_variables', model):
+        for c in range(len(courses)):
+            for s in range(sections[c]):
+                for t in domains[c]:
+                    z[c, s, t] = model.NewBoolVar(f'z[{c},{s},{t}]')
+
+    # Courses reachable by each student, a student can only ever take courses from the union of their preference sets
+    student_courses, course_students = index_requested_courses(len(students), len(courses), preferences)
+
+    # Student-Section Assignment, only created for reachable (student, course) pairs
+    y = {}
+    with phase(phases, 'student_section_variables', model):
+        for i in range(len(students)):
+            for c in student_courses[i]:
+                for s in range(sections[c]):
+                    for t in domains[c]:
+                        y[i, c, s, t] = model.NewBoolVar(f'y[{i},{c},{s},{t}]')
+
+    # If a student is assigned to a course section at a time block,
+    # then that course section must be scheduled at that time block
+    if formulation == 'standard':
+        with phase(phases, 'section_links', model):
+            for (i, c, s, t), var in y.items():
+                model.AddImplication(var, z[c, s, t])
+
+    add_section_constraints(model, z, sections, domains, symmetry_breaking, phases)
+
+    # Course capacities. Given a capacity_literals dict, the rows of course c are only enforced by
+    # capacity_literals[c], so an infeasible model can be explained by the courses short of seats
+    with phase(phases, 'capacity', model):
+        for c in range(len(courses)):
+            if capacity_literals is not None and course_students[c]:
+                capacity_literals[c] = model.NewBoolVar(f'capacity[{c}]')
+            for s in range(sections[c]):
+                if course_students[c] and formulation == 'aggregated':
+                    # A section sits at one block at most, so bounding each block by cap * z bounds the section
+                    for t in domains[c]:
+                        model.Add(sum(y[i, c, s, t] for i in course_students[c]) <= section_capacity[c] * z[c, s, t])
+                elif course_students[c]:
+                    capacity = model.Add(sum(y[i, c, s, t] for i in course_students[c] for t in domains[c]) <= section_capacity[c])
+                    if capacity_literals is not None:
+                        capacity.OnlyEnforceIf(capacity_literals[c])
+                    if rows is not None:
+                        rows['capacity', c, s] = capacity
+
+    # Each student is assigned to at most one set of preferred courses
+    with phase(phases, 'one_preference_set', model):
+        for i in range(len(students)):
+            model.AddAtMostOne(x[i, k] for k in range(len(preferences[i])))
+
+    # Students can only take one course during each time block
+    with phase(phases, 'student_overlap', model):
+        for i in range(len(students)):
+            for t in range(total_blocks):
+                model.AddAtMostOne(y[i, c, s, t] for c in student_courses[i] if t in in_domain[c]
+                                   for s in range(sections[c]))
+
+    # Align the student-section-time assignment variables with the student-preference assignment variables
+    with phase(phases, 'preference_set_rows', model):
+        for i in range(len(students)):
+            total_courses = [y[i, c, s, t] for c in student_courses[i] for s in range(sections[c]) for t in domains[c]]
+            for k in range(len(preferences[i])):
+                # If x[i,k]=1, the student takes exactly the courses of the preference set. With every student
+                # taking len(preferences[i]) courses below, that is only possible for a set of that size.
+                if formulation == 'standard':
+                    model.Add(sum(total_courses) == len(preferences[i][k])).OnlyEnforceIf(x[i, k])
+                elif len(preferences[i][k]) != len(preferences[i]):
+                    model.Add(x[i, k] == 0)
+                for c in preferences[i][k]:
+                    section_time_assignments = [y[i, c-1, s, t] for s in range(sections[c-1]) for t in domains[c-1]]
+                    # A course is taken at most once, and exactly once if x[i, k] = 1
+                    if formulation == 'standard':
+                        model.AddAtMostOne(section_time_assignments)
+                    model.AddBoolOr(section_time_assignments + [x[i, k].Not()])
+            if formulation == 'aggregated':
+                for c in student_courses[i]:
+                    model.AddAtMostOne(y[i, c, s, t] for s in range(sections[c]) for t in domains[c])
+            courses_taken = model.Add(sum(total_courses) == len(preferences[i]))
+            if rows is not None:
+                rows['courses_taken', i] = courses_taken
+
+    # Objective
+    with phase(phases, 'objective', model):
+        set_objective(model, x, preferences, maximize, objective)
+
+    return model, x, y, z, student_courses
+
+
+class IndexedVariables(Mapping):
+    # y of the lean model, read like the dict of build_course_schedule_model. The variables of student i in
+    # course c fill one range of proto indices, section by section and in domain order within a section,
+    # so a key is turned into an index arithmetically and a variable handle only exists while it is used.
+    def __init__(self, model, sections, domains):
+        self.model = model
+        self.sections = sections
+        self.domains = domains
+        self.position = [{t: p for p, t in enumerate(domain)} for domain in domains]
+        self.starts = {}
+        self.size = 0
+
+    def add(self, i, c):
+        # Unnamed Boolean variables written to the proto directly
+        proto = self.model.Proto()
+        self.starts[i, c] = len(proto.variables)
+        count = self.sections[c] * len(self.domains[c])
+        for _ in range(count):
+            proto.variables.add().domain.extend((0, 1))
+        self.size += count
+
+    def index(self, i, c, s, t):
+        try:
+            if not 0 <= s < self.sections[c]:
+                raise KeyError
+            return self.starts[i, c] + s * len(self.domains[c]) + self.position[c][t]
+        except (KeyError, IndexError):
+            raise KeyError((i, c, s, t)) from None
+
+    def section_indices(self, i, c, s):
+        start = self.starts[i, c] + s * len(self.domains[c])
+        return range(start, start + len(self.domains[c]))
+
+    def course_indices(self, i, c):
+        start = self.starts[i, c]
+        return range(start, start + self.sections[c] * len(self.domains[c]))
+
+    def __getitem__(self, key):
+        return self.model.GetBoolVarFromProtoIndex(self.index(*key))
+
+    def __iter__(self):
+        for i, c in self.starts:
+            for s in range(self.sections[c]):
+                for t in self.domains[c]:
+                    yield i, c, s, t
+
+    def __len__(self):
+        return self.size
+
+    def set_keys(self, values):
+        # Keys of the variables set to 1 in a solution vector, in creation order. The ranges were created
+        # one after the other, so an index belongs to the last range starting at or before it.
+        if not self.starts:
+            return []
+        pairs = list(self.starts)
+        starts = np.fromiter(self.starts.values(), dtype=np.int64, count=len(pairs))
+        ones = np.flatnonzero(np.asarray(values)[starts[0]:starts[0] + self.size]) + starts[0]
+        keys = []
+        for index, owner in zip(ones.tolist(), (np.searchsorted(starts, ones, side='right') - 1).tolist()):
+            i, c = pairs[owner]
+            s, p = divmod(index - starts[owner], len(self.domains[c]))
+            keys.append((i, c, s, self.domains[c][p]))
+        return keys
+
+
+def add_linear_row(proto, variables, lower, upper, coeffs=None, enforcement=()):
+    # A linear row written to the proto from variable indices, without building an expression
+    row = proto.constraints.add()
+    row.enforcement_literal.extend(enforcement)
+    row.linear.vars.extend(variables)
+    row.linear.coeffs.extend(coeffs if coeffs is not None else [1] * len(row.linear.vars))
+    row.linear.domain.extend((lower, upper))
+
+
+def build_lean_course_schedule_model(students, courses, preferences, sections, section_capacity, maximize=1,
+                                     symmetry_breaking=True, objective='first_choices', time_grid=None,
+                                     allowed_blocks=None, capacity_literals=None, formulation='standard',
+                                     phases=None):
+    # Same variables, rows and objective as build_course_schedule_model, in the same order, for inputs
+    # whose dense model would not fit in memory (see ModelSize). Variables are unnamed, y is an
+    # IndexedVariables instead of a dict of tuple keys and handles, and every row over y is written to the
+    # proto from variable indices as it is generated.
+    if formulation not in ('standard', 'aggregated'):
+        raise ValueError(f"Unknown formulation: {formulation}")
+    if formulation == 'aggregated' and capacity_literals is not None:
+        raise ValueError("capacity_literals need the standard formulation")
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    model = cp_model.CpModel()
+    proto = model.Proto()
+
+    x = {}
+    with phase(phases, 'preference_variables', model):
+        for i in range(len(students)):
+            for k in range(len(preferences[i])):
+                x[i, k] = model.NewBoolVar('')
+
+    z = {}
+    with phase(phases, 'section_variables', model):
+        for c in range(len(courses)):
+            for s in range(sections[c]):
+                for t in domains[c]:
+                    z[c, s, t] = model.NewBoolVar('')
+
+    student_courses, course_students = index_requested_courses(len(students), len(courses), preferences)
+    y = IndexedVariables(model, sections, domains)
+    with phase(phases, 'student_section_variables', model):
+        for i in range(len(students)):
+            for c in student_courses[i]:
+                y.add(i, c)
+
+    if formulation == 'standard':
+        with phase(phases, 'section_links', model):
+            for (i, c), start in y.starts.items():
+                for s in range(sections[c]):
+                    for p, t in enumerate(domains[c]):
+                        link = proto.constraints.add()
+                        link.enforcement_literal.append(start + s * len(domains[c]) + p)
+                        link.bool_and.literals.append(z[c, s, t].Index())
+
+    add_section_constraints(model, z, sections, domains, symmetry_breaking, phases)
+
+    with phase(phases, 'capacity', model):
+        for c in range(len(courses)):
+            if capacity_literals is not None and course_students[c]:
+                capacity_literals[c] = model.NewBoolVar(f'capacity[{c}]')
+            for s in range(sections[c]):
+                if course_students[c] and formulation == 'aggregated':
+                    for t in domains[c]:
+                        seats = [y.index(i, c, s, t) for i in course_students[c]]
+                        add_linear_row(proto, seats + [z[c, s, t].Index()], -section_capacity[c], 0,
+                                       [1] * len(seats) + [-section_capacity[c]])
+                elif course_students[c]:
+                    add_linear_row(proto, (index for i in course_students[c] for index in y.section_indices(i, c, s)),
+                                   0, section_capacity[c],
+                                   enforcement=[capacity_literals[c].Index()] if capacity_literals is not None else ())
+
+    with phase(phases, 'one_preference_set', model):
+        for i in range(len(students)):
+            model.AddAtMostOne(x[i, k] for k in range(len(preferences[i])))
+
+    with phase(phases, 'student_overlap', model):
+        for i in range(len(students)):
+            blocks = [[] for _ in range(total_blocks)]
+            for c in student_courses[i]:
+                for s in range(sections[c]):
+                    for index, t in zip(y.section_indices(i, c, s), domains[c]):
+                        blocks[t].append(index)
+            for literals in blocks:
+                proto.constraints.add().at_most_one.literals.extend(literals)
+
+    with phase(phases, 'preference_set_rows', model):
+        for i in range(len(students)):
+            total_courses = [index for c in student_courses[i] for index in y.course_indices(i, c)]
+            for k in range(len(preferences[i])):
+                chosen = x[i, k].Index()
+                if formulation == 'standard':
+                    add_linear_row(proto, total_courses, len(preferences[i][k]), len(preferences[i][k]),
+                                   enforcement=[chosen])
+                elif len(preferences[i][k]) != len(preferences[i]):
+                    add_linear_row(proto, [chosen], 0, 0)
+                for c in preferences[i][k]:
+                    section_time_assignments = list(y.course_indices(i, c - 1))
+                    if formulation == 'standard':
+                        proto.constraints.add().at_most_one.literals.extend(section_time_assignments)
+                    proto.constraints.add().bool_or.literals.extend(section_time_assignments + [-chosen - 1])
+            if formulation == 'aggregated':
+                for c in student_courses[i]:
+                    proto.constraints.add().at_most_one.literals.extend(y.course_indices(i, c))
+            add_linear_row(proto, total_courses, len(preferences[i]), len(preferences[i]))
+
+    with phase(phases, 'objective', model):
+        set_objective(model, x, preferences, maximize, objective)
+
+    return model, x, y, z, student_courses
+
+
+def extract_solution(values, students, x, y, z):
+    # values is the whole solution vector read in bulk, only variables set to 1 are turned back into keys.
+    # Keys were created in (student, course, section, block) order, so schedules stay sorted by course.
+    values = np.asarray(values)
+
+    def set_keys(variables):
+        if isinstance(variables, IndexedVariables):
+            return variables.set_keys(values)
+        keys = list(variables)
+        indices = np.fromiter((var.Index() for var in variables.values()), dtype=np.int64, count=len(keys))
+        return [keys[j] for j in np.flatnonzero(values[indices])]
+
+    schedule = {student: [] for student in students}
+    for i, c, s, t in set_keys(y):
+        schedule[students[i]].append({
+            'course': c+1,
+            'section': s+1,
+            'time_block': t+1
+        })
+    preference_sets = {student: None for student in students}
+    for i, k in set_keys(x):
+        preference_sets[students[i]] = k+1
+    section_blocks = {}
+    for c, s, t in set_keys(z):
+        section_blocks.setdefault(c+1, {})[s+1] = t+1
+    return schedule, preference_sets, section_blocks
+
+
+def split_group_blocks(counts, group_size, total_blocks, num_courses=None):
+    # Split a group's course x block counts into one course -> block assignment per member. Column sums are
+    # at most group_size, row sums are at most group_size and add up to group_size * num_courses; with
+    # num_courses=None every row sum is group_size and every member takes every course. Skip columns soak
+    # up the seats members leave in a course and dummy rows the unused blocks, which gives a
+    # group_size-regular bipartite multigraph. Such a graph always has a perfect matching, so peeling one
+    # matching per member always succeeds, and each member gets num_courses courses in distinct blocks.
+    if group_size == 0:
+        return []
+    group_courses = list(counts)
+    num_courses = len(group_courses) if num_courses is None else num_courses
+    width = total_blocks + len(group_courses) - num_courses
+    rows = [list(counts[c]) + [0] * (width - total_blocks) for c in group_courses]
+    column, load = total_blocks, 0
+    for row in rows:
+        missing = group_size - sum(row)
+        while missing > 0:
+            take = min(missing, group_size - load)
+            row[column] += take
+            missing -= take
+            load += take
+            if load == group_size:
+                column, load = column + 1, 0
+    deficits = [group_size - sum(row[t] for row in rows) for t in range(total_blocks)]
+    for _ in range(total_blocks - num_courses):
+        row = [0] * width
+        needed = group_size
+        for t in range(total_blocks):
+            take = min(needed, deficits[t])
+            row[t] += take
+            deficits[t] -= take
+            needed -= take
+        rows.append(row)
+
+    assignments = []
+    for _ in range(group_size):
+        match_of_column = [-1] * width
+
+        def augment(r, visited):
+            for t in range(width):
+                if rows[r][t] > 0 and not visited[t]:
+                    visited[t] = True
+                    if match_of_column[t] == -1 or augment(match_of_column[t], visited):
+                        match_of_column[t] = r
+                        return True
+            return False
+
+        for r in range(len(rows)):
+            augment(r, [False] * width)
+        assignment = {}
+        for t, r in enumerate(match_of_column):
+            rows[r][t] -= 1
+            if r < len(group_courses) and t < total_blocks:
+                assignment[group_courses[r]] = t
+        assignments.append(assignment)
+    return assignments
+
+
+def profile_groups(preferences):
+    # Students with identical preference lists are interchangeable, groups[g] = (preference sets, members)
+    members = {}
+    for i, student_preferences in enumerate(preferences):
+        members.setdefault(tuple(map(tuple, student_preferences)), []).append(i)
+    return [([list(preference_set) for preference_set in profile], group_members)
+            for profile, group_members in members.items()]
+
+
+def build_grouped_schedule_model(students, courses, preferences, sections, section_capacity, maximize=1,
+                                 objective='first_choices', time_grid=None, allowed_blocks=None,
+                                 capacity_literals=None, phases=None):
+    # Same schedules as build_course_schedule_model, with the students of each profile group modeled together:
+    #   x[g, k]        members of group g placed in their (k+1)-th preference set
+    #   y[g, o, c, t]  members of group g with option o taking course c at time block t, where option k < K
+    #                  is preference set k and option K (K sets) is no preference set at all
+    #   z[c, t]        a section of course c is scheduled at time block t, sections numbered by block
+    # Counts are split per option so that extract_grouped_solution can always split them back into
+    # members: members placed in a set all take the same courses, and split_group_blocks handles the
+    # members taking any requested courses. Model size grows with the number of distinct profiles instead of students.
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    groups = profile_groups(preferences)
+    profiles = [profile for profile, members in groups]
+    group_courses, course_groups = index_requested_courses(len(groups), len(courses), profiles)
+    model = cp_model.CpModel()
+
+    # At most one section of a course per block, so a course has at most as many open blocks as sections
+    z = {}
+    with phase(phases, 'section_variables', model):
+        for c in range(len(courses)):
+            for t in domains[c]:
+                z[c, t] = model.NewBoolVar(f'z[{c},{t}]')
+            model.Add(sum(z[c, t] for t in domains[c]) <= sections[c])
+
+    x = {}
+    y = {}
+    seats = {}
+    with phase(phases, 'group_rows', model):
+        for g, (profile, members) in enumerate(groups):
+            num_sets = len(profile)
+            for k in range(num_sets):
+                # As in build_course_schedule_model, where a placed set is exactly the courses taken, only a set
+                # with len(preferences[i]) courses can be placed
+                x[g, k] = model.NewIntVar(0, len(members) if len(profile[k]) == num_sets else 0, f'x[{g},{k}]')
+            model.Add(sum(x[g, k] for k in range(num_sets)) <= len(members))
+            for o in range(num_sets + 1):
+                if o < num_sets and len(profile[o]) != num_sets:
+                    continue
+                chosen = x[g, o] if o < num_sets else len(members) - sum(x[g, k] for k in range(num_sets))
+                required = {c - 1 for c in profile[o]} if o < num_sets else set()
+                option_courses = sorted(required) if o < num_sets else group_courses[g]
+                for c in option_courses:
+                    for t in domains[c]:
+                        y[g, o, c, t] = model.NewIntVar(0, len(members), f'y[{g},{o},{c},{t}]')
+                        seats.setdefault((c, t), []).append(y[g, o, c, t])
+                    # Every member takes each course of their set, any other course at most once
+                    taken = sum(y[g, o, c, t] for t in domains[c])
+                    if c in required:
+                        model.Add(taken == chosen)
+                    else:
+                        model.Add(taken <= chosen)
+                # Students can only take one course during each time block, and len(preferences[i]) courses in all
+                for t in range(total_blocks):
+                    model.Add(sum(y[g, o, c, t] for c in option_courses if (g, o, c, t) in y) <= chosen)
+                model.Add(sum(y[g, o, c, t] for c in option_courses for t in domains[c]) == num_sets * chosen)
+
+    # Course capacities, seats are only available in blocks where the course has a section.
+    # Given a capacity_literals dict, the capacity rows of course c are only enforced by capacity_literals[c].
+    with phase(phases, 'capacity', model):
+        for c in range(len(courses)):
+            if capacity_literals is not None and course_groups[c]:
+                capacity_literals[c] = model.NewBoolVar(f'capacity[{c}]')
+            for t in domains[c]:
+                if (c, t) in seats:
+                    model.Add(sum(seats[c, t]) == 0).OnlyEnforceIf(z[c, t].Not())
+                    capacity = model.Add(sum(seats[c, t]) <= section_capacity[c])
+                    if capacity_literals is not None:
+                        capacity.OnlyEnforceIf(capacity_literals[c])
+
+    # Objective, over the groups' counts with the weights of the whole student body
+    with phase(phases, 'objective', model):
+        set_objective(model, x, profiles, maximize, objective, len(students))
+
+    return model, x, y, z, groups
+
+
+def extract_grouped_solution(values, students, groups, x, y, z, total_blocks):
+    # Counts of build_grouped_schedule_model turned back into one schedule per student, in the same form
+    # as extract_solution. Members of a group are handed their option and courses in member order.
+    values = np.asarray(values)
+    course_blocks = {}
+    for (c, t), var in z.items():
+        if values[var.Index()]:
+            course_blocks.setdefault(c, []).append(t)
+    section_of_block = {(c, t): s for c in course_blocks for s, t in enumerate(sorted(course_blocks[c]))}
+    counts = {}
+    for (g, o, c, t), var in y.items():
+        if values[var.Index()]:
+            counts.setdefault((g, o), {}).setdefault(c, [0] * total_blocks)[t] = int(values[var.Index()])
+
+    schedule = {student: [] for student in students}
+    preference_sets = {student: None for student in students}
+    for g, (profile, members) in enumerate(groups):
+        sizes = [int(values[x[g, k].Index()]) for k in range(len(profile))]
+        sizes.append(len(members) - sum(sizes))
+        start = 0
+        for o, size in enumerate(sizes):
+            option_members = members[start:start + size]
+            start += size
+            assignments = split_group_blocks(counts.get((g, o), {}), size, total_blocks, len(profile))
+            for i, assignment in zip(option_members, assignments):
+                schedule[students[i]] = [{
+                    'course': c+1,
+                    'section': section_of_block[c, t]+1,
+                    'time_block': t+1
+                } for c, t in sorted(assignment.items())]
+                preference_sets[students[i]] = o+1 if o < len(profile) else None
+    section_blocks = {c+1: {s+1: t+1 for s, t in enumerate(sorted(course_blocks[c]))} for c in sorted(course_blocks)}
+    return schedule, preference_sets, section_blocks
+
+
+def add_schedule_hint(model, x, y, z, students, hint):
+    # Starts the search from the schedule of an earlier result, for example one of engine='lns'.
+    # Every variable is hinted, the ones the hint does not set to 1 are hinted to 0.
+    index = {student: i for i, student in enumerate(students)}
+    taken = {(index[student], entry['course']-1, entry['section']-1, entry['time_block']-1)
+             for student, entries in hint['schedule'].items() for entry in entries}
+    chosen = {(index[student], k-1) for student, k in hint['preference_sets'].items() if k is not None}
+    opened = {(course-1, section-1, block-1) for course, blocks in hint['section_blocks'].items()
+              for section, block in blocks.items()}
+    model.ClearHints()
+    for variables, ones in ((x, chosen), (y, taken), (z, opened)):
+        for key, var in variables.items():
+            model.AddHint(var, key in ones)
+
+
+class ImprovingSolutionCallback(cp_model.CpSolverSolutionCallback):
+    # Hands every improving schedule found during the search to on_solution as a 'FEASIBLE' result
+    # extract(values) turns a solution vector into (schedule, preference_sets, section_blocks)
+    def __init__(self, on_solution, students, preferences, extract, statistics):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self.on_solution = on_solution
+        self.students = students
+        self.preferences = preferences
+        self.extract = extract
+        self.statistics = statistics
+
+    def on_solution_callback(self):
+        statistics = dict(self.statistics, solve_time=self.WallTime(), objective=self.ObjectiveValue(),
+                          best_bound=self.BestObjectiveBound())
+        self.on_solution(schedule_result('FEASIBLE', self.students, self.preferences,
+                                         *self.extract(self.Response().solution), statistics=statistics))
+
+
+def solve_lexicographically(model, solver, x, y, z, preferences, statistics, callback=None):
+    # Successive solves that reuse the same model: maximize the first preference level, fix it at the value
+    # found as a constraint, then move on to the next level with the previous solution as a hint.
+    # Returns the overall status and the solution vector of the last successful solve.
+    time_limit = solver.parameters.max_time_in_seconds
+    deadline = time.monotonic() + time_limit
+    status, values, level_objectives = cp_model.UNKNOWN, None, []
+    all_optimal = True
+    for level in preference_levels(x, preferences):
+        model.Maximize(level)
+        if values is not None:
+            model.ClearHints()
+            for variables in (x, y, z):
+                for var in variables.values():
+                    model.AddHint(var, values[var.Index()])
+        solver.parameters.max_time_in_seconds = max(0.0, deadline - time.monotonic())
+        level_status = solver.Solve(model, callback)
+        record_solver(statistics, solver, level_status)
+        if level_status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            break
+        status = level_status
+        all_optimal = all_optimal and level_status == cp_model.OPTIMAL
+        values = list(solver.ResponseProto().solution)
+        level_objectives.append(int(solver.ObjectiveValue()))
+        statistics['objective'] = solver.ObjectiveValue()
+        statistics['best_bound'] = solver.BestObjectiveBound()
+        model.Add(level >= level_objectives[-1])
+    solver.parameters.max_time_in_seconds = time_limit
+    statistics['level_objectives'] = level_objectives
+    if values is not None and not (all_optimal and len(level_objectives) == len(preference_levels(x, preferences))):
+        status = cp_model.FEASIBLE
+    return status, values
+
+
+def solve_course_schedule(students, courses, preferences, sections, section_capacity, maximize=1,
+                          num_workers=0, time_limit=None, log_search=False, symmetry_breaking=True, verbose=False,
+                          gap_limit=None, on_solution=None, objective='first_choices', cache=None, time_grid=None,
+                          allowed_blocks=None, hint=None, group_profiles=False, formulation='standard', lean=False):
+    # With group_profiles, students with identical preference lists are modeled together by
+    # build_grouped_schedule_model, which finds the same optimum with a model sized by the distinct profiles.
+    # lean=True builds the same model with build_lean_course_schedule_model, in about half the memory.
+    if group_profiles and hint is not None:
+        raise ValueError("A hint cannot be combined with group_profiles")
+    if group_profiles and lean:
+        raise ValueError("A lean build cannot be combined with group_profiles")
+    build_model = build_lean_course_schedule_model if lean else build_course_schedule_model
+    # Too many students and preference levels for the weights, the levels are maximized one after the other
+    if objective == 'weighted' and not weights_fit(len(students), max(map(len, preferences), default=0)):
+        objective = 'lexicographic'
+    # Wall time and memory of every phase, and rows of every constraint family, see Metrics.phase
+    phases = {}
+    build_start = time.perf_counter()
+    # With a ScheduleCache the constraints are only built once per set of inputs, a cached model is
+    # reused as is under any objective mode
+    cached = None
+    if cache is not None:
+        key = cache_key('grouped-model' if group_profiles else 'model', students, courses, preferences, sections,
+                        section_capacity, symmetry_breaking, time_domain_key(time_grid, allowed_blocks),
+                        None if group_profiles else formulation)
+        with phase(phases, 'model_cache'):
+            cached = cache.load_model(key)
+    groups = profile_groups(preferences) if group_profiles else None
+    if cached is None:
+        if group_profiles:
+            model, x, y, z, groups = build_grouped_schedule_model(students, courses, preferences, sections,
+                                                                  section_capacity, maximize, objective, time_grid,
+                                                                  allowed_blocks, phases=phases)
+        else:
+            model, x, y, z, student_courses = build_model(students, courses, preferences, sections, section_capacity,
+                                                          maximize, symmetry_breaking, objective, time_grid,
+                                                          allowed_blocks, formulation=formulation, phases=phases)
+        if cache is not None:
+            with phase(phases, 'model_cache'):
+                cache.save_model(key, model, x, y, z)
+    else:
+        model, x, y, z = cached
+    # x counts the students of each group in the grouped model, the levels are summed over the groups' profiles
+    level_preferences = [profile for profile, members in groups] if group_profiles else preferences
+    if cached is not None:
+        with phase(phases, 'objective', model):
+            set_objective(model, x, level_preferences, maximize, objective, len(students))
+
+    total_blocks = len((time_grid or default_time_grid()).blocks)
+
+    def extract(values):
+        if group_profiles:
+            return extract_grouped_solution(values, students, groups, x, y, z, total_blocks)
+        return extract_solution(values, students, x, y, z)
+    if hint is not None:
+        with phase(phases, 'hint'):
+            add_schedule_hint(model, x, y, z, students, hint)
+    build_time = time.perf_counter() - build_start
+    statistics = model_statistics(build_time, 0.0, len(model.Proto().variables), len(model.Proto().constraints))
+    statistics['phases'] = phases
+
+    # Solver parameters, num_workers=0 lets CP-SAT use every available core.
+    # The search stops at time_limit seconds or once the relative gap to the bound is below gap_limit,
+    # keeping the best schedule found so far.
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = num_workers
+    solver.parameters.log_search_progress = log_search
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = time_limit
+    if gap_limit is not None:
+        solver.parameters.relative_gap_limit = gap_limit
+    callback = None
+    if on_solution is not None:
+        callback = ImprovingSolutionCallback(on_solution, students, preferences, extract, statistics)
+
+    # Solve
+    solve_start = time.perf_counter()
+    with phase(phases, 'solve'):
+        if objective == 'lexicographic':
+            status, values = solve_lexicographically(model, solver, x, y, z, level_preferences, statistics, callback)
+        else:
+            status = solver.Solve(model, callback)
+            record_solver(statistics, solver, status)
+            values = solver.ResponseProto().solution
+            if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                statistics['objective'] = solver.ObjectiveValue()
+                statistics['best_bound'] = solver.BestObjectiveBound()
+    statistics['solve_time'] = time.perf_counter() - solve_start
+    if status == cp_model.MODEL_INVALID:
+        raise ValueError(f"CP-SAT rejected the model: {model.Validate()}")
+
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        # A search stopped by gap_limit also reports OPTIMAL, only a closed gap is called optimal here
+        optimal = status == cp_model.OPTIMAL and statistics['objective'] == statistics['best_bound']
+        with phase(phases, 'extract'):
+            solution = extract(values)
+        result = schedule_result('OPTIMAL' if optimal else 'FEASIBLE', students, preferences, *solution,
+                                 statistics=statistics)
+    elif status == cp_model.INFEASIBLE:
+        # Rebuilt with every course capacity behind an assumption literal to name the courses short of seats,
+        # in the standard formulation whose capacity rows can be switched off
+        explain_start = time.perf_counter()
+        capacity_literals = {}
+        with phase(phases, 'explain'):
+            if group_profiles:
+                model = build_grouped_schedule_model(students, courses, preferences, sections, section_capacity,
+                                                     maximize, objective, time_grid, allowed_blocks,
+                                                     capacity_literals)[0]
+            else:
+                model = build_model(students, courses, preferences, sections, section_capacity, maximize,
+                                    symmetry_breaking, objective, time_grid, allowed_blocks, capacity_literals)[0]
+            seats = course_seats(courses, sections, section_capacity,
+                                 course_block_domains(courses, time_grid or default_time_grid(), allowed_blocks))
+            conflicts = explain_infeasibility(model, capacity_literals, courses, seats, preferences, num_workers,
+                                              time_limit)
+        statistics['explain_time'] = time.perf_counter() - explain_start
+        result = schedule_result('NOT OPTIMAL', students, preferences, statistics=statistics, conflicts=conflicts)
+    else:
+        result = schedule_result('NOT OPTIMAL', students, preferences, statistics=statistics)
+    if verbose:
+        print_solution(result)
+    return result
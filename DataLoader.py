@@ -0,0 +1,42 @@
+import json
+
+# classes to represent Student-preferences 
+class Student:
+    def __init__(self, studentId, terms):
+        self.studentId = studentId
+        self.terms = [Term(**term) for term in terms]
+
+class Term:
+    def __init__(self, termId, coursesPreferences):
+        self.termId = termId
+        self.coursesPreferences = coursesPreferences
+
+# classes to represent Courses
+class Course:
+    def __init__(self, id, name, code, maxSeats, maxSections):
+        self.id = id
+        self.name = name
+        self.code = code
+        self.maxSeats = maxSeats
+        self.maxSections = maxSections
+
+# each section of a course should be treated separately, 
+# just add a check so that no two sections of the same course are scheduled at the same time
+class Section:
+    def __init__(self, id, courseId, maxSeats):
+        self.id = id
+        self.courseId = courseId
+        self.maxSeats = maxSeats
+        self.currSeats = 0
+
+# Function to load students
+def load_students(filename):
+    with open(filename, 'r') as file:
+        data = json.load(file)
+    return [Student(**student) for student in data]
+
+# Function to load courses
+def load_courses(filename):
+    with open(filename, 'r') as file:
+        data = json.load(file)
+    return [Course(**course) for course in data]
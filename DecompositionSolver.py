@@ -0,0 +1,330 @@
+import time
+
+from ortools.sat.python import cp_model
+
+from CpSatSolver import preference_levels, lexicographic_weights, weights_fit, solve_lexicographically, \
+    split_group_blocks
+from Metrics import phase, record_solver, merge_solver
+from ScheduleResult import schedule_result, print_solution, model_statistics
+from TimeGrid import default_time_grid, course_block_domains
+
+
+def record_model(statistics, model, build_time, solve_time):
+    # Accumulate the build/solve time and size of every model solved by the decomposition
+    if statistics is not None:
+        statistics['build_time'] += build_time
+        statistics['solve_time'] += solve_time
+        statistics['num_variables'] += len(model.Proto().variables)
+        statistics['num_constraints'] += len(model.Proto().constraints)
+
+
+def select_preference_sets(students, courses, preferences, sections, section_capacity, maximize=1, cuts=(),
+                           num_workers=0, time_limit=None, statistics=None, gap_limit=None,
+                           objective='first_choices'):
+    # Phase 1: aggregate model choosing one preference set per student,
+    # with the course capacity implied by sections[c] * section_capacity[c]
+    build_start = time.perf_counter()
+    model = cp_model.CpModel()
+
+    x = {}
+    for i in range(len(students)):
+        for k in range(len(preferences[i])):
+            x[i, k] = model.NewBoolVar(f'x[{i},{k}]')
+        # Every student is given exactly one of their preference sets
+        model.AddExactlyOne(x[i, k] for k in range(len(preferences[i])))
+
+    # Seats demanded for each course by the chosen preference sets
+    demand = [[] for _ in range(len(courses))]
+    for i in range(len(students)):
+        for k in range(len(preferences[i])):
+            for c in preferences[i][k]:
+                demand[c-1].append(x[i, k])
+
+    # Course capacities
+    for c in range(len(courses)):
+        if demand[c]:
+            model.Add(sum(demand[c]) <= sections[c] * section_capacity[c])
+
+    # Feedback cuts from phase 2, lower the combined demand of a set of courses that could not be timetabled
+    for cut_courses, bound in cuts:
+        model.Add(sum(lit for c in cut_courses for lit in demand[c]) <= bound)
+
+    # Objective
+    # Maximize the total number of students attending one of their first `maximize` preferred sets of courses,
+    # or first-choice placements, then second-choice and so on. The phase 1 model is small, so the
+    # lexicographic order is solved in one go through the equivalent weighted objective whenever the
+    # weights fit CP-SAT's integer range, and level by level otherwise.
+    successive = False
+    if objective == 'first_choices':
+        model.Maximize(sum(x[i, k] for i in range(len(students)) for k in range(min(maximize, len(preferences[i])))))
+    elif objective in ('weighted', 'lexicographic'):
+        levels = preference_levels(x, preferences)
+        successive = not weights_fit(len(students), len(levels))
+        if not successive:
+            model.Maximize(sum(w * level for w, level in zip(lexicographic_weights(len(students), len(levels)),
+                                                             levels)))
+    else:
+        raise ValueError(f"Unknown objective: {objective}")
+
+    build_time = time.perf_counter() - build_start
+
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = num_workers
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = time_limit
+    if gap_limit is not None:
+        solver.parameters.relative_gap_limit = gap_limit
+    solve_start = time.perf_counter()
+    if successive:
+        level_statistics = {}
+        status, values = solve_lexicographically(model, solver, x, {}, {}, preferences, level_statistics)
+        objective_value, best_bound = level_statistics.get('objective'), level_statistics.get('best_bound')
+        if statistics is not None:
+            merge_solver(statistics, level_statistics)
+    else:
+        status = solver.Solve(model)
+        record_solver(statistics, solver, status)
+        values = solver.ResponseProto().solution
+        objective_value, best_bound = solver.ObjectiveValue(), solver.BestObjectiveBound()
+    record_model(statistics, model, build_time, time.perf_counter() - solve_start)
+    if status == cp_model.MODEL_INVALID:
+        raise ValueError(f"CP-SAT rejected the model: {model.Validate()}")
+
+    chosen = None
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        if objective_value != best_bound:
+            status = cp_model.FEASIBLE
+        if statistics is not None:
+            statistics['objective'] = objective_value
+            statistics['best_bound'] = best_bound
+        chosen = [next(k for k in range(len(preferences[i])) if values[x[i, k].Index()])
+                  for i in range(len(students))]
+    return status, chosen
+
+
+def match_courses_to_blocks(student_courses, course_blocks, seats_left, total_blocks):
+    # Assign every course of a student to a distinct time block with a free seat (bipartite matching),
+    # trying the emptiest sections first. Returns None when no such assignment exists.
+    match_of_block = [-1] * total_blocks
+
+    def augment(c, visited):
+        for t in sorted(course_blocks[c], key=lambda t: -seats_left[c, t]):
+            if seats_left[c, t] > 0 and not visited[t]:
+                visited[t] = True
+                if match_of_block[t] == -1 or augment(match_of_block[t], visited):
+                    match_of_block[t] = c
+                    return True
+        return False
+
+    for c in student_courses:
+        if not augment(c, [False] * total_blocks):
+            return None
+    return {c: t for t, c in enumerate(match_of_block) if c != -1}
+
+
+def place_sections(courses, sections, section_capacity, groups, total_blocks, domains=None):
+    # Place sections of the most demanded courses first, each into the block where it clashes with the fewest
+    # students who also requested an already placed course. Returns the sorted blocks of every course.
+    domains = domains or [range(total_blocks)] * len(courses)
+    demand = [0] * len(courses)
+    co_demand = [dict() for _ in range(len(courses))]
+    for group_courses, members in groups:
+        for c in group_courses:
+            demand[c] += len(members)
+            for d in group_courses:
+                if d != c:
+                    co_demand[c][d] = co_demand[c].get(d, 0) + len(members)
+
+    course_blocks = {c: [] for c in range(len(courses))}
+    block_clash = [dict() for _ in range(total_blocks)]
+    block_load = [0] * total_blocks
+    for c in sorted(range(len(courses)), key=lambda c: -demand[c]):
+        if demand[c] == 0:
+            continue
+        for s in range(min(sections[c], len(domains[c]))):
+            t = min((t for t in domains[c] if t not in course_blocks[c]),
+                    key=lambda t: (block_clash[t].get(c, 0), block_load[t]))
+            course_blocks[c].append(t)
+            block_load[t] += section_capacity[c]
+            for d, count in co_demand[c].items():
+                block_clash[t][d] = block_clash[t].get(d, 0) + count / sections[c]
+        course_blocks[c].sort()
+    return course_blocks
+
+
+def greedy_timetable(courses, sections, section_capacity, groups, total_blocks, domains=None):
+    # Sections go where place_sections puts them, then students are seated one by one with a matching
+    course_blocks = place_sections(courses, sections, section_capacity, groups, total_blocks, domains)
+    seats_left = {(c, t): section_capacity[c] for c in course_blocks for t in course_blocks[c]}
+    student_blocks = {}
+    # Students whose courses have the fewest sections are the hardest to seat, so they go first
+    for group_courses, members in sorted(groups, key=lambda group: sum(len(course_blocks[c]) for c in group[0])):
+        for i in members:
+            assignment = match_courses_to_blocks(group_courses, course_blocks, seats_left, total_blocks)
+            if assignment is None:
+                continue
+            for c, t in assignment.items():
+                seats_left[c, t] -= 1
+            student_blocks[i] = assignment
+    return course_blocks, student_blocks
+
+
+def timetable_preference_sets(courses, sections, section_capacity, groups, total_blocks,
+                              num_workers=0, time_limit=None, statistics=None, domains=None):
+    # Phase 2: place sections into time blocks and seat students given the fixed preference sets.
+    # A greedy pass settles most inputs outright, otherwise it is used as a hint for the exact model below.
+    domains = domains or [range(total_blocks)] * len(courses)
+    greedy_start = time.perf_counter()
+    course_blocks, student_blocks = greedy_timetable(courses, sections, section_capacity, groups, total_blocks,
+                                                     domains)
+    if statistics is not None:
+        statistics['solve_time'] += time.perf_counter() - greedy_start
+    if len(student_blocks) == sum(len(members) for group_courses, members in groups):
+        return cp_model.FEASIBLE, (course_blocks, student_blocks)
+
+    # Students with the same chosen courses are interchangeable, so each group of them is modeled with
+    # integer counts m[g, c, t] of group members taking course c at time block t.
+    build_start = time.perf_counter()
+    model = cp_model.CpModel()
+
+    # open_block[c, t] = 1 if a section of course c is scheduled at time block t,
+    # at most one section of a course per block so the section index is implied by the block
+    open_block = {}
+    for c in range(len(courses)):
+        for t in domains[c]:
+            open_block[c, t] = model.NewBoolVar(f'open[{c},{t}]')
+            model.AddHint(open_block[c, t], t in course_blocks[c])
+        model.Add(sum(open_block[c, t] for t in domains[c]) <= sections[c])
+
+    m = {}
+    course_seats = [[[] for _ in range(total_blocks)] for _ in range(len(courses))]
+    for g, (group_courses, members) in enumerate(groups):
+        for c in group_courses:
+            for t in domains[c]:
+                m[g, c, t] = model.NewIntVar(0, len(members), f'm[{g},{c},{t}]')
+                model.AddHint(m[g, c, t], sum(1 for i in members if student_blocks.get(i, {}).get(c) == t))
+                course_seats[c][t].append(m[g, c, t])
+        # Students can only take one course during each time block
+        for t in range(total_blocks):
+            model.Add(sum(m[g, c, t] for c in group_courses if (g, c, t) in m) <= len(members))
+
+    # Section capacities, seats are only available in blocks where the course has a section
+    for c in range(len(courses)):
+        for t in domains[c]:
+            if course_seats[c][t]:
+                model.Add(sum(course_seats[c][t]) <= section_capacity[c] * open_block[c, t])
+            else:
+                model.Add(open_block[c, t] == 0)
+
+    # Every group member takes every course of the group, guarded by one assumption literal per course
+    # so an infeasible timetable can be explained by the courses that cannot be seated together
+    seated = {}
+    for c in range(len(courses)):
+        seated[c] = model.NewBoolVar(f'seated[{c}]')
+    for g, (group_courses, members) in enumerate(groups):
+        for c in group_courses:
+            model.Add(sum(m[g, c, t] for t in domains[c]) == len(members)).OnlyEnforceIf(seated[c])
+    model.AddAssumptions(seated.values())
+    build_time = time.perf_counter() - build_start
+
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = num_workers
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = time_limit
+    # The full LP relaxation proves counting (pigeonhole) infeasibilities that clause learning alone cannot
+    solver.parameters.linearization_level = 2
+    solve_start = time.perf_counter()
+    status = solver.Solve(model)
+    record_solver(statistics, solver, status)
+    record_model(statistics, model, build_time, time.perf_counter() - solve_start)
+
+    if status == cp_model.INFEASIBLE:
+        core = solver.SufficientAssumptionsForInfeasibility()
+        index_to_course = {seated[c].Index(): c for c in seated}
+        return status, sorted(index_to_course[index] for index in core if index in index_to_course)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return status, None
+
+    course_blocks = {c: [t for t in domains[c] if solver.BooleanValue(open_block[c, t])]
+                     for c in range(len(courses))}
+    student_blocks = {}
+    for g, (group_courses, members) in enumerate(groups):
+        counts = {c: [solver.Value(m[g, c, t]) if (g, c, t) in m else 0 for t in range(total_blocks)]
+                  for c in group_courses}
+        student_blocks.update(zip(members, split_group_blocks(counts, len(members), total_blocks)))
+    return status, (course_blocks, student_blocks)
+
+
+def decomposed_course_schedule(students, courses, preferences, sections, section_capacity, maximize=1,
+                               num_workers=0, time_limit=None, max_iterations=10, verbose=False,
+                               gap_limit=None, on_solution=None, objective='first_choices', time_grid=None,
+                               allowed_blocks=None):
+    # Unlike the cp_sat and linear models, which have every student take len(preferences[i]) of their
+    # requested courses (so a set is only ever fully placed when its size equals the number of sets),
+    # this engine places every student in exactly one whole preference set. The two can disagree on the
+    # same input: three students with [[1], [2]] and two seats per course are infeasible for cp_sat
+    # (six seats needed, four offered) but fine here (three seats needed).
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    # A course never has more sections than blocks it can be scheduled in
+    sections = [min(sections[c], len(domains[c])) for c in range(len(courses))]
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    cuts = []
+    statistics = model_statistics()
+    statistics['phases'] = {}
+    result = schedule_result('NOT OPTIMAL', students, preferences, statistics=statistics)
+
+    for iteration in range(max_iterations):
+        with phase(statistics['phases'], 'selection'):
+            phase1_status, chosen = select_preference_sets(students, courses, preferences, sections,
+                                                           section_capacity, maximize, cuts, num_workers,
+                                                           remaining(), statistics, gap_limit, objective)
+        if chosen is None:
+            break
+
+        # Group students by their chosen courses, members of a group are interchangeable in phase 2
+        members_by_courses = {}
+        for i in range(len(students)):
+            key = tuple(sorted(c - 1 for c in preferences[i][chosen[i]]))
+            members_by_courses.setdefault(key, []).append(i)
+        groups = list(members_by_courses.items())
+
+        with phase(statistics['phases'], 'timetable'):
+            phase2_status, timetable = timetable_preference_sets(courses, sections, section_capacity, groups,
+                                                                 total_blocks, num_workers, remaining(),
+                                                                 statistics, domains)
+        if phase2_status == cp_model.INFEASIBLE:
+            # Feedback cut: the courses in the infeasible core must carry fewer seats than they do now
+            core = timetable or sorted({c for group_courses, members in groups for c in group_courses})
+            load = sum(len(members) for group_courses, members in groups for c in group_courses if c in core)
+            cuts.append((core, load - 1))
+            if verbose:
+                print(f"Iteration {iteration+1}: timetabling infeasible for courses {[c+1 for c in core]}, adding cut")
+            continue
+        if timetable is None:
+            break
+
+        course_blocks, student_blocks = timetable
+        section_of_block = {(c, t): s for c in course_blocks for s, t in enumerate(course_blocks[c])}
+        schedule = {students[i]: [{
+            'course': c+1,
+            'section': section_of_block[c, t]+1,
+            'time_block': t+1
+        } for c, t in sorted(student_blocks[i].items())] for i in range(len(students))}
+        preference_sets = {students[i]: chosen[i]+1 for i in range(len(students))}
+        section_blocks = {c+1: {s+1: t+1 for s, t in enumerate(course_blocks[c])} for c in course_blocks if course_blocks[c]}
+        status = 'OPTIMAL' if phase1_status == cp_model.OPTIMAL and not cuts else 'FEASIBLE'
+        result = schedule_result(status, students, preferences, schedule, preference_sets, section_blocks,
+                                 statistics)
+        if on_solution is not None:
+            on_solution(result)
+        break
+
+    if verbose:
+        print_solution(result)
+    return result
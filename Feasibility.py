@@ -0,0 +1,116 @@
+import time
+
+from ortools.sat.python import cp_model
+
+from TimeGrid import default_time_grid, course_block_domains
+
+EXPLAIN_TIME_LIMIT = 60.0  # seconds spent at most on explaining an infeasible model
+
+# A conflict is a dict naming the constraint that cannot be met:
+#   {'constraint': 'capacity', 'courses': [...], 'demand': n, 'seats': m}   seats of these courses run out,
+#                                      demand is the least number of seats the students need in these courses
+#   {'constraint': 'student', 'student': s, 'required': n, 'courses': m, 'blocks': b}
+#                                                                        student s cannot take n courses
+#   {'constraint': 'timetable', 'courses': [...]}                        no timetable even with unlimited seats
+#   {'constraint': 'pinned', 'pins': [...]}                              ScheduleSession pins that cannot all hold
+
+
+def course_seats(courses, sections, section_capacity, domains):
+    # Seats a course can offer, a course never opens more sections than blocks in its domain
+    return [max(0, min(sections[c], len(domains[c]))) * max(0, section_capacity[c]) for c in range(len(courses))]
+
+
+def screen_infeasibility(students, courses, preferences, sections, section_capacity, time_grid=None,
+                         allowed_blocks=None, whole_sets=False):
+    # Necessary conditions checked without building a model, in time linear in the size of the preferences.
+    # whole_sets=False follows the cp_sat and linear models, where student i takes len(preferences[i])
+    # distinct requested courses. whole_sets=True follows the decomposition and column_generation engines,
+    # where a student takes every course of exactly one preference set. Returns the list of conflicts, empty
+    # when nothing is wrong.
+    time_grid = time_grid or default_time_grid()
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    seats = course_seats(courses, sections, section_capacity, domains)
+    conflicts = []
+    forced_demand = [0] * len(courses)
+    total_demand = 0
+    requested = set()
+
+    for i in range(len(students)):
+        if whole_sets:
+            # Sets whose courses all have seats, and enough blocks between them for one course per block
+            options = [{c - 1 for c in preference_set} for preference_set in preferences[i]]
+            required = min((len(option) for option in options), default=0)
+            options = [option for option in options if all(seats[c] > 0 for c in option)
+                       and len(set().union(*(domains[c] for c in option))) >= len(option)]
+            available = set().union(*options)
+            if options:
+                required = min(len(option) for option in options)
+            forced = set.intersection(*options) if options else set()
+            viable = bool(options)
+        else:
+            available = {c - 1 for preference_set in preferences[i] for c in preference_set if seats[c - 1] > 0}
+            required = len(preferences[i])
+            forced = available if len(available) == required else set()
+            viable = len(available) >= required
+        blocks = set().union(*(domains[c] for c in available))
+        if not viable or len(blocks) < required:
+            conflicts.append({'constraint': 'student', 'student': students[i], 'required': required,
+                              'courses': len(available), 'blocks': len(blocks)})
+            continue
+        for c in forced:
+            forced_demand[c] += 1
+        total_demand += required
+        requested |= available
+
+    # Seats every student has to take are compared course by course, then the seats needed overall
+    for c in range(len(courses)):
+        if forced_demand[c] > seats[c]:
+            conflicts.append({'constraint': 'capacity', 'courses': [courses[c]], 'demand': forced_demand[c],
+                              'seats': seats[c]})
+    total_seats = sum(seats[c] for c in requested)
+    if not conflicts and total_demand > total_seats:
+        conflicts.append({'constraint': 'capacity', 'courses': [courses[c] for c in sorted(requested)],
+                          'demand': total_demand, 'seats': total_seats})
+    return conflicts
+
+
+def core_demand(preferences, core):
+    # Seats student i needs in the (0-based) courses of core at the least, when every other requested
+    # course had a seat for them: len(preferences[i]) minus the requested courses outside the core
+    demand = 0
+    for student_preferences in preferences:
+        requested = {c - 1 for preference_set in student_preferences for c in preference_set}
+        demand += max(0, len(student_preferences) - len(requested - set(core)))
+    return demand
+
+
+def explain_infeasibility(model, capacity_literals, courses, seats, preferences, num_workers=0,
+                          time_limit=EXPLAIN_TIME_LIMIT):
+    # The model's capacity rows are enforced by capacity_literals[c]. Solving with these literals as
+    # assumptions makes CP-SAT return a set of courses whose capacities cannot all hold, which is then
+    # shrunk one course at a time until dropping any course of the set makes it feasible.
+    # All the solves share time_limit seconds, a core that could not be shrunk in time is returned as is.
+    deadline = time.monotonic() + (EXPLAIN_TIME_LIMIT if time_limit is None else time_limit)
+    model.ClearObjective()
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = num_workers
+
+    def infeasible(core):
+        model.ClearAssumptions()
+        model.AddAssumptions([capacity_literals[c] for c in core])
+        solver.parameters.max_time_in_seconds = max(0.0, deadline - time.monotonic())
+        return solver.Solve(model) == cp_model.INFEASIBLE
+
+    if not infeasible(list(capacity_literals)):
+        return []
+    index_to_course = {capacity_literals[c].Index(): c for c in capacity_literals}
+    core = sorted(index_to_course[index] for index in solver.SufficientAssumptionsForInfeasibility()
+                  if index in index_to_course)
+    if not core:
+        # Infeasible whatever the seats, the student and block constraints alone cannot be met
+        return [{'constraint': 'timetable', 'courses': list(courses)}]
+    for c in list(core):
+        if len(core) > 1 and infeasible([d for d in core if d != c]):
+            core.remove(c)
+    return [{'constraint': 'capacity', 'courses': [courses[c] for c in core], 'demand': core_demand(preferences, core),
+             'seats': sum(seats[c] for c in core)}]
@@ -0,0 +1,302 @@
+import random
+import time
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+from CpSatSolver import index_requested_courses, lexicographic_weights, weights_fit, set_objective, \
+    solve_lexicographically
+from DecompositionSolver import record_model, match_courses_to_blocks, place_sections
+from Metrics import phase, record_solver, merge_solver
+from ScheduleResult import schedule_result, print_solution, model_statistics
+from TimeGrid import default_time_grid, course_block_domains
+
+
+def seat_student(required, requested, num_courses, course_blocks, seats_left, total_blocks):
+    # Seat a student in every course of required plus other requested courses with free seats, num_courses
+    # in distinct blocks in all. Returns the course -> block assignment, or None when it cannot be done.
+    assignment = match_courses_to_blocks(required, course_blocks, seats_left, total_blocks)
+    if assignment is None:
+        return None
+    taken = list(required)
+    for c in sorted(set(requested) - set(required), key=lambda c: -int(seats_left[c].sum())):
+        if len(taken) == num_courses:
+            break
+        extended = match_courses_to_blocks(taken + [c], course_blocks, seats_left, total_blocks)
+        if extended is not None:
+            taken.append(c)
+            assignment = extended
+    return assignment if len(taken) == num_courses else None
+
+
+def placed_set(preference_sets, blocks):
+    # 0-based rank of the first preference set the student takes exactly, None if there is none. The cp_sat
+    # model can only set x[i, k] for such a set, which needs len(preference_sets) courses, and its objective
+    # always picks the first one.
+    for k, preference_set in enumerate(preference_sets):
+        if len(preference_set) == len(preference_sets) and all(c - 1 in blocks for c in preference_set):
+            return k
+    return None
+
+
+def greedy_course_schedule(courses, preferences, sections, section_capacity, total_blocks, domains):
+    # Sections are placed by demand over every preference set, then students are seated by preference rank:
+    # every student is tried in their first set before anyone is tried in a second one, and the students
+    # left over at the end are seated in any requested courses. Free seats are kept in a course x block array.
+    student_courses, course_students = index_requested_courses(len(preferences), len(courses), preferences)
+    members_by_courses = {}
+    for i in range(len(preferences)):
+        for preference_set in preferences[i]:
+            members_by_courses.setdefault(tuple(sorted(c - 1 for c in preference_set)), []).append(i)
+    course_blocks = place_sections(courses, sections, section_capacity, list(members_by_courses.items()),
+                                   total_blocks, domains)
+
+    seats_left = np.zeros((len(courses), total_blocks), dtype=np.int64)
+    for c, blocks in course_blocks.items():
+        seats_left[c, blocks] = section_capacity[c]
+    student_blocks = {}
+    # Students whose courses have the fewest sections are the hardest to seat, so they go first
+    order = sorted(range(len(preferences)), key=lambda i: sum(len(course_blocks[c]) for c in student_courses[i]))
+    for k in range(max(map(len, preferences), default=0) + 1):
+        for i in order:
+            if i in student_blocks or k > len(preferences[i]):
+                continue
+            required = sorted({c - 1 for c in preferences[i][k]}) if k < len(preferences[i]) else []
+            if k < len(preferences[i]) and len(required) != len(preferences[i]):
+                continue
+            assignment = seat_student(required, student_courses[i], len(preferences[i]), course_blocks, seats_left,
+                                      total_blocks)
+            if assignment is not None:
+                for c, t in assignment.items():
+                    seats_left[c, t] -= 1
+                student_blocks[i] = assignment
+    return course_blocks, student_blocks
+
+
+def reoptimize_neighborhood(free_students, free_courses, preferences, student_courses, sections, section_capacity,
+                            course_blocks, student_blocks, seats_used, domains, total_blocks, maximize=1,
+                            objective='first_choices', num_workers=0, time_limit=None, gap_limit=None,
+                            statistics=None):
+    # CP-SAT over the free students only, everyone else keeps their seats. Sections of the free courses may
+    # move to other blocks, but never away from a block where a fixed student still sits. The current
+    # schedule of the free students is a complete hint, so a solve never returns anything worse.
+    build_start = time.perf_counter()
+    model = cp_model.CpModel()
+    fixed = seats_used.copy()
+    for i in free_students:
+        for c, t in student_blocks.get(i, {}).items():
+            fixed[c, t] -= 1
+
+    # open_block[c, t] = 1 if a section of course c is scheduled at time block t, only for the free courses
+    open_block = {}
+    for c in free_courses:
+        for t in domains[c]:
+            open_block[c, t] = model.NewBoolVar(f'open[{c},{t}]')
+            model.AddHint(open_block[c, t], t in course_blocks[c])
+            if fixed[c, t] > 0:
+                model.Add(open_block[c, t] == 1)
+        model.Add(sum(open_block[c, t] for t in domains[c]) <= sections[c])
+
+    x = {}
+    y = {}
+    seats = {}
+    for j, i in enumerate(free_students):
+        current = student_blocks.get(i, {})
+        for c in student_courses[i]:
+            for t in (domains[c] if c in free_courses else course_blocks[c]):
+                y[j, c, t] = model.NewBoolVar(f'y[{j},{c},{t}]')
+                model.AddHint(y[j, c, t], current.get(c) == t)
+                seats.setdefault((c, t), []).append(y[j, c, t])
+                if c in free_courses:
+                    model.AddImplication(y[j, c, t], open_block[c, t])
+        rank = placed_set(preferences[i], current) if i in student_blocks else None
+        for k in range(len(preferences[i])):
+            x[j, k] = model.NewBoolVar(f'x[{j},{k}]')
+            model.AddHint(x[j, k], k == rank)
+            if len(preferences[i][k]) != len(preferences[i]):
+                model.Add(x[j, k] == 0)
+            # If x[j, k] = 1, the student takes every course of the preference set
+            for c in preferences[i][k]:
+                model.AddBoolOr([y[j, c - 1, t] for t in range(total_blocks) if (j, c - 1, t) in y] + [x[j, k].Not()])
+        model.AddAtMostOne(x[j, k] for k in range(len(preferences[i])))
+        # One course per time block, each course at most once, and len(preferences[i]) courses in all
+        for t in range(total_blocks):
+            model.AddAtMostOne(y[j, c, t] for c in student_courses[i] if (j, c, t) in y)
+        for c in student_courses[i]:
+            model.AddAtMostOne(y[j, c, t] for t in range(total_blocks) if (j, c, t) in y)
+        model.Add(sum(y[j, c, t] for c in student_courses[i] for t in range(total_blocks) if (j, c, t) in y)
+                  == len(preferences[i]))
+
+    # Section capacities, less the seats the fixed students take
+    for (c, t), seated in seats.items():
+        if c in free_courses:
+            model.Add(sum(seated) + int(fixed[c, t]) <= section_capacity[c] * open_block[c, t])
+        else:
+            model.Add(sum(seated) <= section_capacity[c] - int(fixed[c, t]))
+
+    # Objective, the fixed students contribute a constant so the free students' part is maximized alone
+    sub_preferences = [preferences[i] for i in free_students]
+    successive = objective != 'first_choices' and not weights_fit(len(free_students),
+                                                                  max(map(len, sub_preferences), default=0))
+    if not successive:
+        set_objective(model, x, sub_preferences, maximize, 'first_choices' if objective == 'first_choices' else 'weighted')
+    build_time = time.perf_counter() - build_start
+
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = num_workers
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = time_limit
+    if gap_limit is not None:
+        solver.parameters.relative_gap_limit = gap_limit
+    solve_start = time.perf_counter()
+    if successive:
+        level_statistics = {}
+        status, values = solve_lexicographically(model, solver, x, y, open_block, sub_preferences, level_statistics)
+        if statistics is not None:
+            merge_solver(statistics, level_statistics)
+    else:
+        status = solver.Solve(model)
+        record_solver(statistics, solver, status)
+        values = solver.ResponseProto().solution
+    record_model(statistics, model, build_time, time.perf_counter() - solve_start)
+    if status == cp_model.MODEL_INVALID:
+        raise ValueError(f"CP-SAT rejected the model: {model.Validate()}")
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+
+    blocks = {c: [t for t in domains[c] if values[open_block[c, t].Index()]] for c in free_courses}
+    seated = {i: {} for i in free_students}
+    for (j, c, t), var in y.items():
+        if values[var.Index()]:
+            seated[free_students[j]][c] = t
+    return blocks, seated
+
+
+def schedule_levels(preferences, student_blocks):
+    # levels[k] counts the students who take every course of their (k+1)-th preference set first
+    levels = [0] * max(map(len, preferences), default=0)
+    for i, blocks in student_blocks.items():
+        k = placed_set(preferences[i], blocks)
+        if k is not None:
+            levels[k] += 1
+    return levels
+
+
+def schedule_objective(levels, num_students, maximize=1, objective='first_choices'):
+    # Objective value of the cp_sat model for the same schedule, None when the weights would overflow
+    if objective == 'first_choices':
+        return sum(levels[:maximize])
+    if not weights_fit(num_students, len(levels)):
+        return None
+    return sum(w * level for w, level in zip(lexicographic_weights(num_students, len(levels)), levels))
+
+
+def lns_course_schedule(students, courses, preferences, sections, section_capacity, maximize=1, num_workers=0,
+                        time_limit=None, verbose=False, gap_limit=None, on_solution=None, objective='first_choices',
+                        time_grid=None, allowed_blocks=None, max_rounds=100, neighborhood_size=100,
+                        round_time_limit=5.0, seed=0):
+    # Greedy construction followed by large-neighborhood search, for schools too large for the exact model.
+    # Follows the cp_sat model: every student takes len(preferences[i]) of their requested courses and
+    # counts as placed in a set of that many courses they take whole. Each round frees the students around
+    # one student not yet in the best set they could be placed in, and every other round also the sections
+    # of that set's courses, and re-optimizes them with CP-SAT. Time and memory are bounded by the rounds and
+    # neighborhood_size, never by the size of the school. The result can be passed as hint= to the cp_sat engine.
+    if objective not in ('first_choices', 'weighted', 'lexicographic'):
+        raise ValueError(f"Unknown objective: {objective}")
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    # A course never has more sections than blocks it can be scheduled in
+    sections = [min(sections[c], len(domains[c])) for c in range(len(courses))]
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    rng = random.Random(seed)
+
+    statistics = model_statistics()
+    statistics['phases'] = {}
+    build_start = time.perf_counter()
+    with phase(statistics['phases'], 'greedy'):
+        course_blocks, student_blocks = greedy_course_schedule(courses, preferences, sections, section_capacity,
+                                                               total_blocks, domains)
+    statistics['build_time'] = time.perf_counter() - build_start  # the sub-models add their own times below
+    student_courses, course_students = index_requested_courses(len(students), len(courses), preferences)
+    seats_used = np.zeros((len(courses), total_blocks), dtype=np.int64)
+    for blocks in student_blocks.values():
+        for c, t in blocks.items():
+            seats_used[c, t] += 1
+    rank = [placed_set(preferences[i], student_blocks[i]) if i in student_blocks else None
+            for i in range(len(students))]
+    # Rank of the first set each student could be placed in, None for students with no such set
+    best_rank = [next((k for k, preference_set in enumerate(preferences[i])
+                       if len(preference_set) == len(preferences[i])), None) for i in range(len(students))]
+
+    def current_result(status):
+        section_of_block = {(c, t): s for c in course_blocks for s, t in enumerate(course_blocks[c])}
+        schedule = {students[i]: [{
+            'course': c+1,
+            'section': section_of_block[c, t]+1,
+            'time_block': t+1
+        } for c, t in sorted(student_blocks[i].items())] for i in range(len(students))}
+        preference_sets = {students[i]: None if rank[i] is None else rank[i]+1 for i in range(len(students))}
+        section_blocks = {c+1: {s+1: t+1 for s, t in enumerate(course_blocks[c])}
+                          for c in course_blocks if course_blocks[c]}
+        levels = schedule_levels(preferences, student_blocks)
+        statistics['objective'] = schedule_objective(levels, len(students), maximize, objective)
+        statistics['level_objectives'] = levels
+        return schedule_result(status, students, preferences, schedule, preference_sets, section_blocks,
+                               dict(statistics))
+
+    if on_solution is not None and len(student_blocks) == len(students):
+        on_solution(current_result('FEASIBLE'))
+
+    rounds = improvements = 0
+    while rounds < max_rounds and (deadline is None or time.monotonic() < deadline):
+        # Unseated students first, then students outside their first preference set
+        unseated = [i for i in range(len(students)) if i not in student_blocks]
+        unhappy = unseated or [i for i in range(len(students)) if rank[i] != best_rank[i]]
+        if not unhappy:
+            break
+        anchor = rng.choice(unhappy)
+        free_courses = ({c - 1 for c in preferences[anchor][best_rank[anchor]]}
+                        if rounds % 2 and best_rank[anchor] is not None else set())
+        neighbors = sorted({i for c in student_courses[anchor] for i in course_students[c]} - {anchor})
+        free_students = [anchor] + rng.sample(neighbors, min(len(neighbors), neighborhood_size - 1))
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        rounds += 1
+        with phase(statistics['phases'], 'neighborhoods'):
+            solved = reoptimize_neighborhood(free_students, free_courses, preferences, student_courses, sections,
+                                             section_capacity, course_blocks, student_blocks, seats_used, domains,
+                                             total_blocks, maximize, objective, num_workers,
+                                             round_time_limit if remaining is None else min(round_time_limit,
+                                                                                            remaining),
+                                             gap_limit, statistics)
+        if solved is None:
+            continue
+        blocks, seated = solved
+        before = (-len(unseated), schedule_levels(preferences, {i: student_blocks[i] for i in free_students
+                                                                 if i in student_blocks}))
+        for i in free_students:
+            for c, t in student_blocks.get(i, {}).items():
+                seats_used[c, t] -= 1
+            student_blocks[i] = seated[i]
+            for c, t in seated[i].items():
+                seats_used[c, t] += 1
+            rank[i] = placed_set(preferences[i], seated[i])
+        course_blocks.update(blocks)
+        after = (-len(students) + len(student_blocks), schedule_levels(preferences, {i: seated[i] for i in free_students}))
+        if after > before:
+            improvements += 1
+            if on_solution is not None and len(student_blocks) == len(students):
+                on_solution(current_result('FEASIBLE'))
+    statistics['lns_rounds'] = rounds
+    statistics['lns_improvements'] = improvements
+
+    if len(student_blocks) < len(students):
+        statistics['unseated'] = len(students) - len(student_blocks)
+        result = schedule_result('NOT OPTIMAL', students, preferences, statistics=statistics)
+    else:
+        # Only proven optimal when every student takes the first preference set they could be placed in
+        result = current_result('OPTIMAL' if rank == best_rank
+                                else 'FEASIBLE')
+    if verbose:
+        print_solution(result)
+    return result
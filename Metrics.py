@@ -0,0 +1,98 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+def resident_memory_kb():
+    # Current resident set size, None where /proc is not available
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def model_size(model):
+    # (variables, constraints) of a CP-SAT model or a pywraplp solver
+    if hasattr(model, 'NumConstraints'):
+        return model.NumVariables(), model.NumConstraints()
+    proto = model.Proto()
+    return len(proto.variables), len(proto.constraints)
+
+
+@contextmanager
+def phase(phases, name, model=None):
+    # Adds the wall time and resident memory delta of the block to phases[name], and with a model the
+    # variables and constraints the block added to it. A phase run several times accumulates, and
+    # phases=None records nothing.
+    if phases is None:
+        yield
+        return
+    memory = resident_memory_kb()
+    size = model_size(model) if model is not None else None
+    start = time.perf_counter()
+    yield
+    record = phases.setdefault(name, {'time': 0.0, 'memory_delta_kb': 0, 'calls': 0})
+    record['time'] += time.perf_counter() - start
+    record['calls'] += 1
+    end_memory = resident_memory_kb()
+    if memory is None or end_memory is None or record['memory_delta_kb'] is None:
+        record['memory_delta_kb'] = None
+    else:
+        record['memory_delta_kb'] += end_memory - memory
+    if size is not None:
+        variables, constraints = model_size(model)
+        record['variables'] = record.get('variables', 0) + variables - size[0]
+        record['constraints'] = record.get('constraints', 0) + constraints - size[1]
+
+
+def merge_phases(phases, other):
+    # Sums the phases of another run (a component, a sub-model) into phases
+    for name, record in other.items():
+        total = phases.setdefault(name, dict.fromkeys(record, 0))
+        for key, value in record.items():
+            total[key] = None if value is None or total.get(key) is None else total[key] + value
+
+
+def record_solver(statistics, solver, status):
+    # Accumulates the search statistics of a CP-SAT solve into statistics['solver']: the last status,
+    # and branches, conflicts and times summed over every solve (lexicographic levels, sub-models)
+    if statistics is None:
+        return
+    record = statistics.setdefault('solver', {'solves': 0, 'branches': 0, 'conflicts': 0, 'wall_time': 0.0,
+                                              'user_time': 0.0, 'deterministic_time': 0.0})
+    record['status'] = solver.StatusName(status)
+    record['solves'] += 1
+    record['branches'] += solver.NumBranches()
+    record['conflicts'] += solver.NumConflicts()
+    record['wall_time'] += solver.WallTime()
+    record['user_time'] += solver.UserTime()
+    record['deterministic_time'] += solver.ResponseProto().deterministic_time
+
+
+def merge_solver(statistics, other):
+    if 'solver' not in other:
+        return
+    record = statistics.setdefault('solver', {})
+    for key, value in other['solver'].items():
+        record[key] = value if key == 'status' else record.get(key, 0) + value
+
+
+def relative_gap(statistics):
+    # |objective - bound| / max(1, |objective|), CP-SAT's own definition, None without both values
+    objective, bound = statistics.get('objective'), statistics.get('best_bound')
+    if objective is None or bound is None:
+        return None
+    return abs(objective - bound) / max(1.0, abs(objective))
+
+
+def json_value(value):
+    # numpy scalars in statistics
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def write_metrics(path, record):
+    # Appends one JSON line, the format of benchmark-results.jsonl
+    with open(path, 'a') as file:
+        file.write(json.dumps(record, default=json_value) + '\n')
@@ -0,0 +1,109 @@
+from CpSatSolver import index_requested_courses
+from TimeGrid import default_time_grid, course_block_domains
+
+# Bytes of the built model, fitted on generated schools of 200 to 1000 students (within 7%): every
+# proto variable, constraint and literal or linear term, and per variable the name, tuple key and
+# handle the dense build keeps in its dicts on top of the proto
+VARIABLE_BYTES = 125
+CONSTRAINT_BYTES = 170
+TERM_BYTES = 7
+HANDLE_BYTES = 404
+# CP-SAT copies and presolves the model, its peak in the first seconds of search measured 2 to 8 times
+# the proto. A rough allowance, the search itself grows with time and workers.
+SOLVE_FACTOR = 5
+
+
+class ModelTooLargeError(MemoryError):
+    pass
+
+
+def estimate_model_size(students, courses, preferences, sections, section_capacity, time_grid=None,
+                        allowed_blocks=None, formulation='standard', symmetry_breaking=True, lean=False):
+    # Variables, constraints and terms build_course_schedule_model (or build_lean_course_schedule_model with
+    # lean=True) would create, counted family by family from the inputs in time linear in the preferences,
+    # and the memory the build and the solve would take.
+    if formulation not in ('standard', 'aggregated'):
+        raise ValueError(f"Unknown formulation: {formulation}")
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    student_courses, course_students = index_requested_courses(len(students), len(courses), preferences)
+    # Student-section-block variables of one course
+    course_size = [sections[c] * len(domains[c]) for c in range(len(courses))]
+    student_size = [sum(course_size[c] for c in student_courses[i]) for i in range(len(students))]
+    y = sum(student_size)
+
+    variables = sum(map(len, preferences)) + sum(course_size) + y
+    constraints, terms = 0, 0
+    if formulation == 'standard':
+        # section_links
+        constraints += y
+        terms += 2 * y
+    for c in range(len(courses)):
+        blocks = len(domains[c])
+        # section_blocks and section_overlap
+        constraints += sections[c] + blocks
+        terms += 2 * course_size[c]
+        if symmetry_breaking and sections[c] > 1:
+            constraints += (sections[c] - 1) * blocks
+            terms += (sections[c] - 1) * blocks * (blocks + 1) // 2
+        if course_students[c] and formulation == 'aggregated':
+            constraints += course_size[c]
+            terms += course_size[c] * (len(course_students[c]) + 1)
+        elif course_students[c]:
+            constraints += sections[c]
+            terms += course_size[c] * len(course_students[c])
+    # one_preference_set and student_overlap
+    constraints += len(students) * (1 + total_blocks)
+    terms += sum(map(len, preferences)) + y
+    # preference_set_rows, courses_taken included
+    for i in range(len(students)):
+        for preference_set in preferences[i]:
+            if formulation == 'standard':
+                constraints += 1 + 2 * len(preference_set)
+                terms += student_size[i] + 1 + sum(2 * course_size[c - 1] + 1 for c in preference_set)
+            else:
+                if len(preference_set) != len(preferences[i]):
+                    constraints += 1
+                    terms += 1
+                constraints += len(preference_set)
+                terms += sum(course_size[c - 1] + 1 for c in preference_set)
+        if formulation == 'aggregated':
+            constraints += len(student_courses[i])
+            terms += student_size[i]
+        constraints += 1
+        terms += student_size[i]
+
+    proto_bytes = variables * VARIABLE_BYTES + constraints * CONSTRAINT_BYTES + terms * TERM_BYTES
+    model_bytes = proto_bytes + (0 if lean else variables * HANDLE_BYTES)
+    solve_bytes = SOLVE_FACTOR * proto_bytes
+    return {
+        'formulation': formulation,
+        'lean': lean,
+        'variables': variables,
+        'constraints': constraints,
+        'terms': terms,
+        'model_bytes': model_bytes,
+        'solve_bytes': solve_bytes,
+        'memory_bytes': model_bytes + solve_bytes
+    }
+
+
+def choose_model_build(students, courses, preferences, sections, section_capacity, memory_budget, time_grid=None,
+                       allowed_blocks=None, formulation='standard', symmetry_breaking=True):
+    # The estimate of the first build that fits in memory_budget bytes, out of the requested one, the same
+    # formulation built lean, and the aggregated formulation built lean. All of them have the same schedules.
+    builds = [(formulation, False), (formulation, True)]
+    if formulation == 'standard':
+        builds.append(('aggregated', True))
+    estimates = []
+    for build_formulation, lean in builds:
+        estimate = estimate_model_size(students, courses, preferences, sections, section_capacity, time_grid,
+                                       allowed_blocks, build_formulation, symmetry_breaking, lean)
+        if estimate['memory_bytes'] <= memory_budget:
+            return estimate
+        estimates.append(estimate)
+    smallest = min(estimates, key=lambda estimate: estimate['memory_bytes'])
+    raise ModelTooLargeError(f"The smallest model ({smallest['formulation']}, lean) needs about "
+                             f"{smallest['memory_bytes'] / 2 ** 20:.1f} MiB, over the budget of "
+                             f"{memory_budget / 2 ** 20:.1f} MiB: try engine='lns' or group_profiles=True")
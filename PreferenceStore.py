@@ -0,0 +1,103 @@
+import json
+import os
+
+import numpy as np
+
+# Layout of the flat arrays, every level indexes into the next one through an offset array:
+#   student_ids[s]                                   id of the s-th student
+#   term_offsets[s]:term_offsets[s+1]                term rows of student s
+#   term_ids[r], set_offsets[r]:set_offsets[r+1]     term id and preference sets of term row r
+#   course_offsets[k]:course_offsets[k+1]            slice of course_ids holding preference set k
+ARRAY_NAMES = ('student_ids', 'term_offsets', 'term_ids', 'set_offsets', 'course_offsets', 'course_ids',
+               'catalog_ids', 'catalog_codes', 'catalog_names', 'max_seats', 'max_sections')
+
+
+class PreferenceStore:
+    def __init__(self, student_ids, term_offsets, term_ids, set_offsets, course_offsets, course_ids,
+                 catalog_ids, catalog_codes, catalog_names, max_seats, max_sections):
+        self.student_ids = student_ids
+        self.term_offsets = term_offsets
+        self.term_ids = term_ids
+        self.set_offsets = set_offsets
+        self.course_offsets = course_offsets
+        self.course_ids = course_ids
+        self.catalog_ids = catalog_ids
+        self.catalog_codes = catalog_codes
+        self.catalog_names = catalog_names
+        self.max_seats = max_seats
+        self.max_sections = max_sections
+
+    def terms(self):
+        return np.unique(self.term_ids).tolist()
+
+    def term_preferences(self, termId):
+        # Students taking part in a term and their preference sets, as the lists create_course_schedule expects
+        rows = np.flatnonzero(self.term_ids == termId)
+        owners = np.searchsorted(self.term_offsets, rows, side='right') - 1
+        set_offsets = self.set_offsets.tolist()
+        course_offsets = self.course_offsets.tolist()
+        course_ids = self.course_ids.tolist()
+        preferences = [[course_ids[course_offsets[k]:course_offsets[k + 1]]
+                        for k in range(set_offsets[r], set_offsets[r + 1])] for r in rows.tolist()]
+        return self.student_ids[owners].tolist(), preferences
+
+    def term_problem(self, termId):
+        # Positional arguments of create_course_schedule for one term
+        students, preferences = self.term_preferences(termId)
+        return (students, self.catalog_ids.tolist(), preferences,
+                self.max_sections.tolist(), self.max_seats.tolist())
+
+    def save(self, filename, sources=()):
+        # Written through a file object so numpy keeps the file name as given
+        with open(filename, 'wb') as file:
+            np.savez(file, source_stamps=source_stamps(sources), **{name: getattr(self, name) for name in ARRAY_NAMES})
+
+
+def source_stamps(sources):
+    # (size, modification time) of every input file, a cache is only valid while these are unchanged
+    return np.array([[os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in sources], dtype=np.int64)
+
+
+def build_preference_store(preferences_data, courses_data):
+    student_ids, term_offsets, term_ids, set_offsets, course_offsets, course_ids = [], [0], [], [0], [0], []
+    for student in preferences_data:
+        student_ids.append(student['studentId'])
+        for term in student['terms']:
+            term_ids.append(term['termId'])
+            for preference_set in term['coursesPreferences']:
+                course_ids.extend(preference_set)
+                course_offsets.append(len(course_ids))
+            set_offsets.append(len(course_offsets) - 1)
+        term_offsets.append(len(term_ids))
+
+    return PreferenceStore(
+        np.array(student_ids, dtype=np.int64),
+        np.array(term_offsets, dtype=np.int64),
+        np.array(term_ids, dtype=np.int32),
+        np.array(set_offsets, dtype=np.int64),
+        np.array(course_offsets, dtype=np.int64),
+        np.array(course_ids, dtype=np.int32),
+        np.array([course['id'] for course in courses_data], dtype=np.int32),
+        np.array([course['code'] for course in courses_data], dtype=str),
+        np.array([course['name'] for course in courses_data], dtype=str),
+        np.array([course['maxSeats'] for course in courses_data], dtype=np.int32),
+        np.array([course['maxSections'] for course in courses_data], dtype=np.int32))
+
+
+def load_preference_store(preferences_file='student-preferences.json', courses_file='courses.json',
+                          cache_file=None):
+    # With a cache_file, repeated runs on unchanged inputs read the arrays back instead of parsing the JSON
+    sources = (preferences_file, courses_file)
+    if cache_file is not None and os.path.exists(cache_file):
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if np.array_equal(cached['source_stamps'], source_stamps(sources)):
+                return PreferenceStore(*(cached[name] for name in ARRAY_NAMES))
+
+    with open(preferences_file, 'r') as file:
+        preferences_data = json.load(file)
+    with open(courses_file, 'r') as file:
+        courses_data = json.load(file)
+    store = build_preference_store(preferences_data, courses_data)
+    if cache_file is not None:
+        store.save(cache_file, sources)
+    return store
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+
+def cache_key(*parts):
+    # sha256 of the JSON form of the inputs, tuples and lists hash alike so every loader produces the same key
+    return hashlib.sha256(json.dumps(parts, separators=(',', ':')).encode()).hexdigest()
+
+
+# Number of entries of each variable dict key: x[i, k], y[i, c, s, t], z[c, s, t], used when a dict is empty.
+# The grouped model keys its variables x[g, k], y[g, o, c, t] and z[c, t].
+KEY_ARITY = {'x': 2, 'y': 4, 'z': 3}
+
+
+class ScheduleCache:
+    # Solved schedules are kept on disk, one file per entry named after its key. Reading an entry marks it
+    # as recently used, and once the directory grows over max_bytes the least recently used entries are removed.
+    # Built CP-SAT models are kept in memory, the max_models most recently used ones, and handed out as
+    # clones so a solve never changes the cached copy. Cloning takes well under a second where building
+    # takes tens. With persist_models the models are also written to disk for other processes, which is of
+    # little use: OR-Tools only reads them back from text format, nearly as slow as building them again.
+    def __init__(self, directory='.schedule-cache', max_bytes=2 ** 30, max_models=2, persist_models=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_models = max_models
+        self.persist_models = persist_models
+        self.models = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def load_result(self, key):
+        path = self.path(key, '.result.pkl')
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+    def save_result(self, key, result):
+        self.write(self.path(key, '.result.pkl'), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def load_model(self, key):
+        # Returns (model, x, y, z) as build_course_schedule_model created them, or None.
+        # Variables only carry their index, so the cached x, y and z are valid for every clone. Read from
+        # disk they come back as integer variables, the grouped model's counts are not Boolean.
+        if key not in self.models:
+            path = self.path(key, '.model.npz')
+            if not self.persist_models or not os.path.exists(path):
+                return None
+            os.utime(path)
+            with np.load(path, allow_pickle=False) as cached:
+                model = cp_model.CpModel()
+                model.Proto().parse_text_format(zlib.decompress(cached['model'].tobytes()).decode())
+                variables = []
+                for name in ('x', 'y', 'z'):
+                    keys, indices = cached[name + '_keys'].tolist(), cached[name + '_indices'].tolist()
+                    variables.append({tuple(k): model.GetIntVarFromProtoIndex(index)
+                                      for k, index in zip(keys, indices)})
+            self.keep_model(key, (model, *variables))
+        self.models.move_to_end(key)
+        model, x, y, z = self.models[key]
+        return model.Clone(), x, y, z
+
+    def keep_model(self, key, entry):
+        self.models[key] = entry
+        self.models.move_to_end(key)
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+
+    def save_model(self, key, model, x, y, z):
+        # Called before the model is solved, the kept clone still has the constraints only
+        self.keep_model(key, (model.Clone(), x, y, z))
+        if not self.persist_models:
+            return
+        arrays = {'model': np.frombuffer(zlib.compress(str(model.Proto()).encode(), 1), dtype=np.uint8)}
+        for name, variables in (('x', x), ('y', y), ('z', z)):
+            arity = len(next(iter(variables))) if variables else KEY_ARITY[name]
+            arrays[name + '_keys'] = np.array(list(variables), dtype=np.int32).reshape(len(variables), arity)
+            arrays[name + '_indices'] = np.array([var.Index() for var in variables.values()], dtype=np.int64)
+        with tempfile.SpooledTemporaryFile() as file:
+            np.savez(file, **arrays)
+            file.seek(0)
+            self.write(self.path(key, '.model.npz'), file.read())
+
+    def write(self, path, data):
+        # Written to a temporary file first, so concurrent readers never see a partial entry
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
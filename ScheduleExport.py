@@ -0,0 +1,135 @@
+import csv
+import json
+from contextlib import contextmanager
+
+from TimeGrid import default_time_grid
+
+DAY_LABELS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+CSV_COLUMNS = ['studentId', 'courseId', 'section', 'day', 'block', 'startTime', 'endTime']
+
+
+@contextmanager
+def open_output(output, mode='w'):
+    # Writers take a file name or an open file object, a file object is left open
+    if isinstance(output, str):
+        with open(output, mode, newline='' if 'b' not in mode else None) as file:
+            yield file
+    else:
+        yield output
+
+
+def course_id_of(courses=None):
+    # Results number courses from 1 in input order, courses maps them back to the input's course ids
+    return (lambda course: course) if courses is None else (lambda course: courses[course - 1])
+
+
+def student_document(label, entries, time_grid, course_id):
+    # One student's week in the expected-output.json format. Blocks without a course carry course id 0,
+    # the lunch block "Lunch". The "couseId" spelling is the deliverable's.
+    taken = {time_grid.blocks[entry['time_block'] - 1]: course_id(entry['course']) for entry in entries}
+    times = time_grid.block_times()
+    return {
+        'label': label,
+        'days': [{
+            'label': DAY_LABELS[day - 1],
+            'blocks': [{
+                'label': f'Block {block}',
+                'startTime': times[block - 1][0],
+                'endTime': times[block - 1][1],
+                'couseId': 'Lunch' if block == time_grid.lunch_block else taken.get((day, block), 0)
+            } for block in range(1, time_grid.blocks_per_day + 1)]
+        } for day in range(1, time_grid.days_per_week + 1)]
+    }
+
+
+def write_json_array(file, documents):
+    # Incremental JSON writer: the array is written one document at a time, never held whole in memory
+    file.write('[')
+    for n, document in enumerate(documents):
+        file.write(',\n' if n else '\n')
+        file.write(json.dumps(document, indent=4))
+    file.write('\n]\n')
+
+
+def write_student_schedules(result, output, time_grid=None, courses=None):
+    # Per-student view, a JSON array of expected-output.json schedules labelled "Schedule <student>"
+    time_grid = time_grid or default_time_grid()
+    course_id = course_id_of(courses)
+    with open_output(output) as file:
+        write_json_array(file, (student_document(f'Schedule {student}', entries, time_grid, course_id)
+                                for student, entries in result['schedule'].items()))
+
+
+def section_documents(result, time_grid, course_id):
+    # Sections in course order with their block, times and number of students seated
+    enrolled = {}
+    for entries in result['schedule'].values():
+        for entry in entries:
+            enrolled[entry['course'], entry['section']] = enrolled.get((entry['course'], entry['section']), 0) + 1
+    times = time_grid.block_times()
+    for course, blocks in result['section_blocks'].items():
+        for section, time_block in blocks.items():
+            day, block = time_grid.blocks[time_block - 1]
+            yield {
+                'courseId': course_id(course),
+                'section': section,
+                'day': DAY_LABELS[day - 1],
+                'block': f'Block {block}',
+                'startTime': times[block - 1][0],
+                'endTime': times[block - 1][1],
+                'enrolled': enrolled.get((course, section), 0)
+            }
+
+
+def write_section_schedules(result, output, time_grid=None, courses=None):
+    # Per-section view, a JSON array with one entry per scheduled section
+    time_grid = time_grid or default_time_grid()
+    with open_output(output) as file:
+        write_json_array(file, section_documents(result, time_grid, course_id_of(courses)))
+
+
+def schedule_rows(result, time_grid, course_id):
+    # One row per student and course taken, in CSV_COLUMNS order
+    times = time_grid.block_times()
+    for student, entries in result['schedule'].items():
+        for entry in entries:
+            day, block = time_grid.blocks[entry['time_block'] - 1]
+            yield [student, course_id(entry['course']), entry['section'], DAY_LABELS[day - 1], block,
+                   times[block - 1][0], times[block - 1][1]]
+
+
+def write_schedule_csv(result, output, time_grid=None, courses=None):
+    time_grid = time_grid or default_time_grid()
+    with open_output(output) as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(schedule_rows(result, time_grid, course_id_of(courses)))
+
+
+def write_schedule_parquet(result, output, time_grid=None, courses=None, batch_size=65536):
+    # Same rows as write_schedule_csv, written in row groups of batch_size rows. Needs pyarrow.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("Parquet export needs pyarrow: pip install pyarrow") from error
+    time_grid = time_grid or default_time_grid()
+    schema = pa.schema([('studentId', pa.string()), ('courseId', pa.string()), ('section', pa.int32()),
+                        ('day', pa.string()), ('block', pa.int32()), ('startTime', pa.string()),
+                        ('endTime', pa.string())])
+
+    def write_batch(writer, rows):
+        columns = [list(column) for column in zip(*rows)]
+        columns[0] = [str(student) for student in columns[0]]
+        columns[1] = [str(course) for course in columns[1]]
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+    with pq.ParquetWriter(output, schema) as writer:
+        rows = []
+        for row in schedule_rows(result, time_grid, course_id_of(courses)):
+            rows.append(row)
+            if len(rows) == batch_size:
+                write_batch(writer, rows)
+                rows = []
+        if rows:
+            write_batch(writer, rows)
@@ -0,0 +1,55 @@
+def schedule_result(status, students, preferences, schedule=None, preference_sets=None, section_blocks=None,
+                    statistics=None, conflicts=None):
+    # Structured result shared by every engine:
+    #   schedule[student]          list of {'course', 'section', 'time_block'} entries (1-based)
+    #   preference_sets[student]   1-based index of the assigned preference set, None if no set was assigned
+    #   section_blocks[course]     {section: time_block} for every scheduled section
+    #   preference_counts[k]       number of students assigned to their k-th preference set
+    #   statistics                 build/solve wall time, model size, objective value and best bound
+    #   conflicts                  constraints that make the input infeasible (see Feasibility.py), if known
+    preference_sets = preference_sets or {}
+    preference_counts = {k + 1: 0 for k in range(max((len(p) for p in preferences), default=0))}
+    for k in preference_sets.values():
+        if k is not None:
+            preference_counts[k] += 1
+    return {
+        'status': status,
+        'schedule': schedule or {},
+        'preference_sets': preference_sets,
+        'section_blocks': section_blocks or {},
+        'preference_counts': preference_counts,
+        'statistics': statistics or {},
+        'conflicts': conflicts or []
+    }
+
+
+def print_solution(result):
+    print("Solver status:", result['status'])
+    if not result['schedule']:
+        print('No solution found.')
+        for conflict in result.get('conflicts', []):
+            print('Conflict:', conflict)
+        return
+    print('Solution:')
+    for student, student_schedule in result['schedule'].items():
+        for entry in student_schedule:
+            print(f"Student {student} attends course {entry['course']} assigned to section {entry['section']} "
+                  f"at time block {entry['time_block']}")
+    for student, k in result['preference_sets'].items():
+        if k is not None:
+            print(f"Student {student} assigned to preference set {k}")
+    for course, blocks in result['section_blocks'].items():
+        for section, block in blocks.items():
+            print(f"Course {course} section {section} assigned at time block {block}")
+
+
+def model_statistics(build_time=0.0, solve_time=0.0, num_variables=0, num_constraints=0, objective=None,
+                     best_bound=None):
+    return {
+        'build_time': build_time,
+        'solve_time': solve_time,
+        'num_variables': num_variables,
+        'num_constraints': num_constraints,
+        'objective': objective,
+        'best_bound': best_bound
+    }
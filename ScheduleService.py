@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import socket
+import time
+
+from Metrics import json_value
+from PreferenceStore import load_preference_store
+from TimeGrid import default_time_grid
+
+PROBLEM_FIELDS = ('students', 'courses', 'preferences', 'sections', 'section_capacity')
+# Arguments of create_course_schedule the service supplies itself or that cannot travel as JSON
+RESERVED_OPTIONS = ('on_solution', 'cache', 'time_grid', 'hint', 'verbose')
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def progress_of(result):
+    # What a worker reports for every improving schedule, small enough to send while the search runs
+    return {'objective': result['statistics'].get('objective'),
+            'best_bound': result['statistics'].get('best_bound'),
+            'preference_counts': result['preference_counts']}
+
+
+def solve_jobs(connection, cache_directory):
+    # Worker process loop. The solver is imported once per process, and the ScheduleCache keeps the last
+    # models it built in memory, so a later job on the same inputs skips the import and the model build.
+    from ScheduleCache import ScheduleCache
+    from Solver import create_course_schedule
+
+    cache = ScheduleCache(cache_directory) if cache_directory else None
+    while True:
+        job = connection.recv()
+        if job is None:
+            return
+        job_id, problem, options = job
+
+        def progress(result):
+            connection.send(('progress', job_id, progress_of(result)))
+
+        try:
+            on_solution = None if options.get('components') else progress
+            result = create_course_schedule(*problem, on_solution=on_solution, cache=cache, **options)
+            connection.send(('done', job_id, result))
+        except Exception as error:
+            connection.send(('failed', job_id, f"{type(error).__name__}: {error}"))
+
+
+class Job:
+    def __init__(self, job_id, problem, options):
+        self.id = job_id
+        self.problem = problem
+        self.options = options
+        self.state = 'queued'
+        self.progress = {'solutions': 0}
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def finish(self, state, result=None, error=None):
+        self.state = state
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.problem = None
+
+    def summary(self, with_result=False):
+        summary = {'id': self.id, 'state': self.state, 'progress': self.progress, 'error': self.error,
+                   'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+        if with_result:
+            summary['result'] = self.result
+        return summary
+
+
+class Worker:
+    # One solver process and the asyncio queue its messages arrive on. The queue also carries the service's
+    # own ('cancel', job id, None) messages, so a running job waits on a single queue for either.
+    def __init__(self, context, cache_directory):
+        self.connection, child = context.Pipe()
+        # Not a daemon process: components=True starts a process pool of its own
+        self.process = context.Process(target=solve_jobs, args=(child, cache_directory))
+        self.process.start()
+        child.close()
+        self.messages = asyncio.Queue()
+        asyncio.get_running_loop().add_reader(self.connection.fileno(), self.read)
+
+    def read(self):
+        try:
+            while self.connection.poll():
+                self.messages.put_nowait(self.connection.recv())
+        except (EOFError, OSError):
+            asyncio.get_running_loop().remove_reader(self.connection.fileno())
+            self.messages.put_nowait(('exited', None, None))
+
+    async def stop(self, kill=False):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self.connection.fileno())
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+        await loop.run_in_executor(None, self.process.join)
+        self.connection.close()
+
+
+class ScheduleService:
+    # Local scheduling daemon. Jobs wait in a bounded queue and run one at a time in each of num_processes
+    # warm worker processes. A cancelled or overrunning job has its worker killed and replaced, which is
+    # the only way to stop a CP-SAT search from outside. time_limit is the default solver limit of a job;
+    # a job still running grace_seconds after its limit (which does not count the model build) is killed.
+    def __init__(self, num_processes=1, queue_size=16, preferences_file=None, courses_file='courses.json',
+                 time_grid=None, cache_directory='.schedule-cache', time_limit=None, grace_seconds=60.0,
+                 keep_jobs=1000):
+        self.num_processes = num_processes
+        self.queue_size = queue_size
+        # The preference file is parsed once, jobs then name a term instead of sending the whole problem
+        self.store = load_preference_store(preferences_file, courses_file) if preferences_file else None
+        self.time_grid = time_grid or default_time_grid()
+        self.cache_directory = cache_directory
+        self.time_limit = time_limit
+        self.grace_seconds = grace_seconds
+        self.keep_jobs = keep_jobs
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.loop = None
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None, started=None):
+        # Runs until shutdown(). started() is called once the socket accepts connections.
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.stopping = asyncio.Event()
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [Worker(self.context, self.cache_directory) for _ in range(self.num_processes)]
+        dispatchers = [asyncio.create_task(self.dispatch(slot)) for slot in range(self.num_processes)]
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started()
+        async with server:
+            await self.stopping.wait()
+        for dispatcher in dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*dispatchers, return_exceptions=True)
+        for worker in self.workers:
+            await worker.stop(kill=True)
+
+    def shutdown(self):
+        # Safe to call from any thread
+        self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def submit(self, request):
+        if 'term' in request:
+            if self.store is None:
+                raise ValueError("The service was started without a preference file")
+            problem = self.store.term_problem(request['term'])
+        else:
+            problem = tuple(request[name] for name in PROBLEM_FIELDS)
+        options = dict(request.get('options', {}))
+        reserved = [name for name in RESERVED_OPTIONS if name in options]
+        if reserved:
+            raise ValueError(f"Options set by the service: {', '.join(reserved)}")
+        # JSON object keys are strings, allowed_blocks is keyed by the problem's course ids again
+        if options.get('allowed_blocks'):
+            allowed = options['allowed_blocks']
+            options['allowed_blocks'] = {course: allowed[str(course)] for course in problem[1] if str(course) in allowed}
+        options['time_grid'] = self.time_grid
+        if self.time_limit is not None:
+            options.setdefault('time_limit', self.time_limit)
+
+        # The bound counts jobs still waiting, a cancelled job leaves the queue at once
+        if self.queued_jobs() >= self.queue_size:
+            raise QueueFullError(f"Queue full ({self.queue_size} jobs waiting)")
+        job = Job(next(self.job_ids), problem, options)
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self.forget_finished_jobs()
+        return job
+
+    def queued_jobs(self):
+        return sum(job.state == 'queued' for job in self.jobs.values())
+
+    def forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(self.jobs) - self.keep_jobs)]:
+            del self.jobs[job_id]
+
+    def cancel(self, job):
+        if job.state == 'queued':
+            # Dropped when a dispatcher takes it from the queue
+            job.finish('cancelled')
+        elif job.state == 'running':
+            self.workers[job.slot].messages.put_nowait(('cancel', job.id, None))
+
+    async def dispatch(self, slot):
+        while True:
+            job = await self.queue.get()
+            if job.state != 'queued':
+                continue
+            job.state = 'running'
+            job.started = time.time()
+            job.slot = slot
+            worker = self.workers[slot]
+            worker.connection.send((job.id, job.problem, job.options))
+            if not await self.follow(job, worker):
+                # Cancelled, overran its limit or the process died: the worker cannot be reused
+                await worker.stop(kill=True)
+                self.workers[slot] = Worker(self.context, self.cache_directory)
+
+    async def follow(self, job, worker):
+        # Applies the worker's messages to the job until it ends. Returns whether the worker is still usable.
+        time_limit = job.options.get('time_limit')
+        deadline = None if time_limit is None else job.started + time_limit + self.grace_seconds
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                kind, job_id, payload = await asyncio.wait_for(worker.messages.get(), timeout)
+            except asyncio.TimeoutError:
+                job.finish('failed', error=f"Still running {self.grace_seconds}s after its time limit")
+                return False
+            if kind == 'progress':
+                job.progress = dict(payload, solutions=job.progress['solutions'] + 1,
+                                    elapsed=time.time() - job.started)
+            elif kind == 'done':
+                job.finish('done', result=payload)
+                return True
+            elif kind == 'failed':
+                job.finish('failed', error=payload)
+                return True
+            elif kind == 'cancel':
+                job.finish('cancelled')
+                return False
+            else:
+                job.finish('failed', error="Worker process exited")
+                return False
+
+    def route(self, method, path, body):
+        # (HTTP status, JSON response) of one request
+        parts = path.strip('/').split('/')
+        if parts == ['status']:
+            return 200, {'queued': self.queued_jobs(), 'queue_size': self.queue_size,
+                         'running': sum(job.state == 'running' for job in self.jobs.values()),
+                         'processes': self.num_processes}
+        if parts == ['jobs'] and method == 'GET':
+            return 200, [job.summary() for job in self.jobs.values()]
+        if parts == ['jobs'] and method == 'POST':
+            try:
+                return 202, self.submit(body or {}).summary()
+            except QueueFullError as error:
+                return 503, {'error': str(error)}
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            job = self.jobs.get(int(parts[1]))
+            if job is None:
+                return 404, {'error': f"No job {parts[1]}"}
+            if method == 'GET':
+                return 200, job.summary(with_result=True)
+            if method == 'DELETE':
+                self.cancel(job)
+                return 200, job.summary()
+        return 404, {'error': f"No route {method} {path}"}
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1: one JSON request and response per connection
+        try:
+            method, path, _ = (await reader.readline()).decode().split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, value = line.decode().split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, response = self.route(method, path, json.loads(body) if body else None)
+        except (ValueError, KeyError, TypeError, IndexError, asyncio.IncompleteReadError) as error:
+            status, response = 400, {'error': f"{type(error).__name__}: {error}"}
+        payload = json.dumps(response, default=json_value).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        await writer.drain()
+        writer.close()
+
+
+def service_request(method, path, body=None, host='127.0.0.1', port=8765, unix_path=None, timeout=None):
+    # Blocking client for scripts and tests, returns (HTTP status, decoded JSON response)
+    payload = json.dumps(body).encode() if body is not None else b''
+    if unix_path:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(unix_path)
+    else:
+        connection = socket.create_connection((host, port), timeout)
+    with connection:
+        connection.sendall(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                           f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        chunks = []
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    head, _, content = b''.join(chunks).partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(content)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local scheduling service with a job queue.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', default=None, help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes solving jobs concurrently')
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--preferences', default='student-preferences.json',
+                        help='preference file jobs can name terms of, "" for none')
+    parser.add_argument('--courses', default='courses.json')
+    parser.add_argument('--cache-dir', default='.schedule-cache')
+    parser.add_argument('--time-limit', type=float, default=None, help='default time limit of a job in seconds')
+    args = parser.parse_args()
+
+    service = ScheduleService(args.processes, args.queue_size, args.preferences or None, args.courses,
+                              cache_directory=args.cache_dir, time_limit=args.time_limit)
+    address = args.unix or f"{args.host}:{args.port}"
+    asyncio.run(service.serve(args.host, args.port, args.unix,
+                              started=lambda: print(f"Scheduling service listening on {address}")))
@@ -0,0 +1,286 @@
+import time
+
+from ortools.sat.python import cp_model
+
+from CpSatSolver import build_course_schedule_model, extract_solution, set_objective
+from Feasibility import screen_infeasibility
+from Metrics import phase, record_solver, relative_gap
+from ScheduleResult import schedule_result, print_solution, model_statistics
+from TimeGrid import default_time_grid, course_block_domains
+
+
+def set_bounds(model, var, lower, upper):
+    # Fixes or releases a variable in place, in the model proto
+    domain = model.Proto().variables[var.Index()].domain
+    domain[0] = lower
+    domain[1] = upper
+
+
+class ScheduleSession:
+    # What-if scheduling on one CP-SAT model kept alive between edits, the cp_sat engine's model in the
+    # standard formulation. The model is built once with room for extra_sections more sections of every
+    # course, and edits change it in place:
+    #   set_capacity(course, seats)       new bound of the course's capacity rows
+    #   set_sections(course, count)       sections from count on are closed by fixing their variables to 0
+    #   set_preferences(student, sets)    the student's variables are fixed to 0 and a new block of variables
+    #                                     and rows is appended, its seats added to the capacity rows
+    #   pin_set / pin_course / pin_block  assumptions held in every solve until unpin(key)
+    # Only more sections than were built in rebuilds the model. solve() starts from the previous schedule
+    # as a hint, keep='fixed' also fixes the seats of every student the edits since the last solve did not
+    # touch. Courses and students are named by their ids, as in the result.
+    def __init__(self, students, courses, preferences, sections, section_capacity, maximize=1,
+                 objective='first_choices', time_grid=None, allowed_blocks=None, extra_sections=1, num_workers=0,
+                 verbose=False):
+        if objective not in ('first_choices', 'weighted'):
+            raise ValueError(f"A session solves the first_choices or weighted objective, not {objective}")
+        self.students = list(students)
+        self.courses = list(courses)
+        self.preferences = [[list(preference_set) for preference_set in student_sets] for student_sets in preferences]
+        self.sections = list(sections)
+        self.section_capacity = list(section_capacity)
+        self.maximize = maximize
+        self.objective = objective
+        self.time_grid = time_grid or default_time_grid()
+        self.allowed_blocks = allowed_blocks
+        self.extra_sections = extra_sections
+        self.num_workers = num_workers
+        self.verbose = verbose
+        self.domains = course_block_domains(self.courses, self.time_grid, allowed_blocks)
+        self.student_index = {student: i for i, student in enumerate(self.students)}
+        self.course_index = {course: c for c, course in enumerate(self.courses)}
+        self.max_sections = [count + extra_sections for count in self.sections]
+        self.pins = set()
+        self.values = None
+        self.result = None
+        self.build()
+
+    def build(self):
+        # (Re)builds the model from the current inputs, the last solution is kept as the next hint
+        self.phases = {}
+        self.rows = {}
+        self.pin_literals = {}
+        with phase(self.phases, 'build'):
+            self.model, self.x, self.y, self.z, student_courses = build_course_schedule_model(
+                self.students, self.courses, self.preferences, self.max_sections, self.section_capacity,
+                self.maximize, True, self.objective, self.time_grid, self.allowed_blocks, rows=self.rows)
+            for c in range(len(self.courses)):
+                self.close_sections(c)
+        if self.result is not None and self.result['schedule']:
+            self.values = self.solution_values(self.result)
+        self.touched_students = set()
+        self.touched_courses = set()
+
+    def solution_values(self, result):
+        # Solution vector of a result in the current model, the hint after a rebuild
+        values = [0] * len(self.model.Proto().variables)
+        for student, entries in result['schedule'].items():
+            i = self.student_index[student]
+            for entry in entries:
+                values[self.y[i, entry['course'] - 1, entry['section'] - 1, entry['time_block'] - 1].Index()] = 1
+        for student, k in result['preference_sets'].items():
+            if k is not None:
+                values[self.x[self.student_index[student], k - 1].Index()] = 1
+        for course, blocks in result['section_blocks'].items():
+            for section, block in blocks.items():
+                values[self.z[course - 1, section - 1, block - 1].Index()] = 1
+        return values
+
+    def close_sections(self, c):
+        for s in range(self.max_sections[c]):
+            for t in self.domains[c]:
+                set_bounds(self.model, self.z[c, s, t], 0, 0 if s >= self.sections[c] else 1)
+
+    def set_capacity(self, course, seats):
+        c = self.course_index[course]
+        with phase(self.phases, 'edit'):
+            self.section_capacity[c] = seats
+            for s in range(self.max_sections[c]):
+                if ('capacity', c, s) in self.rows:
+                    self.model.Proto().constraints[self.rows['capacity', c, s].Index()].linear.domain[1] = seats
+        self.touched_courses.add(c)
+
+    def set_sections(self, course, count):
+        c = self.course_index[course]
+        self.sections[c] = count
+        self.touched_courses.add(c)
+        if count > self.max_sections[c]:
+            self.max_sections[c] = count + self.extra_sections
+            self.build()
+            return
+        with phase(self.phases, 'edit'):
+            self.close_sections(c)
+
+    def set_preferences(self, student, preference_sets):
+        i = self.student_index[student]
+        with phase(self.phases, 'edit'):
+            # The old block stays in the model with every variable fixed to 0 and no course to take
+            for k in range(len(self.preferences[i])):
+                set_bounds(self.model, self.x.pop((i, k)), 0, 0)
+            for key in [key for key in self.y if key[0] == i]:
+                set_bounds(self.model, self.y.pop(key), 0, 0)
+            domain = self.model.Proto().constraints[self.rows.pop(('courses_taken', i)).Index()].linear.domain
+            domain[0] = domain[1] = 0
+            self.preferences[i] = [list(preference_set) for preference_set in preference_sets]
+            self.add_student(i)
+            set_objective(self.model, self.x, self.preferences, self.maximize, self.objective)
+        # Pins on the old block do not carry over
+        self.pins = {key for key in self.pins if not (key[0] in ('set', 'course') and key[1] == student)}
+        self.pin_literals = {key: literal for key, literal in self.pin_literals.items() if key in self.pins}
+        self.touched_students.add(i)
+
+    def add_student(self, i):
+        # The rows build_course_schedule_model has for student i, over the student's new preference sets
+        model = self.model
+        preferences = self.preferences[i]
+        requested = sorted({c - 1 for preference_set in preferences for c in preference_set})
+        x, y, z = self.x, self.y, self.z
+        for k in range(len(preferences)):
+            x[i, k] = model.NewBoolVar(f'x[{i},{k}]')
+        for c in requested:
+            for s in range(self.max_sections[c]):
+                for t in self.domains[c]:
+                    y[i, c, s, t] = model.NewBoolVar(f'y[{i},{c},{s},{t}]')
+                    model.AddImplication(y[i, c, s, t], z[c, s, t])
+                # The new seats count against the section's capacity
+                if ('capacity', c, s) in self.rows:
+                    linear = model.Proto().constraints[self.rows['capacity', c, s].Index()].linear
+                    for t in self.domains[c]:
+                        linear.vars.append(y[i, c, s, t].Index())
+                        linear.coeffs.append(1)
+                else:
+                    self.rows['capacity', c, s] = model.Add(sum(y[i, c, s, t] for t in self.domains[c])
+                                                            <= self.section_capacity[c])
+        model.AddAtMostOne(x[i, k] for k in range(len(preferences)))
+        for t in range(len(self.time_grid.blocks)):
+            model.AddAtMostOne(y[i, c, s, t] for c in requested if (i, c, 0, t) in y
+                               for s in range(self.max_sections[c]))
+        total_courses = [y[i, c, s, t] for c in requested for s in range(self.max_sections[c]) for t in self.domains[c]]
+        for k in range(len(preferences)):
+            model.Add(sum(total_courses) == len(preferences[k])).OnlyEnforceIf(x[i, k])
+            for c in preferences[k]:
+                section_time_assignments = [y[i, c-1, s, t] for s in range(self.max_sections[c-1])
+                                            for t in self.domains[c-1]]
+                model.AddAtMostOne(section_time_assignments)
+                model.AddBoolOr(section_time_assignments + [x[i, k].Not()])
+        self.rows['courses_taken', i] = model.Add(sum(total_courses) == len(preferences))
+
+    def pin_set(self, student, preference_set):
+        # The student is placed in their preference_set-th set (1-based)
+        key = ('set', student, preference_set)
+        if not 1 <= preference_set <= len(self.preferences[self.student_index[student]]):
+            raise ValueError(f"Student {student} has no preference set {preference_set}")
+        self.pins.add(key)
+        return key
+
+    def pin_course(self, student, course, time_block=None):
+        # The student takes the course, at time_block if given
+        key = ('course', student, course, time_block)
+        if self.course_index[course] + 1 not in {c for preference_set in self.preferences[self.student_index[student]]
+                                                 for c in preference_set}:
+            raise ValueError(f"Student {student} did not request course {course}")
+        self.pins.add(key)
+        return key
+
+    def pin_block(self, course, time_block):
+        # A section of the course is scheduled at time_block
+        key = ('block', course, time_block)
+        self.pins.add(key)
+        return key
+
+    def unpin(self, key):
+        self.pins.discard(key)
+
+    def pin_literal(self, key):
+        # Literal assumed true while the pin holds, created once per model
+        if key in self.pin_literals:
+            return self.pin_literals[key]
+        if key[0] == 'set':
+            literal = self.x[self.student_index[key[1]], key[2] - 1]
+        else:
+            literal = self.model.NewBoolVar(f'pin{key}')
+            if key[0] == 'course':
+                i, c, block = self.student_index[key[1]], self.course_index[key[2]], key[3]
+                seats = [var for (j, d, s, t), var in self.y.items() if j == i and d == c and block in (None, t + 1)]
+            else:
+                c, block = self.course_index[key[1]], key[2]
+                seats = [self.z[c, s, block - 1] for s in range(self.max_sections[c]) if (c, s, block - 1) in self.z]
+            self.model.AddBoolOr(seats).OnlyEnforceIf(literal)
+        self.pin_literals[key] = literal
+        return literal
+
+    def untouched_students(self):
+        # Students whose preferences and requested courses no edit since the last solve changed
+        return [i for i in range(len(self.students)) if i not in self.touched_students
+                and not any(c - 1 in self.touched_courses for preference_set in self.preferences[i]
+                            for c in preference_set)]
+
+    def solve(self, time_limit=None, keep='hint'):
+        # keep='hint' starts from the previous schedule, keep='fixed' also keeps every untouched student's
+        # seats, which solves faster but only proves optimality for the touched students. A fixed solve
+        # that turns out infeasible is repeated with the hint only.
+        if keep not in ('hint', 'fixed'):
+            raise ValueError(f"Unknown keep mode: {keep}")
+        build_time = sum(record['time'] for record in self.phases.values())
+        phases = self.phases
+        model = self.model
+        fixed = []
+        with phase(phases, 'hint'):
+            model.ClearHints()
+            if self.values is not None:
+                for variables in (self.x, self.y, self.z):
+                    for var in variables.values():
+                        model.AddHint(var, self.values[var.Index()] if var.Index() < len(self.values) else 0)
+                if keep == 'fixed':
+                    untouched = set(self.untouched_students())
+                    fixed = [var for variables in (self.x, self.y) for key, var in variables.items()
+                             if key[0] in untouched]
+                    for var in fixed:
+                        set_bounds(model, var, self.values[var.Index()], self.values[var.Index()])
+            pins = sorted(self.pins, key=str)
+            model.ClearAssumptions()
+            model.AddAssumptions([self.pin_literal(key) for key in pins])
+
+        solver = cp_model.CpSolver()
+        solver.parameters.num_workers = self.num_workers
+        if time_limit is not None:
+            solver.parameters.max_time_in_seconds = time_limit
+        statistics = model_statistics(build_time, 0.0, len(model.Proto().variables), len(model.Proto().constraints))
+        statistics['phases'] = phases
+        with phase(phases, 'solve'):
+            status = solver.Solve(model)
+        record_solver(statistics, solver, status)
+        if fixed:
+            for var in fixed:
+                set_bounds(model, var, 0, 1)
+            if status == cp_model.INFEASIBLE:
+                return self.solve(time_limit, 'hint')
+        statistics['solve_time'] = phases['solve']['time']
+
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            statistics['objective'] = solver.ObjectiveValue()
+            statistics['best_bound'] = solver.BestObjectiveBound()
+            statistics['gap'] = relative_gap(statistics)
+            self.values = list(solver.ResponseProto().solution)
+            optimal = status == cp_model.OPTIMAL and not fixed and statistics['gap'] == 0
+            with phase(phases, 'extract'):
+                solution = extract_solution(self.values, self.students, self.x, self.y, self.z)
+            self.result = schedule_result('OPTIMAL' if optimal else 'FEASIBLE', self.students, self.preferences,
+                                          *solution, statistics=statistics)
+            self.touched_students = set()
+            self.touched_courses = set()
+        elif status == cp_model.INFEASIBLE and pins:
+            # The pins that cannot hold together
+            core = set(solver.SufficientAssumptionsForInfeasibility())
+            conflicts = [{'constraint': 'pinned',
+                          'pins': [key for key in pins if self.pin_literals[key].Index() in core]}]
+            self.result = schedule_result('NOT OPTIMAL', self.students, self.preferences, statistics=statistics,
+                                          conflicts=conflicts)
+        else:
+            conflicts = screen_infeasibility(self.students, self.courses, self.preferences, self.sections,
+                                             self.section_capacity, self.time_grid, self.allowed_blocks)
+            self.result = schedule_result('NOT OPTIMAL', self.students, self.preferences, statistics=statistics,
+                                          conflicts=conflicts)
+        self.phases = {}
+        if self.verbose:
+            print_solution(self.result)
+        return self.result
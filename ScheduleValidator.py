@@ -0,0 +1,205 @@
+import argparse
+import json
+
+import numpy as np
+
+from TimeGrid import default_time_grid, course_block_domains
+
+# Each course gets a random 64-bit key, and a set of courses the wrapping sum of its keys, so a student's
+# courses are compared with every one of their preference sets as single integers
+SET_HASH_SEED = 20240301
+
+
+def schedule_arrays(result, students):
+    # The schedule as parallel arrays with one row per entry: student index, course, section and time block,
+    # all 0-based. Students missing from the schedule have no rows.
+    index = {student: i for i, student in enumerate(students)}
+    lists = list(result['schedule'].values())
+    sizes = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+    student = np.repeat(np.fromiter((index[label] for label in result['schedule']), dtype=np.int64,
+                                    count=len(lists)), sizes)
+    entries = [entry for student_entries in lists for entry in student_entries]
+
+    def field(name):
+        return np.fromiter((entry[name] for entry in entries), dtype=np.int64, count=len(entries)) - 1
+    return student, field('course'), field('section'), field('time_block')
+
+
+def section_block_arrays(result):
+    # result['section_blocks'] as (course, section, time block) arrays, 0-based
+    rows = [(course, section, block) for course, blocks in result['section_blocks'].items()
+            for section, block in blocks.items()]
+    table = np.fromiter((value for row in rows for value in row), dtype=np.int64, count=3 * len(rows)) - 1
+    return table[0::3], table[1::3], table[2::3]
+
+
+def duplicates(first, second, size):
+    # (first, second) pairs appearing more than once, with their counts, for second values below size
+    unique, counts = np.unique(first * size + second, return_counts=True)
+    unique, counts = unique[counts > 1], counts[counts > 1]
+    return unique // size, unique % size, counts
+
+
+def validate_schedule(result, students, courses, preferences, sections, section_capacity, time_grid=None,
+                      allowed_blocks=None, whole_sets=False, max_violations=None):
+    # Checks a result against the inputs independently of the engine that produced it:
+    #   'course', 'section', 'time_block'   entries naming a course, section or block that does not exist
+    #                                       (or a block outside the course's domain)
+    #   'capacity'          more students in a section than its capacity
+    #   'student_block'     a student with more than one course in a time block
+    #   'duplicate_course'  a student taking a course more than once
+    #   'section_blocks'    a section met in more than one block, by its students or by section_blocks
+    #   'course_block'      two sections of a course in the same block
+    #   'preference_set'    a student placed in set k whose courses are not exactly that set, or with
+    #                       whole_sets=True any student whose courses are none of their sets
+    # Returns {'valid', 'violations', 'violation_counts', 'rank_counts', 'unmatched', 'mean_rank'}, where a
+    # student's rank is the first preference set their courses match exactly. At most max_violations
+    # violations are listed, all of them are counted.
+    time_grid = time_grid or default_time_grid()
+    total_blocks = len(time_grid.blocks)
+    num_courses = len(courses)
+    domains = course_block_domains(courses, time_grid, allowed_blocks)
+    sections = np.asarray(sections, dtype=np.int64).reshape(num_courses)
+    capacity = np.asarray(section_capacity, dtype=np.int64).reshape(num_courses)
+    student, course, section, block = schedule_arrays(result, students)
+    section_course, section_section, section_block = section_block_arrays(result)
+    violations = []
+    violation_counts = {}
+
+    def report(check, found):
+        violation_counts[check] = violation_counts.get(check, 0) + len(found)
+        room = len(found) if max_violations is None else max(0, max_violations - len(violations))
+        violations.extend(dict(found[n], check=check) for n in range(min(room, len(found))))
+
+    in_domain = np.zeros((num_courses, total_blocks), dtype=bool)
+    for c, domain in enumerate(domains):
+        in_domain[c, domain] = True
+
+    def outside_inputs(course, section, block, owners=None):
+        # Reports the rows naming a course, section or block that does not exist, or a block outside the
+        # course's domain, and returns the mask of the other rows. owners are the students of the rows.
+        def rows(mask, **fields):
+            found = [{name: int(values[n]) + 1 for name, values in fields.items()} for n in np.flatnonzero(mask)]
+            if owners is not None:
+                for entry, i in zip(found, owners[mask].tolist()):
+                    entry['student'] = students[i]
+            return found
+        bad_course = (course < 0) | (course >= num_courses)
+        known = ~bad_course
+        bad_section = known.copy()
+        bad_section[known] = (section[known] < 0) | (section[known] >= sections[course[known]])
+        bad_block = known.copy()
+        bad_block[known] = (block[known] < 0) | (block[known] >= total_blocks)
+        inside = known & ~bad_block
+        bad_block[inside] = ~in_domain[course[inside], block[inside]]
+        report('course', rows(bad_course, course=course))
+        report('section', rows(bad_section, course=course, section=section))
+        report('time_block', rows(bad_block, course=course, time_block=block))
+        return known & ~bad_section & ~bad_block
+
+    # Rows outside the inputs are reported and left out of the other checks
+    valid = outside_inputs(course, section, block, student)
+    student, course, section, block = student[valid], course[valid], section[valid], block[valid]
+    valid = outside_inputs(section_course, section_section, section_block)
+    section_course, section_section, section_block = section_course[valid], section_section[valid], section_block[valid]
+
+    # Section capacity, sections numbered within their course
+    offsets = np.concatenate(([0], np.cumsum(sections)))
+    enrolled = np.bincount(offsets[course] + section, minlength=offsets[-1])
+    over = np.flatnonzero(enrolled > np.repeat(capacity, sections))
+    over_course = np.searchsorted(offsets, over, side='right') - 1
+    report('capacity', [{'course': c + 1, 'section': int(n - offsets[c]) + 1, 'students': int(enrolled[n]),
+                         'capacity': int(capacity[c])} for n, c in zip(over.tolist(), over_course.tolist())])
+
+    # One course per student per block, each course at most once
+    first, second, counts = duplicates(student, block, total_blocks)
+    report('student_block', [{'student': students[i], 'time_block': t + 1, 'courses': n}
+                             for i, t, n in zip(first.tolist(), second.tolist(), counts.tolist())])
+    first, second, counts = duplicates(student, course, num_courses)
+    report('duplicate_course', [{'student': students[i], 'course': c + 1, 'times': n}
+                                for i, c, n in zip(first.tolist(), second.tolist(), counts.tolist())])
+
+    # A section meets in one block, the one section_blocks gives it, and a course runs one section per block
+    max_sections = max(int(sections.max(initial=0)), 1)
+    meetings = np.unique((np.concatenate((course, section_course)) * max_sections +
+                          np.concatenate((section, section_section))) * total_blocks +
+                         np.concatenate((block, section_block)))
+    meeting_section, meeting_block = meetings // total_blocks, meetings % total_blocks
+    first, second, counts = duplicates(meeting_section // max_sections, meeting_section % max_sections, max_sections)
+    report('section_blocks', [{'course': c + 1, 'section': s + 1, 'blocks': n}
+                              for c, s, n in zip(first.tolist(), second.tolist(), counts.tolist())])
+    first, second, counts = duplicates(meeting_section // max_sections, meeting_block, total_blocks)
+    report('course_block', [{'course': c + 1, 'time_block': t + 1, 'sections': n}
+                            for c, t, n in zip(first.tolist(), second.tolist(), counts.tolist())])
+
+    # Each student's courses against each of their preference sets, as sums of random course keys
+    course_keys = np.random.default_rng(SET_HASH_SEED).integers(1, 2 ** 63, size=num_courses + 1, dtype=np.uint64)
+    taken = np.zeros(len(students), dtype=np.uint64)
+    np.add.at(taken, student, course_keys[course])
+    num_sets = np.fromiter(map(len, preferences), dtype=np.int64, count=len(preferences))
+    max_sets = int(num_sets.max(initial=0))
+    set_owner = np.repeat(np.arange(len(preferences)), num_sets)
+    set_rank = np.arange(len(set_owner)) - np.repeat(np.cumsum(num_sets) - num_sets, num_sets)
+    set_size = np.fromiter((len(preference_set) for student_sets in preferences for preference_set in student_sets),
+                           dtype=np.int64, count=len(set_owner))
+    set_course = np.fromiter((c for student_sets in preferences for preference_set in student_sets
+                              for c in preference_set), dtype=np.int64, count=int(set_size.sum())) - 1
+    # Course ids outside the inputs all share the last key
+    set_course[(set_course < 0) | (set_course >= num_courses)] = num_courses
+    set_keys = np.zeros((len(students), max_sets), dtype=np.uint64)
+    np.add.at(set_keys, (np.repeat(set_owner, set_size), np.repeat(set_rank, set_size)), course_keys[set_course])
+    has_set = np.zeros((len(students), max_sets), dtype=bool)
+    has_set[set_owner, set_rank] = True
+    matches = has_set & (set_keys == taken[:, None])
+    ranks = np.where(matches.any(axis=1), matches.argmax(axis=1) + 1, 0)
+
+    assigned = np.fromiter((result['preference_sets'].get(student_label) or 0 for student_label in students),
+                           dtype=np.int64, count=len(students))
+    placed = np.flatnonzero(assigned > 0)
+    wrong = placed[(assigned[placed] > has_set[placed].sum(axis=1))]
+    fits = placed[assigned[placed] <= has_set[placed].sum(axis=1)]
+    wrong = np.concatenate((wrong, fits[~matches[fits, assigned[fits] - 1]]))
+    if whole_sets:
+        wrong = np.concatenate((wrong, np.flatnonzero((assigned == 0) & (ranks == 0))))
+    wrong.sort()
+    order = np.argsort(student, kind='stable')
+    starts = np.searchsorted(student[order], np.arange(len(students) + 1))
+    report('preference_set', [{'student': students[i], 'preference_set': int(assigned[i]) or None,
+                               'courses': sorted((course[order[starts[i]:starts[i + 1]]] + 1).tolist())}
+                              for i in wrong.tolist()])
+
+    rank_counts = {k + 1: int(n) for k, n in enumerate(np.bincount(ranks, minlength=max_sets + 1)[1:])}
+    matched = ranks[ranks > 0]
+    return {
+        'valid': not any(violation_counts.values()),
+        'violations': violations,
+        'violation_counts': violation_counts,
+        'rank_counts': rank_counts,
+        'unmatched': int((ranks == 0).sum()),
+        'mean_rank': float(matched.mean()) if len(matched) else None
+    }
+
+
+if __name__ == '__main__':
+    # Checks a result written as JSON (with its keys back to integers) against a term of the inputs
+    from PreferenceStore import load_preference_store
+    parser = argparse.ArgumentParser(description='Check a schedule against its inputs')
+    parser.add_argument('result')
+    parser.add_argument('--term', type=int, default=1)
+    parser.add_argument('--preferences', default='student-preferences.json')
+    parser.add_argument('--courses', default='courses.json')
+    parser.add_argument('--whole-sets', action='store_true')
+    args = parser.parse_args()
+    with open(args.result) as file:
+        result = json.load(file)
+    result['section_blocks'] = {int(course): {int(section): block for section, block in blocks.items()}
+                                for course, blocks in result['section_blocks'].items()}
+    problem = load_preference_store(args.preferences, args.courses).term_problem(args.term)
+    students = problem[0]
+    # JSON object keys are strings, the students of the term may be numbers
+    labels = {str(student): student for student in students}
+    result['schedule'] = {labels[key]: entries for key, entries in result['schedule'].items()}
+    result['preference_sets'] = {labels[key]: k for key, k in result['preference_sets'].items()}
+    report = validate_schedule(result, *problem, whole_sets=args.whole_sets, max_violations=20)
+    print(json.dumps(report, indent=4, default=str))
+    raise SystemExit(0 if report['valid'] else 1)
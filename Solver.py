@@ -1,7 +1,190 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 from ortools.linear_solver import pywraplp
+from ColumnGenerationSolver import column_generation_course_schedule
+from Components import independent_components, component_problem, merge_component_results
+from CpSatSolver import solve_course_schedule
+from DecompositionSolver import decomposed_course_schedule
+from LnsSolver import lns_course_schedule
+from ModelSize import choose_model_build
+from Feasibility import screen_infeasibility
+from Metrics import phase, merge_phases, relative_gap, write_metrics
+from ScheduleCache import cache_key
+from ScheduleResult import schedule_result, print_solution, model_statistics
+from TimeGrid import default_time_grid, time_domain_key
+
+LINEAR_STATUS = {pywraplp.Solver.OPTIMAL: 'OPTIMAL', pywraplp.Solver.FEASIBLE: 'FEASIBLE',
+                 pywraplp.Solver.INFEASIBLE: 'INFEASIBLE', pywraplp.Solver.UNBOUNDED: 'UNBOUNDED',
+                 pywraplp.Solver.ABNORMAL: 'ABNORMAL', pywraplp.Solver.MODEL_INVALID: 'MODEL_INVALID',
+                 pywraplp.Solver.NOT_SOLVED: 'NOT_SOLVED'}
+
+def create_course_schedule(students, courses, preferences, sections, section_capacity,
+                           engine='cp_sat', num_workers=0, time_limit=None, log_search=False,
+                           symmetry_breaking=True, verbose=False, gap_limit=None, on_solution=None,
+                           objective='first_choices', cache=None, time_grid=None, allowed_blocks=None,
+                           prescreen=True, maximize=1, hint=None, components=False, group_profiles=False,
+                           formulation='standard', metrics_file=None, memory_budget=None):
+    # Every engine maximizes the number of students placed in one of their first `maximize` preference sets
+    # unless another objective is chosen. DifferentScheduleSolver is the same entry point with maximize first.
+    if engine not in ('cp_sat', 'decomposition', 'lns', 'column_generation', 'linear'):
+        raise ValueError(f"Unknown engine: {engine}")
+    if hint is not None and engine != 'cp_sat':
+        raise ValueError(f"Only the cp_sat engine takes a hint, not {engine}")
+    if group_profiles and engine != 'cp_sat':
+        raise ValueError(f"Only the cp_sat engine groups preference profiles, not {engine}")
+    if memory_budget is not None and (engine != 'cp_sat' or group_profiles):
+        raise ValueError("memory_budget applies to the per-student cp_sat model only")
+
+    # With a ScheduleCache, unchanged inputs and options return the stored schedule without building a model,
+    # and the cp_sat engine reuses the cached model when only the objective changed. A hint only changes
+    # where the search starts, so it is left out of the key.
+    if cache is not None:
+        key = cache_key('result', engine, objective, maximize, time_limit, gap_limit, symmetry_breaking,
+                        students, courses, preferences, sections, section_capacity,
+                        time_domain_key(time_grid, allowed_blocks))
+        result = cache.load_result(key)
+        if result is not None:
+            if verbose:
+                print_solution(result)
+            return result
 
-def create_course_schedule(students, courses, preferences, sections, section_capacity):
-    total_blocks = 20  # 5 days * total_blocks blocks/day
+    # result['statistics']['phases'] has the wall time and memory delta of every phase of the run, and for
+    # the cp_sat and linear engines the variables and constraints of every constraint family, see Metrics.
+    # result['statistics']['solver'] has the search statistics. With a metrics_file, every run appends
+    # its statistics there as one JSON line.
+    phases = {}
+
+    # Inputs that cannot have any schedule are rejected in milliseconds, without building a model.
+    # result['conflicts'] names the courses short of seats or the students who cannot be placed.
+    if prescreen:
+        with phase(phases, 'prescreen'):
+            conflicts = screen_infeasibility(students, courses, preferences, sections, section_capacity, time_grid,
+                                             allowed_blocks,
+                                             whole_sets=engine in ('decomposition', 'column_generation'))
+        if conflicts:
+            result = schedule_result('NOT OPTIMAL', students, preferences, statistics={'phases': phases},
+                                     conflicts=conflicts)
+            if metrics_file is not None:
+                write_run_metrics(metrics_file, result, engine, objective, formulation, students, courses)
+            if verbose:
+                print_solution(result)
+            return result
+
+    # With components=True, groups of students and courses that never share a preference set (separate
+    # tracks, say) are solved as separate problems in a process pool and their schedules merged
+    parts = independent_components(students, courses, preferences) if components else []
+    if len(parts) > 1:
+        if on_solution is not None or hint is not None:
+            raise ValueError("on_solution and hint cannot be combined with components")
+        result = solve_components(parts, students, courses, preferences, sections, section_capacity, allowed_blocks,
+                                  engine=engine, num_workers=num_workers, time_limit=time_limit,
+                                  log_search=log_search, symmetry_breaking=symmetry_breaking, gap_limit=gap_limit,
+                                  objective=objective, time_grid=time_grid, prescreen=False, maximize=maximize,
+                                  group_profiles=group_profiles, formulation=formulation,
+                                  memory_budget=memory_budget)
+        if verbose:
+            print_solution(result)
+    # Native CP-SAT backend, supports parallel search workers, time and gap limits, search logging and
+    # on_solution(result) callbacks for every improving schedule found before the search ends.
+    # group_profiles=True models students with identical preference lists together, as integer counts.
+    # formulation='aggregated' builds the same model with far fewer rows, see build_course_schedule_model.
+    # With a memory_budget in bytes, the model size is estimated from the inputs before anything is built.
+    # Over the budget, the model is built lean (unnamed variables, index ranges instead of dicts) and then
+    # in the aggregated formulation, and refused with ModelTooLargeError when neither fits.
+    elif engine == 'cp_sat':
+        estimate = None
+        if memory_budget is not None:
+            with phase(phases, 'estimate'):
+                estimate = choose_model_build(students, courses, preferences, sections, section_capacity,
+                                              memory_budget, time_grid, allowed_blocks, formulation,
+                                              symmetry_breaking)
+            formulation = estimate['formulation']
+        result = solve_course_schedule(students, courses, preferences, sections, section_capacity, maximize,
+                                       num_workers=num_workers, time_limit=time_limit, log_search=log_search,
+                                       symmetry_breaking=symmetry_breaking, verbose=verbose,
+                                       gap_limit=gap_limit, on_solution=on_solution, objective=objective,
+                                       cache=cache, time_grid=time_grid, allowed_blocks=allowed_blocks, hint=hint,
+                                       group_profiles=group_profiles, formulation=formulation,
+                                       lean=estimate is not None and estimate['lean'])
+        if estimate is not None:
+            result['statistics']['model_estimate'] = estimate
+    # Two-phase decomposition, preference-set selection first and timetabling second. Each student gets one
+    # whole preference set here, see decomposed_course_schedule for how that differs from the cp_sat model.
+    elif engine == 'decomposition':
+        result = decomposed_course_schedule(students, courses, preferences, sections, section_capacity, maximize,
+                                            num_workers=num_workers, time_limit=time_limit, verbose=verbose,
+                                            gap_limit=gap_limit, on_solution=on_solution, objective=objective,
+                                            time_grid=time_grid, allowed_blocks=allowed_blocks)
+    # Greedy construction improved by large-neighborhood search, for schools too large for the exact model.
+    # Never proves optimality unless everyone gets their first set, its result can seed cp_sat through hint=.
+    elif engine == 'lns':
+        result = lns_course_schedule(students, courses, preferences, sections, section_capacity, maximize,
+                                     num_workers=num_workers, time_limit=time_limit, verbose=verbose,
+                                     gap_limit=gap_limit, on_solution=on_solution, objective=objective,
+                                     time_grid=time_grid, allowed_blocks=allowed_blocks)
+    # Column generation over per-student patterns (a preference set and a block for each of its courses):
+    # GLOP solves the master LP, pricing adds the patterns its duals favor, and CP-SAT picks the timetable
+    # and patterns from those generated. Whole preference sets, as with decomposition.
+    elif engine == 'column_generation':
+        result = column_generation_course_schedule(students, courses, preferences, sections, section_capacity,
+                                                   maximize, num_workers=num_workers, time_limit=time_limit,
+                                                   verbose=verbose, gap_limit=gap_limit, on_solution=on_solution,
+                                                   objective=objective, time_grid=time_grid,
+                                                   allowed_blocks=allowed_blocks)
+    else:
+        if objective != 'first_choices':
+            raise ValueError(f"The linear engine only supports the first_choices objective, not {objective}")
+        if allowed_blocks:
+            raise ValueError("The linear engine does not support allowed_blocks")
+        result = linear_course_schedule(students, courses, preferences, sections, section_capacity, verbose,
+                                        time_grid, maximize, formulation)
+    merge_phases(phases, result['statistics'].get('phases', {}))
+    result['statistics']['phases'] = phases
+    result['statistics']['gap'] = relative_gap(result['statistics'])
+    if metrics_file is not None:
+        write_run_metrics(metrics_file, result, engine, objective, formulation, students, courses)
+    if cache is not None and result['schedule']:
+        cache.save_result(key, result)
+    return result
+
+def write_run_metrics(metrics_file, result, engine, objective, formulation, students, courses):
+    write_metrics(metrics_file, {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'engine': engine,
+                                 'objective_mode': objective, 'formulation': formulation,
+                                 'students': len(students), 'courses': len(courses), 'status': result['status'],
+                                 'statistics': result['statistics']})
+
+def schedule_component(problem, options):
+    return create_course_schedule(*problem, **options)
+
+def solve_components(parts, students, courses, preferences, sections, section_capacity, allowed_blocks=None,
+                     **options):
+    # Every component is solved in its own process, largest first, sharing the cores between the solves
+    # unless num_workers is given. Options are passed on to create_course_schedule.
+    max_processes = min(len(parts), os.cpu_count() or 1)
+    if not options.get('num_workers'):
+        options['num_workers'] = max(1, (os.cpu_count() or 1) // max_processes)
+    with ProcessPoolExecutor(max_workers=max_processes) as executor:
+        futures = []
+        for part in parts:
+            problem, part_allowed = component_problem(part, students, courses, preferences, sections,
+                                                      section_capacity, allowed_blocks)
+            futures.append(executor.submit(schedule_component, problem, dict(options, allowed_blocks=part_allowed)))
+        results = [future.result() for future in futures]
+    return merge_component_results(parts, students, courses, preferences, results, options.get('objective'))
+
+def linear_course_schedule(students, courses, preferences, sections, section_capacity, verbose=False,
+                           time_grid=None, maximize=1, formulation='standard'):
+    # Legacy pywraplp big-M model, kept as engine='linear'. formulation='aggregated' drops the big-M rows
+    # and the per-variable links for the rows described in build_course_schedule_model.
+    if formulation not in ('standard', 'aggregated'):
+        raise ValueError(f"Unknown formulation: {formulation}")
+    phases = {}
+    build_start = time.perf_counter()
+    total_blocks = len((time_grid or default_time_grid()).blocks)  # teachable blocks of the week, lunch excluded
     M=50 # Big M parameter value, larger than maximum course possible but keep away from INT MAX
     # Initialize the solver
     solver = pywraplp.Solver.CreateSolver('SAT')
@@ -9,151 +192,209 @@ def create_course_schedule(students, courses, preferences, sections, section_cap
     # Variables
     # Student Preference Assignment
     x = {}
-    for i in range(len(students)):
-        for k in range(len(preferences[i])):
-            x[i, k] = solver.BoolVar(f'x[{i},{k}]')
+    with phase(phases, 'preference_variables', solver):
+        for i in range(len(students)):
+            for k in range(len(preferences[i])):
+                x[i, k] = solver.BoolVar(f'x[{i},{k}]')
 
     # Student-Section Assignment
     y = {}
-    for i in range(len(students)):  # Iterate over each student
-        for c in range(len(courses)):  # Iterate over each course
-            for s in range(sections[c]):  # Iterate over each section of the course
-                for t in range(total_blocks):
-                # Create a Boolean variable for each student-course-section combination
-                    y[i, c, s,t] = solver.BoolVar(f'y[{i},{c},{s}]')
+    with phase(phases, 'student_section_variables', solver):
+        for i in range(len(students)):  # Iterate over each student
+            for c in range(len(courses)):  # Iterate over each course
+                for s in range(sections[c]):  # Iterate over each section of the course
+                    for t in range(total_blocks):
+                    # Create a Boolean variable for each student-course-section combination
+                        y[i, c, s,t] = solver.BoolVar(f'y[{i},{c},{s}]')
 
     # course section time block assignment
     z = {}
-    for c in range(len(courses)):
-        for s in range(sections[c]):
-            for t in range(total_blocks):
-                z[c, s, t] = solver.BoolVar(f'z[{c},{s},{t}]')
+    with phase(phases, 'section_variables', solver):
+        for c in range(len(courses)):
+            for s in range(sections[c]):
+                for t in range(total_blocks):
+                    z[c, s, t] = solver.BoolVar(f'z[{c},{s},{t}]')
 
                 
     # Align the course section time block assignment variables with the student-section-time assignment variables
-    for i in range(len(students)):  # Iterate over each student
-        for c in range(len(courses)):  # Iterate over each course
-            for s in range(sections[c]):  # Iterate over each section of the course
-                for t in range(total_blocks):  # Iterate over each time block
-                    # Add a constraint that if a student is assigned to a course section at a time block,
-                    # then that course section must be scheduled at that time block
-                    solver.Add(y[i, c, s, t] <= z[c, s, t])
+    with phase(phases, 'section_links', solver):
+        for i in range(len(students)):  # Iterate over each student
+            for c in range(len(courses)):  # Iterate over each course
+                for s in range(sections[c]):  # Iterate over each section of the course
+                    for t in range(total_blocks):  # Iterate over each time block
+                        # Add a constraint that if a student is assigned to a course section at a time block,
+                        # then that course section must be scheduled at that time block
+                        if formulation == 'standard':
+                            solver.Add(y[i, c, s, t] <= z[c, s, t])
 
     # Each section of courses is assigned to at most one time block
-    for c in range(len(courses)):
-        for s in range(sections[c]):
-            # Ensure each section is assigned to at most one time block
-            solver.Add(sum(z[c, s, t] for t in range(total_blocks)) <= 1)
+    with phase(phases, 'section_blocks', solver):
+        for c in range(len(courses)):
+            for s in range(sections[c]):
+                # Ensure each section is assigned to at most one time block
+                solver.Add(sum(z[c, s, t] for t in range(total_blocks)) <= 1)
     
     # No multiple section of a same course can be assigned to the same time block
-    for i in range(len(courses)):
-        for t in range(total_blocks):
-            section_sum = []
-            for j in range(sections[i]):
-                section_sum.append(z[i, j, t])
-            solver.Add(solver.Sum(section_sum) <= 1)
+    with phase(phases, 'section_overlap', solver):
+        for i in range(len(courses)):
+            for t in range(total_blocks):
+                section_sum = []
+                for j in range(sections[i]):
+                    section_sum.append(z[i, j, t])
+                solver.Add(solver.Sum(section_sum) <= 1)
 
     # Course capacities
-    for i in range(len(courses)):
-        for t in range(sections[i]):
-            student_sum = [y[j, i, t, c] for c in range(total_blocks) for j in range(len(students))]
-            solver.Add(solver.Sum(student_sum) <= section_capacity[i])
+    with phase(phases, 'capacity', solver):
+        for i in range(len(courses)):
+            for t in range(sections[i]):
+                if formulation == 'aggregated':
+                    # Each block's row links the students to the section and bounds its seats at once
+                    for c in range(total_blocks):
+                        solver.Add(solver.Sum(y[j, i, t, c] for j in range(len(students))) <= section_capacity[i] * z[i, t, c])
+                    continue
+                student_sum = [y[j, i, t, c] for c in range(total_blocks) for j in range(len(students))]
+                solver.Add(solver.Sum(student_sum) <= section_capacity[i])
          
    
     
     # Each student is assigned to at most one set of preferred courses
-    for i in range(len(students)):
-        solver.Add(solver.Sum(x[i, k] for k in range(len(preferences[i]))) <= 1)
+    with phase(phases, 'one_preference_set', solver):
+        for i in range(len(students)):
+            solver.Add(solver.Sum(x[i, k] for k in range(len(preferences[i]))) <= 1)
 
     # Students can only take one course during each time block
-    for i in range(len(students)):  # Iterate over each student
-        for t in range(total_blocks):  # Iterate over each time block
-            # Add a constraint that sums all y[i, c, s, t] for student i at time t across all courses and sections
-            # The sum should be less than or equal to 1, ensuring only one course per time block
-            solver.Add(solver.Sum(y[i, c-1, s, t] for c in courses for s in range(sections[c-1])) <= 1)
+    with phase(phases, 'student_overlap', solver):
+        for i in range(len(students)):  # Iterate over each student
+            for t in range(total_blocks):  # Iterate over each time block
+                # Add a constraint that sums all y[i, c, s, t] for student i at time t across all courses and sections
+                # The sum should be less than or equal to 1, ensuring only one course per time block
+                solver.Add(solver.Sum(y[i, c-1, s, t] for c in courses for s in range(sections[c-1])) <= 1)
 
     # Align the student-section-time assignment variables with the student-preference assignment variables
-    for i in range(len(students)):  # Iterate over each student
-        for k in range(len(preferences[i])):  # Iterate over each preference set for student i
-            total_courses = [y[i, c, s, t] for c in range(len(courses)) for s in range(sections[c]) for t in range(total_blocks)]
+    with phase(phases, 'preference_set_rows', solver):
+        for i in range(len(students)):  # Iterate over each student
+            for k in range(len(preferences[i])):  # Iterate over each preference set for student i
+                total_courses = [y[i, c, s, t] for c in range(len(courses)) for s in range(sections[c]) for t in range(total_blocks)]
 
-            # Use big M method to introduce a constraint
-            # If x[i,k]=1, we force the sum of total courses of this student to the length of the preference set
-            # Otherwise we introduce a loose bound that's equivalent to no constraint.
-            solver.Add(solver.Sum(total_courses) <=len(preferences[i][k])+M*(1-x[i,k]))
-            solver.Add(solver.Sum(total_courses) >=len(preferences[i][k])-M*(1-x[i,k]))
-            for c in preferences[i][k]:  # Iterate over each course in the k-th preference set
-                # Create a list to hold the section-time assignment variables for course c
-                section_time_assignments = [y[i, c-1, s, t] for s in range(sections[c-1]) for t in range(total_blocks)]
+                if formulation == 'aggregated':
+                    # The student takes len(preferences[i]) courses below, so only a set of that size can be chosen
+                    if len(preferences[i][k]) != len(preferences[i]):
+                        x[i, k].SetUb(0)
+                else:
+                    # Use big M method to introduce a constraint
+                    # If x[i,k]=1, we force the sum of total courses of this student to the length of the preference set
+                    # Otherwise we introduce a loose bound that's equivalent to no constraint.
+                    solver.Add(solver.Sum(total_courses) <=len(preferences[i][k])+M*(1-x[i,k]))
+                    solver.Add(solver.Sum(total_courses) >=len(preferences[i][k])-M*(1-x[i,k]))
+                for c in preferences[i][k]:  # Iterate over each course in the k-th preference set
+                    # Create a list to hold the section-time assignment variables for course c
+                    section_time_assignments = [y[i, c-1, s, t] for s in range(sections[c-1]) for t in range(total_blocks)]
 
-                # Add a constraint that ensures the sum of section-time assignments for course c is equal to x[i, k]
-                # This means if x[i, k] = 1 (preference set k is selected), exactly one section-time assignment must be selected for course c
-                # If x[i, k] = 0, no section-time assignment should be selected for course c
+                    # Add a constraint that ensures the sum of section-time assignments for course c is equal to x[i, k]
+                    # This means if x[i, k] = 1 (preference set k is selected), exactly one section-time assignment must be selected for course c
+                    # If x[i, k] = 0, no section-time assignment should be selected for course c
 
 
-                # Ensures a universal upper bound
-                solver.Add(solver.Sum(section_time_assignments) <= 1)
+                    # Ensures a universal upper bound, once per requested course in the aggregated formulation
+                    if formulation == 'standard':
+                        solver.Add(solver.Sum(section_time_assignments) <= 1)
 
-                # Constraint ensuring that if x[i, k] = 1, then one section_time_assignment must be selected, otherwise no constraint
-                solver.Add(solver.Sum(section_time_assignments) >= x[i, k])
+                    # Constraint ensuring that if x[i, k] = 1, then one section_time_assignment must be selected, otherwise no constraint
+                    solver.Add(solver.Sum(section_time_assignments) >= x[i, k])
 
-    for i in range(len(students)):
-        solver.Add(solver.Sum(y[i, c, s, t] for c in range(len(courses)) for s in range(sections[c]) for t in range(total_blocks)) == len(preferences[i]))
+        for i in range(len(students)):
+            if formulation == 'aggregated':
+                for c in {c - 1 for preference_set in preferences[i] for c in preference_set}:
+                    solver.Add(solver.Sum(y[i, c, s, t] for s in range(sections[c]) for t in range(total_blocks)) <= 1)
+            solver.Add(solver.Sum(y[i, c, s, t] for c in range(len(courses)) for s in range(sections[c]) for t in range(total_blocks)) == len(preferences[i]))
 
     # Objective
     # Maximize the total number of students attending their first or second preferred set of courses
-    solver.Maximize(solver.Sum([x[i, k] for i in range(len(students)) for k in range(1)]))
+    with phase(phases, 'objective', solver):
+        solver.Maximize(solver.Sum([x[i, k] for i in range(len(students)) for k in range(min(maximize, len(preferences[i])))]))
     
-    # Solve
-    status = solver.Solve()
+    build_time = time.perf_counter() - build_start
 
-    schedule = {}
+    # Solve
+    solve_start = time.perf_counter()
+    with phase(phases, 'solve'):
+        status = solver.Solve()
+    statistics = model_statistics(build_time, time.perf_counter() - solve_start,
+                                  solver.NumVariables(), solver.NumConstraints())
+    statistics['phases'] = phases
+    statistics['solver'] = {'status': LINEAR_STATUS.get(status, str(status)), 'solves': 1,
+                            'wall_time': solver.wall_time() / 1000}
+    if status in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
+        statistics['objective'] = solver.Objective().Value()
+        statistics['best_bound'] = solver.Objective().BestBound()
 
-    if status == pywraplp.Solver.OPTIMAL:
-        print("Solver status:", status)
-        print('Solution:')
-        for i in range(len(students)):  # Iterate over each student
-            student_schedule = []
-            for c in range(len(courses)):  # Iterate over each course
-                for s in range(sections[c]):  # Iterate over each section of the course
-                    for t in range(total_blocks):  # Iterate over each time block
-                        if y[i, c, s, t].solution_value() > 0:
-                            print(f"Student {i} attends course {c+1} assigned to section {s+1} at time block {t+1}")
-                            student_schedule.append({
-                                'course': c+1,
-                                'section': s+1,
-                                'time_block': t+1
-                            })
-            schedule[students[i]] = student_schedule
-        for i in range(len(students)):
-            for k in range(len(preferences[i])):
-                if x[i, k].solution_value() > 0:
-                    print(f"Student {students[i]} assigned to preference set {k+1}: {preferences[i][k]}")
-        for c in range(len(courses)):
-            for s in range(sections[c]):
-                for t in range(total_blocks):
-                    if z[c, s, t].solution_value() > 0:
-                        print(f"Course {c+1} section {s+1} assigned at time block {t+1}")
+    if status != pywraplp.Solver.OPTIMAL:
+        result = schedule_result('NOT OPTIMAL', students, preferences, statistics=statistics)
     else:
-        print("Solver status:", status)
-        print('No solution found.')
-    
-    return {
-        'status': 'OPTIMAL' if status == pywraplp.Solver.OPTIMAL else 'NOT OPTIMAL',
-        'schedule': schedule
-    }
-
-# Example data setup
-students = ["Student 1", "Student 2", "Student 3", "Student 4"]
-courses = [1, 2, 3, 4, 5, 6, 7]
-preferences = [
-    [[2, 3, 6, 7], [1, 4, 5, 6], [2, 4, 6, 7], [1, 3, 5, 7]],  # Preferences for Student 1
-    [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]],  # Preferences for Student 2
-    [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]], 
-    [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]]
-]
-
-sections = [2, 3, 2, 2, 3, 2, 2]  # Number of sections for each course
-section_capacity = [3, 3, 3, 3, 3, 3, 3]  # Capacity for each section of each course
-
-create_course_schedule(students, courses, preferences, sections, section_capacity)
\ No newline at end of file
+        with phase(phases, 'extract'):
+            schedule = {}
+            for i in range(len(students)):  # Iterate over each student
+                student_schedule = []
+                for c in range(len(courses)):  # Iterate over each course
+                    for s in range(sections[c]):  # Iterate over each section of the course
+                        for t in range(total_blocks):  # Iterate over each time block
+                            if y[i, c, s, t].solution_value() > 0:
+                                student_schedule.append({
+                                    'course': c+1,
+                                    'section': s+1,
+                                    'time_block': t+1
+                                })
+                schedule[students[i]] = student_schedule
+            preference_sets = {student: None for student in students}
+            for i in range(len(students)):
+                for k in range(len(preferences[i])):
+                    if x[i, k].solution_value() > 0:
+                        preference_sets[students[i]] = k+1
+            section_blocks = {}
+            for c in range(len(courses)):
+                for s in range(sections[c]):
+                    for t in range(total_blocks):
+                        if z[c, s, t].solution_value() > 0:
+                            section_blocks.setdefault(c+1, {})[s+1] = t+1
+        result = schedule_result('OPTIMAL', students, preferences, schedule, preference_sets, section_blocks,
+                                 statistics)
+    if verbose:
+        print_solution(result)
+    return result
+
+def stream_course_schedule(*args, **kwargs):
+    # Generator over the improving schedules of create_course_schedule while the search is still running,
+    # the final result is always yielded last. Takes the same arguments as create_course_schedule.
+    solutions = queue.Queue()
+
+    def solve():
+        try:
+            result = create_course_schedule(*args, on_solution=lambda result: solutions.put((False, result)), **kwargs)
+            solutions.put((True, result))
+        except BaseException as error:
+            solutions.put((True, error))
+
+    threading.Thread(target=solve, daemon=True).start()
+    while True:
+        final, result = solutions.get()
+        if isinstance(result, BaseException):
+            raise result
+        yield result
+        if final:
+            return
+
+if __name__ == '__main__':
+    # Example data setup
+    students = ["Student 1", "Student 2", "Student 3", "Student 4"]
+    courses = [1, 2, 3, 4, 5, 6, 7]
+    preferences = [
+        [[2, 3, 6, 7], [1, 4, 5, 6], [2, 4, 6, 7], [1, 3, 5, 7]],  # Preferences for Student 1
+        [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]],  # Preferences for Student 2
+        [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]], 
+        [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]]
+    ]
+
+    sections = [2, 3, 2, 2, 3, 2, 2]  # Number of sections for each course
+    section_capacity = [3, 3, 3, 3, 3, 3, 3]  # Capacity for each section of each course
+
+    create_course_schedule(students, courses, preferences, sections, section_capacity, verbose=True)
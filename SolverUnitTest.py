@@ -1,5 +1,29 @@
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
-from Solver import create_course_schedule
+from Solver import create_course_schedule, stream_course_schedule
+import DifferentScheduleSolver
+from BatchScheduler import schedule_all_terms
+from PreferenceStore import load_preference_store, build_preference_store
+from Benchmark import generate_school, run_case
+from CpSatSolver import build_course_schedule_model, build_lean_course_schedule_model, weights_fit, split_group_blocks
+from ModelSize import estimate_model_size, ModelTooLargeError
+from Metrics import model_size
+from ScheduleCache import ScheduleCache
+from TimeGrid import TimeGrid, load_time_grid, default_time_grid
+from Feasibility import screen_infeasibility
+from Components import independent_components
+from ScheduleSession import ScheduleSession
+from ScheduleService import ScheduleService, service_request
+from ScheduleValidator import validate_schedule
+from ScheduleExport import write_student_schedules, write_section_schedules, write_schedule_csv
 import random
 
 class TestCourseScheduler(unittest.TestCase):
@@ -62,6 +86,785 @@ class TestCourseScheduler(unittest.TestCase):
         self.assertEqual(result['status'], 'OPTIMAL')
         self.assertEqual(len(result['schedule']), len(students))
 
+    def test_linear_engine_matches_cp_sat(self):
+        students = ["Alice", "Bob"]
+        courses = [1, 2]
+        preferences = [[[1], [2]], [[2], [1]]]
+        sections = [1, 1]
+        section_capacity = [2, 2]
+
+        linear = create_course_schedule(students, courses, preferences, sections, section_capacity, engine='linear')
+        cp_sat = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                        engine='cp_sat', num_workers=2, time_limit=10)
+
+        self.assertEqual(linear['status'], cp_sat['status'])
+        self.assertEqual(linear['schedule'].keys(), cp_sat['schedule'].keys())
+
+    def test_lns_engine(self):
+        preferences_data, courses_data = generate_school(40, num_courses=12, seed=2)
+        students, courses, preferences, sections, section_capacity = build_preference_store(preferences_data, courses_data).term_problem(1)
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity, engine='lns',
+                                        time_limit=10, num_workers=2)
+
+        self.assertIn(result['status'], ('OPTIMAL', 'FEASIBLE'))
+        seats = {}
+        for i, student in enumerate(students):
+            entries = result['schedule'][student]
+            self.assertEqual(len(entries), len(preferences[i]))
+            self.assertEqual(len({entry['time_block'] for entry in entries}), len(entries))
+            for entry in entries:
+                self.assertEqual(result['section_blocks'][entry['course']][entry['section']], entry['time_block'])
+                seats[entry['course'], entry['section']] = seats.get((entry['course'], entry['section']), 0) + 1
+        for (course, section), taken in seats.items():
+            self.assertLessEqual(taken, section_capacity[course - 1])
+
+        # The heuristic schedule is a complete hint, so the exact engine starts from its objective
+        hinted = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                        time_limit=10, num_workers=2, hint=result)
+        self.assertGreaterEqual(hinted['statistics']['objective'], result['statistics']['objective'])
+        with self.assertRaises(ValueError):
+            create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                   engine='decomposition', hint=result)
+
+        # As in the cp_sat model, a set smaller than the number of sets is never placed
+        mixed_students = [f"Student {i}" for i in range(12)]
+        mixed_preferences = [[[1, 2], [3], [2, 4, 5]] if i % 2 else [[5, 3], [1, 3]] for i in range(12)]
+        mixed = create_course_schedule(mixed_students, [1, 2, 3, 4, 5], mixed_preferences, [1] * 5, [6] * 5,
+                                       engine='lns', objective='weighted', time_limit=5)
+        self.assertEqual(mixed['preference_counts'], {1: 6, 2: 0, 3: 0})
+
+    def test_independent_components(self):
+        # Two tracks on disjoint courses, and a student without preferences
+        students = ["Alice", "Bob", "Carol", "Dave", "Erin"]
+        courses = [1, 2, 3, 4, 5]
+        preferences = [[[1, 3], [3, 1]], [[4], [5]], [[3, 1], [1, 3]], [], [[5], [4]]]
+        sections = [1, 1, 1, 1, 1]
+        section_capacity = [2, 2, 2, 2, 2]
+
+        self.assertEqual(independent_components(students, courses, preferences),
+                         [([0, 2, 3], [0, 2]), ([1, 4], [3, 4])])
+        # The decomposition engine has every student take a whole set, so Dave gets one of his own
+        preferences[3] = [[2]]
+        for engine in ('cp_sat', 'decomposition', 'linear'):
+            whole = create_course_schedule(students, courses, preferences, sections, section_capacity, engine=engine)
+            split = create_course_schedule(students, courses, preferences, sections, section_capacity, engine=engine,
+                                           components=True)
+
+            self.assertEqual(split['status'], whole['status'])
+            self.assertEqual(split['preference_counts'], whole['preference_counts'])
+            self.assertEqual(split['statistics']['components'], 3)
+            self.assertEqual(list(split['schedule']), students)
+            self.assertEqual({entry['course'] for entry in split['schedule']['Bob'] + split['schedule']['Erin']}, {4, 5})
+            for entries in split['schedule'].values():
+                for entry in entries:
+                    self.assertEqual(split['section_blocks'][entry['course']][entry['section']], entry['time_block'])
+
+    def test_aggregated_formulation(self):
+        students = [f"Student {i}" for i in range(12)]
+        courses = [1, 2, 3, 4, 5]
+        preferences = [[[1, 2], [3], [2, 4, 5]] if i % 2 else [[5, 3], [1, 3]] for i in range(12)]
+        sections = [1, 1, 1, 1, 1]
+        section_capacity = [6, 6, 6, 6, 6]
+
+        for engine in ('cp_sat', 'linear'):
+            standard = create_course_schedule(students, courses, preferences, sections, section_capacity, engine=engine)
+            aggregated = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                                engine=engine, formulation='aggregated')
+
+            self.assertEqual(aggregated['status'], 'OPTIMAL')
+            self.assertEqual(aggregated['preference_counts'], standard['preference_counts'])
+            self.assertLess(aggregated['statistics']['num_constraints'], standard['statistics']['num_constraints'] / 2)
+            for student_schedule in aggregated['schedule'].values():
+                for entry in student_schedule:
+                    self.assertEqual(aggregated['section_blocks'][entry['course']][entry['section']], entry['time_block'])
+        with self.assertRaises(ValueError):
+            create_course_schedule(students, courses, preferences, sections, section_capacity, formulation='big-m')
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            create_course_schedule(["Alice"], [1], [[[1]]], [1], [1], engine='simplex')
+
+    def test_variables_only_for_requested_courses(self):
+        students = ["Alice", "Bob"]
+        courses = [1, 2, 3, 4]
+        preferences = [[[1], [2]], [[3]]]
+        sections = [1, 2, 1, 3]
+        section_capacity = [2, 2, 2, 2]
+
+        model, x, y, z, student_courses = build_course_schedule_model(students, courses, preferences, sections, section_capacity)
+
+        self.assertEqual(student_courses, [[0, 1], [2]])
+        self.assertEqual({(i, c) for i, c, s, t in y}, {(0, 0), (0, 1), (1, 2)})
+        self.assertEqual(len(y), (1 + 2 + 1) * 20)
+
+    def test_decomposition_engine(self):
+        students = ["Student " + str(i) for i in range(100)]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3], [3, 1]] for _ in students]
+        sections = [5, 5, 5]
+        section_capacity = [20, 20, 20]
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity, engine='decomposition')
+
+        self.assertEqual(result['status'], 'OPTIMAL')
+        self.assertEqual(len(result['schedule']), len(students))
+        for student_schedule in result['schedule'].values():
+            self.assertEqual(len({entry['time_block'] for entry in student_schedule}), len(student_schedule))
+
+    def test_decomposition_feedback_cut(self):
+        # The first choice of Alice needs more courses than there are time blocks
+        students = ["Alice", "Bob"]
+        courses = list(range(1, 22))
+        preferences = [[list(range(1, 22)), [1]], [[2], [3]]]
+        sections = [1] * 21
+        section_capacity = [2] * 21
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity, engine='decomposition')
+
+        self.assertEqual(result['status'], 'FEASIBLE')
+        self.assertEqual([entry['course'] for entry in result['schedule']['Alice']], [1])
+
+    def test_decomposition_no_solution_possible(self):
+        students = ["Student " + str(i) for i in range(100)]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3], [3, 1]] for _ in students]
+        sections = [5, 5, 5]
+        section_capacity = [10, 10, 10]
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity, engine='decomposition')
+
+        self.assertEqual(result['status'], 'NOT OPTIMAL')
+        self.assertEqual(result['schedule'], {})
+
+    def test_split_group_blocks(self):
+        counts = {0: [2, 1, 0], 1: [0, 1, 2]}
+
+        assignments = split_group_blocks(counts, 3, 3)
+
+        self.assertEqual(len(assignments), 3)
+        for assignment in assignments:
+            self.assertEqual(set(assignment), {0, 1})
+            self.assertNotEqual(assignment[0], assignment[1])
+        for c in counts:
+            self.assertEqual([sum(1 for a in assignments if a[c] == t) for t in range(3)], counts[c])
+
+    def test_split_group_blocks_with_optional_courses(self):
+        # Every member takes course 0 and one of courses 1 and 2
+        counts = {0: [2, 0, 1], 1: [0, 2, 0], 2: [1, 0, 0]}
+
+        assignments = split_group_blocks(counts, 3, 3, 2)
+
+        self.assertEqual(len(assignments), 3)
+        for assignment in assignments:
+            self.assertEqual(len(assignment), 2)
+            self.assertIn(0, assignment)
+            self.assertEqual(len(set(assignment.values())), 2)
+        for c in counts:
+            self.assertEqual([sum(1 for a in assignments if a.get(c) == t) for t in range(3)], counts[c])
+
+    def test_group_profiles(self):
+        # Three students share one profile, and the odd students' first set is smaller than their number of sets
+        students = ["Student 1", "Student 2", "Student 3", "Student 4"]
+        courses = [1, 2, 3, 4, 5, 6, 7]
+        preferences = [
+            [[2, 3, 6, 7], [1, 4, 5, 6], [2, 4, 6, 7], [1, 3, 5, 7]],
+            [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]],
+            [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]],
+            [[1, 2, 3, 4], [2, 3, 5, 6], [1, 4, 6, 7], [3, 5, 6, 7]]
+        ]
+        sections = [2, 3, 2, 2, 3, 2, 2]
+        section_capacity = [3, 3, 3, 3, 3, 3, 3]
+        mixed_students = [f"Student {i}" for i in range(12)]
+        mixed_preferences = [[[1, 2], [3], [2, 4, 5]] if i % 2 else [[5, 3], [1, 3]] for i in range(12)]
+
+        for problem in ((students, courses, preferences, sections, section_capacity),
+                        (mixed_students, [1, 2, 3, 4, 5], mixed_preferences, [1] * 5, [6] * 5)):
+            single = create_course_schedule(*problem, objective='weighted')
+            grouped = create_course_schedule(*problem, objective='weighted', group_profiles=True)
+
+            self.assertEqual(grouped['status'], 'OPTIMAL')
+            self.assertEqual(grouped['preference_counts'], single['preference_counts'])
+            self.assertLess(grouped['statistics']['num_variables'], single['statistics']['num_variables'])
+            seats = {}
+            for i, student in enumerate(problem[0]):
+                entries = grouped['schedule'][student]
+                self.assertEqual(len(entries), len(problem[2][i]))
+                self.assertEqual(len({entry['time_block'] for entry in entries}), len(entries))
+                k = grouped['preference_sets'][student]
+                if k is not None:
+                    self.assertEqual({entry['course'] for entry in entries}, set(problem[2][i][k - 1]))
+                for entry in entries:
+                    self.assertEqual(grouped['section_blocks'][entry['course']][entry['section']], entry['time_block'])
+                    seats[entry['course'], entry['section']] = seats.get((entry['course'], entry['section']), 0) + 1
+            for (course, section), taken in seats.items():
+                self.assertLessEqual(taken, problem[4][course - 1])
+
+    def test_sections_ordered_by_time_block(self):
+        students = ["Student " + str(i) for i in range(8)]
+        courses = [1]
+        preferences = [[[1]] for _ in students]
+        sections = [4]
+        section_capacity = [2]
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity)
+
+        self.assertEqual(result['status'], 'OPTIMAL')
+        section_blocks = {entry['section']: entry['time_block'] for entries in result['schedule'].values() for entry in entries}
+        self.assertEqual(sorted(section_blocks), [1, 2, 3, 4])
+        self.assertEqual([section_blocks[s] for s in range(1, 5)], sorted(section_blocks.values()))
+
+    def test_schedule_all_terms(self):
+        students = [
+            {"studentId": 1, "terms": [{"termId": 1, "coursesPreferences": [[1, 2]]}, {"termId": 2, "coursesPreferences": [[2]]}]},
+            {"studentId": 2, "terms": [{"termId": 1, "coursesPreferences": [[2], [1]]}, {"termId": 2, "coursesPreferences": [[1, 2]]}]}
+        ]
+        courses = [
+            {"id": 1, "name": "Mathematics", "code": "MATH101", "maxSeats": 2, "maxSections": 1},
+            {"id": 2, "name": "History", "code": "HIST202", "maxSeats": 2, "maxSections": 1}
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            preferences_file = os.path.join(directory, 'student-preferences.json')
+            courses_file = os.path.join(directory, 'courses.json')
+            with open(preferences_file, 'w') as file:
+                json.dump(students, file)
+            with open(courses_file, 'w') as file:
+                json.dump(courses, file)
+
+            results = schedule_all_terms(preferences_file, courses_file, max_processes=2, engine='decomposition')
+
+        self.assertEqual(sorted(results), [1, 2])
+        self.assertEqual(results[1]['status'], 'OPTIMAL')
+        self.assertEqual(len(results[2]['schedule'][2]), 2)
+
+    def test_preference_store_cache(self):
+        students = [
+            {"studentId": 7, "terms": [{"termId": 1, "coursesPreferences": [[1, 2], [3]]}, {"termId": 2, "coursesPreferences": [[2]]}]},
+            {"studentId": 9, "terms": [{"termId": 2, "coursesPreferences": [[3, 1, 2]]}]}
+        ]
+        courses = [
+            {"id": 1, "name": "Mathematics", "code": "MATH101", "maxSeats": 25, "maxSections": 2},
+            {"id": 2, "name": "History", "code": "HIST202", "maxSeats": 25, "maxSections": 4},
+            {"id": 3, "name": "Computer Science", "code": "CS301", "maxSeats": 20, "maxSections": 3}
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            preferences_file = os.path.join(directory, 'student-preferences.json')
+            courses_file = os.path.join(directory, 'courses.json')
+            cache_file = os.path.join(directory, 'cache.npz')
+            with open(preferences_file, 'w') as file:
+                json.dump(students, file)
+            with open(courses_file, 'w') as file:
+                json.dump(courses, file)
+
+            parsed = load_preference_store(preferences_file, courses_file, cache_file)
+            cached = load_preference_store(preferences_file, courses_file, cache_file)
+
+            for store in (parsed, cached):
+                self.assertEqual(store.terms(), [1, 2])
+                self.assertEqual(store.term_preferences(1), ([7], [[[1, 2], [3]]]))
+                self.assertEqual(store.term_preferences(2), ([7, 9], [[[2]], [[3, 1, 2]]]))
+                self.assertEqual(store.term_problem(2)[3:], ([2, 4, 3], [25, 25, 20]))
+            self.assertEqual(cached.catalog_codes.tolist(), ['MATH101', 'HIST202', 'CS301'])
+
+    def test_structured_result(self):
+        students = ["Alice", "Bob", "Carol"]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3]], [[2, 3], [1, 3]], [[1, 3], [2, 3]]]
+        sections = [1, 2, 1]
+        section_capacity = [2, 2, 3]
+
+        for engine in ('cp_sat', 'decomposition', 'lns', 'linear'):
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                result = create_course_schedule(students, courses, preferences, sections, section_capacity, engine=engine)
+
+            self.assertEqual(output.getvalue(), '')
+            self.assertEqual(result['status'], 'OPTIMAL')
+            self.assertEqual(result['preference_sets'], {"Alice": 1, "Bob": 1, "Carol": 1})
+            self.assertEqual(result['preference_counts'], {1: 3, 2: 0})
+            for student, entries in result['schedule'].items():
+                for entry in entries:
+                    self.assertEqual(result['section_blocks'][entry['course']][entry['section']], entry['time_block'])
+
+    def test_generate_school(self):
+        preferences_data, courses_data = generate_school(30, num_courses=10, num_preference_sets=3, courses_per_set=2,
+                                                         num_terms=2, seed=5)
+
+        self.assertEqual((preferences_data, courses_data), generate_school(30, num_courses=10, num_preference_sets=3,
+                                                                           courses_per_set=2, num_terms=2, seed=5))
+        self.assertEqual(len(preferences_data), 30)
+        self.assertEqual([course['id'] for course in courses_data], list(range(1, 11)))
+        for student in preferences_data:
+            self.assertEqual([term['termId'] for term in student['terms']], [1, 2])
+            for term in student['terms']:
+                self.assertEqual(len(term['coursesPreferences']), 3)
+                for preference_set in term['coursesPreferences']:
+                    self.assertEqual(len(set(preference_set)), 2)
+
+    def test_benchmark_case(self):
+        record = run_case('Solver', 'decomposition', {'num_students': 20, 'num_courses': 8, 'seed': 1})
+
+        self.assertEqual(record['status'], 'OPTIMAL')
+        self.assertEqual(record['students'], 20)
+        for key in ('wall_time', 'peak_rss_kb', 'build_time', 'solve_time', 'num_variables', 'num_constraints', 'objective'):
+            self.assertIn(key, record)
+        self.assertTrue(record['valid'])
+
+    def test_time_limit_keeps_best_schedule(self):
+        preferences_data, courses_data = generate_school(10, num_courses=12, seed=2)
+        problem = build_preference_store(preferences_data, courses_data).term_problem(1)
+
+        results = list(stream_course_schedule(*problem, time_limit=5, num_workers=1))
+
+        final = results[-1]
+        self.assertIn(final['status'], ('OPTIMAL', 'FEASIBLE'))
+        self.assertEqual(len(final['schedule']), 10)
+        self.assertLessEqual(final['statistics']['objective'], final['statistics']['best_bound'])
+        objectives = [result['statistics']['objective'] for result in results[:-1]]
+        self.assertEqual(objectives, sorted(objectives))
+        self.assertTrue(all(result['status'] == 'FEASIBLE' for result in results[:-1]))
+
+    def test_gap_limit(self):
+        students = ["Student " + str(i) for i in range(100)]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3], [3, 1]] for _ in students]
+        sections = [5, 5, 5]
+        section_capacity = [20, 20, 20]
+        solutions = []
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                        engine='decomposition', gap_limit=1.0, on_solution=solutions.append)
+
+        self.assertIn(result['status'], ('OPTIMAL', 'FEASIBLE'))
+        self.assertEqual(solutions, [result])
+
+    def test_lexicographic_objective(self):
+        students = ["Student " + str(i) for i in range(6)]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3]] for _ in students]
+        sections = [1, 1, 1]
+        section_capacity = [3, 6, 6]
+
+        lexicographic = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                               objective='lexicographic')
+        weighted = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                          objective='weighted')
+        decomposed = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                            engine='decomposition', objective='lexicographic')
+
+        self.assertEqual(lexicographic['status'], 'OPTIMAL')
+        self.assertEqual(lexicographic['preference_counts'], {1: 3, 2: 3})
+        self.assertEqual(lexicographic['statistics']['level_objectives'], [3, 3])
+        self.assertEqual(weighted['preference_counts'], lexicographic['preference_counts'])
+        self.assertEqual(decomposed['preference_counts'], lexicographic['preference_counts'])
+        with self.assertRaises(ValueError):
+            create_course_schedule(students, courses, preferences, sections, section_capacity, objective='unknown')
+
+    def test_schedule_cache(self):
+        students = ["Student " + str(i) for i in range(6)]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3]] for _ in students]
+        sections = [1, 1, 1]
+        section_capacity = [3, 6, 6]
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ScheduleCache(directory)
+            solved = create_course_schedule(students, courses, preferences, sections, section_capacity, cache=cache)
+            cached = create_course_schedule(students, courses, preferences, sections, section_capacity, cache=cache)
+            self.assertEqual(cached, solved)
+
+            # Only the objective changed: the model kept in memory is solved again, no new model is built
+            weighted = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                              cache=cache, objective='weighted')
+            self.assertEqual(weighted['status'], 'OPTIMAL')
+            self.assertEqual(weighted['preference_counts'], {1: 3, 2: 3})
+            self.assertEqual(len(cache.models), 1)
+            files = sorted(name.split('.', 1)[1] for name in os.listdir(directory))
+            self.assertEqual(files, ['result.pkl', 'result.pkl'])
+
+        # Persisted models are read back by another cache, also when a variable dict is empty
+        with tempfile.TemporaryDirectory() as directory:
+            result = create_course_schedule([], [1], [], [1], [1], cache=ScheduleCache(directory, persist_models=True))
+            self.assertEqual(result['status'], 'OPTIMAL')
+            key = next(name for name in os.listdir(directory) if name.endswith('.model.npz')).split('.')[0]
+            model, x, y, z = ScheduleCache(directory, persist_models=True).load_model(key)
+            self.assertEqual((x, y), ({}, {}))
+            self.assertEqual(len(z), 20)
+
+        # Least recently used entries go first once the cache is over its size
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ScheduleCache(directory)
+            for key in ('a', 'b'):
+                cache.save_result(key, solved)
+                time.sleep(0.01)
+            cache.load_result('a')
+            time.sleep(0.01)
+            cache.max_bytes = 2 * os.path.getsize(cache.path('a', '.result.pkl'))
+            cache.save_result('c', solved)
+            self.assertEqual(sorted(os.listdir(directory)), ['a.result.pkl', 'c.result.pkl'])
+
+    def test_time_grid_from_constraints(self):
+        grid = load_time_grid('constraints.json')
+
+        self.assertEqual(len(grid.blocks), 20)
+        self.assertEqual(grid.blocks[:4], [(1, 1), (1, 2), (1, 4), (1, 5)])
+        self.assertNotIn((2, 3), grid.blocks)
+        self.assertEqual(len(TimeGrid(unavailable_blocks=[(5, 5)]).blocks), 19)
+
+    def test_default_time_grid(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'constraints.json')
+            with open(path, 'w') as file:
+                json.dump({'schoolDaysPerWeek': 4, 'blocksPerDay': 4, 'lunchBlockNumber': 2}, file)
+
+            self.assertEqual(default_time_grid(path).blocks, load_time_grid(path).blocks)
+            self.assertEqual(len(default_time_grid(path).blocks), 12)
+            self.assertEqual(default_time_grid(os.path.join(directory, 'missing.json')).blocks, TimeGrid().blocks)
+
+    def test_export_schedule(self):
+        students = ["Alice", "Bob"]
+        courses = [11, 12]
+        preferences = [[[1], [2]], [[2], [1]]]
+        grid = TimeGrid(days_per_week=2, blocks_per_day=4, lunch_block=3, lunch_length=60)
+        self.assertEqual(grid.block_times(), [('8:30', '10:00'), ('10:00', '11:30'), ('11:30', '12:30'),
+                                              ('12:30', '14:00')])
+        result = create_course_schedule(students, courses, preferences, [1, 1], [2, 2], time_grid=grid)
+
+        output = io.StringIO()
+        write_student_schedules(result, output, time_grid=grid, courses=courses)
+        documents = json.loads(output.getvalue())
+        with open('expected-output.json') as file:
+            expected = json.load(file)
+        self.assertEqual(len(documents), 2)
+        self.assertEqual(documents[0]['label'], 'Schedule Alice')
+        self.assertEqual(set(documents[0]), set(expected))
+        self.assertEqual(set(documents[0]['days'][0]['blocks'][0]), set(expected['days'][0]['blocks'][0]))
+        self.assertEqual([day['label'] for day in documents[0]['days']], ['Monday', 'Tuesday'])
+        day, block = grid.blocks[result['schedule']['Alice'][0]['time_block'] - 1]
+        self.assertEqual(documents[0]['days'][day - 1]['blocks'][block - 1]['couseId'], 11)
+        self.assertEqual(documents[0]['days'][0]['blocks'][2]['couseId'], 'Lunch')
+
+        output = io.StringIO()
+        write_section_schedules(result, output, time_grid=grid, courses=courses)
+        self.assertEqual([(section['courseId'], section['enrolled']) for section in json.loads(output.getvalue())],
+                         [(11, 2), (12, 2)])
+
+        output = io.StringIO()
+        write_schedule_csv(result, output, time_grid=grid, courses=courses)
+        rows = output.getvalue().splitlines()
+        self.assertEqual(rows[0], 'studentId,courseId,section,day,block,startTime,endTime')
+        self.assertEqual(len(rows), 5)
+
+    def test_validate_schedule(self):
+        students = ["Alice", "Bob", "Carol"]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3]], [[1, 2], [1, 3]], [[2, 3], [1, 3]]]
+        sections, section_capacity = [1, 1, 2], [2, 3, 1]
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                        objective='weighted')
+        report = validate_schedule(result, students, courses, preferences, sections, section_capacity)
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['violations'], [])
+        self.assertEqual(report['rank_counts'], result['preference_counts'])
+
+        broken = copy.deepcopy(result)
+        first, second = broken['schedule']["Alice"][:2]
+        # Alice's second course moved into the block of her first one, and Bob given one course twice
+        second['time_block'] = first['time_block']
+        broken['schedule']["Bob"].append(dict(broken['schedule']["Bob"][0]))
+        broken['schedule']["Carol"].append({'course': 4, 'section': 1, 'time_block': 1})
+        report = validate_schedule(broken, students, courses, preferences, [1, 1, 2], [1, 3, 1])
+        self.assertFalse(report['valid'])
+        for check in ('course', 'capacity', 'student_block', 'duplicate_course', 'section_blocks', 'preference_set'):
+            self.assertGreater(report['violation_counts'][check], 0, check)
+        self.assertIn({'check': 'student_block', 'student': "Alice", 'time_block': first['time_block'],
+                       'courses': 2}, report['violations'])
+        self.assertEqual(len(validate_schedule(broken, students, courses, preferences, sections, section_capacity,
+                                               max_violations=1)['violations']), 1)
+
+    def test_model_size_budget(self):
+        problem = build_preference_store(*generate_school(8, num_courses=6, min_sections=1, max_sections=2,
+                                                          seed=2)).term_problem(1)
+        for formulation in ('standard', 'aggregated'):
+            model, x, y, z, _ = build_course_schedule_model(*problem, formulation=formulation)
+            lean_model, lean_x, lean_y, lean_z, _ = build_lean_course_schedule_model(*problem, formulation=formulation)
+            estimate = estimate_model_size(*problem, formulation=formulation)
+            # Same model, with keys mapped to the same variable indices
+            self.assertEqual(model_size(model), (estimate['variables'], estimate['constraints']))
+            self.assertEqual(model_size(lean_model), model_size(model))
+            self.assertEqual(list(lean_y), list(y))
+            self.assertEqual([lean_y.index(*key) for key in y], [var.Index() for var in y.values()])
+            self.assertLess(estimate_model_size(*problem, formulation=formulation, lean=True)['memory_bytes'],
+                            estimate['memory_bytes'])
+
+        dense = create_course_schedule(*problem, objective='weighted')
+        budget = estimate_model_size(*problem, lean=True)['memory_bytes']
+        lean = create_course_schedule(*problem, objective='weighted', memory_budget=budget)
+        self.assertTrue(lean['statistics']['model_estimate']['lean'])
+        self.assertEqual(lean['status'], 'OPTIMAL')
+        self.assertEqual(lean['statistics']['objective'], dense['statistics']['objective'])
+        budget = estimate_model_size(*problem, formulation='aggregated', lean=True)['memory_bytes']
+        with self.assertRaises(ModelTooLargeError):
+            create_course_schedule(*problem, memory_budget=budget - 1)
+        with self.assertRaises(ValueError):
+            create_course_schedule(*problem, engine='lns', memory_budget=budget)
+
+    def test_schedule_session(self):
+        students = ["A", "B", "C", "D"]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [1, 3]] for _ in students]
+        session = ScheduleSession(students, courses, preferences, [1, 1, 1], [4, 2, 4], objective='weighted')
+        # Two seats in course 2, so two students get their first choice
+        result = session.solve()
+        self.assertEqual(result['status'], 'OPTIMAL')
+        self.assertEqual(result['preference_counts'], {1: 2, 2: 2})
+
+        session.set_capacity(2, 4)
+        self.assertEqual(session.solve()['preference_counts'], {1: 4, 2: 0})
+        session.set_capacity(2, 2)
+        self.assertEqual(session.solve(keep='fixed')['preference_counts'], {1: 2, 2: 2})
+        # A second section of course 2 was built in, a fourth one rebuilds the model
+        session.set_sections(2, 2)
+        result = session.solve()
+        self.assertEqual(result['preference_counts'], {1: 4, 2: 0})
+        self.assertEqual(len(result['section_blocks'][2]), 2)
+        session.set_sections(2, 1)
+        self.assertEqual(session.solve()['preference_counts'], {1: 2, 2: 2})
+        session.set_sections(2, 4)
+        self.assertEqual(session.solve()['preference_counts'], {1: 4, 2: 0})
+
+        session.set_sections(2, 1)
+        session.set_preferences("A", [[1, 3], [1, 2]])
+        result = session.solve()
+        self.assertEqual(result['preference_counts'], {1: 3, 2: 1})
+        self.assertEqual(result['preference_sets']["A"], 1)
+        self.assertEqual(sorted(entry['course'] for entry in result['schedule']["A"]), [1, 3])
+        expected = create_course_schedule(students, courses, [[[1, 3], [1, 2]]] + preferences[1:], [1, 1, 1],
+                                          [4, 2, 4], objective='weighted')
+        self.assertEqual(result['statistics']['objective'], expected['statistics']['objective'])
+
+        pinned = session.pin_set("B", 2)
+        self.assertEqual(session.solve()['preference_sets']["B"], 2)
+        session.unpin(pinned)
+        # Course 1 has a single section, it cannot meet in both blocks
+        block = session.pin_block(1, 1)
+        course = session.pin_course("C", 1, time_block=2)
+        result = session.solve()
+        self.assertEqual(result['status'], 'NOT OPTIMAL')
+        self.assertEqual(result['conflicts'], [{'constraint': 'pinned', 'pins': [block, course]}])
+
+    def test_run_metrics(self):
+        problem = build_preference_store(*generate_school(12, num_courses=6, seed=3)).term_problem(1)
+        with tempfile.TemporaryDirectory() as directory:
+            metrics_file = os.path.join(directory, 'metrics.jsonl')
+            result = create_course_schedule(*problem, metrics_file=metrics_file)
+            statistics = result['statistics']
+            phases = statistics['phases']
+            self.assertEqual(list(phases)[0], 'prescreen')
+            for name in ('section_links', 'capacity', 'student_overlap', 'preference_set_rows', 'solve', 'extract'):
+                self.assertIn(name, phases)
+            # Every constraint of the model belongs to exactly one family
+            self.assertEqual(sum(record.get('constraints', 0) for record in phases.values()),
+                             statistics['num_constraints'])
+            self.assertEqual(sum(record.get('variables', 0) for record in phases.values()),
+                             statistics['num_variables'])
+            self.assertEqual(statistics['solver']['status'], 'OPTIMAL')
+            self.assertEqual(statistics['solver']['solves'], 1)
+            self.assertEqual(statistics['gap'], 0.0)
+
+            create_course_schedule(*problem, engine='decomposition', metrics_file=metrics_file)
+            with open(metrics_file) as file:
+                records = [json.loads(line) for line in file]
+            self.assertEqual([record['engine'] for record in records], ['cp_sat', 'decomposition'])
+            self.assertIn('selection', records[1]['statistics']['phases'])
+
+    def test_schedule_service(self):
+        with tempfile.TemporaryDirectory() as directory:
+            unix_path = os.path.join(directory, 'service.sock')
+            service = ScheduleService(num_processes=1, queue_size=1, cache_directory=None)
+            started = threading.Event()
+            thread = threading.Thread(target=lambda: asyncio.run(service.serve(unix_path=unix_path,
+                                                                               started=started.set)))
+            thread.start()
+            started.wait()
+            try:
+                def wait_for(job_id, states):
+                    while True:
+                        status, job = service_request('GET', f'/jobs/{job_id}', unix_path=unix_path)
+                        if job['state'] in states:
+                            return job
+                        time.sleep(0.1)
+
+                small = {'students': ["Alice", "Bob"], 'courses': [1, 2], 'preferences': [[[1], [2]], [[2], [1]]],
+                         'sections': [1, 1], 'section_capacity': [2, 2]}
+                status, job = service_request('POST', '/jobs', small, unix_path=unix_path)
+                self.assertEqual(status, 202)
+                job = wait_for(job['id'], ('done', 'failed'))
+                self.assertEqual(job['result']['status'], 'OPTIMAL')
+                self.assertGreaterEqual(job['progress']['solutions'], 1)
+
+                problem = build_preference_store(*generate_school(300)).term_problem(1)
+                large = dict(zip(('students', 'courses', 'preferences', 'sections', 'section_capacity'), problem),
+                             options={'time_limit': 120})
+                running = service_request('POST', '/jobs', large, unix_path=unix_path)[1]
+                wait_for(running['id'], ('running',))
+                queued = service_request('POST', '/jobs', large, unix_path=unix_path)[1]
+                # The queue holds a single waiting job
+                self.assertEqual(service_request('POST', '/jobs', large, unix_path=unix_path)[0], 503)
+                self.assertEqual(service_request('DELETE', f"/jobs/{queued['id']}", unix_path=unix_path)[1]['state'],
+                                 'cancelled')
+                service_request('DELETE', f"/jobs/{running['id']}", unix_path=unix_path)
+                self.assertEqual(wait_for(running['id'], ('done', 'failed', 'cancelled'))['state'], 'cancelled')
+
+                # The replacement worker takes the next job
+                status, job = service_request('POST', '/jobs', small, unix_path=unix_path)
+                self.assertEqual(wait_for(job['id'], ('done', 'failed'))['state'], 'done')
+                self.assertEqual(service_request('GET', '/jobs/999', unix_path=unix_path)[0], 404)
+                self.assertEqual(service_request('POST', '/jobs', {'options': {}}, unix_path=unix_path)[0], 400)
+            finally:
+                service.shutdown()
+                thread.join()
+
+    def test_allowed_blocks(self):
+        students = ["Student " + str(i) for i in range(4)]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2], [2, 3]] for _ in students]
+        sections = [2, 2, 2]
+        section_capacity = [4, 4, 4]
+        # One day with a lunch block and an assembly in block 1 leaves blocks 2 and 4, numbered 1 and 2
+        grid = TimeGrid(days_per_week=1, blocks_per_day=4, lunch_block=3, unavailable_blocks=[(1, 1)])
+        allowed_blocks = {1: [1], 2: [2]}
+
+        model, x, y, z, student_courses = build_course_schedule_model(students, courses, preferences, sections,
+                                                                      section_capacity, time_grid=grid,
+                                                                      allowed_blocks=allowed_blocks)
+        self.assertEqual(sorted(z), [(0, 0, 0), (0, 1, 0), (1, 0, 1), (1, 1, 1),
+                                     (2, 0, 0), (2, 0, 1), (2, 1, 0), (2, 1, 1)])
+        for engine in ('cp_sat', 'decomposition'):
+            result = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                            engine=engine, time_grid=grid, allowed_blocks=allowed_blocks)
+            self.assertEqual(result['status'], 'OPTIMAL')
+            self.assertEqual(result['preference_counts'], {1: 4, 2: 0})
+            self.assertEqual(result['section_blocks'][1], {1: 1})
+            self.assertEqual(result['section_blocks'][2], {1: 2})
+
+    def test_prescreen_capacity_conflict(self):
+        students = ["Alice", "Bob"]
+        courses = [1, 2]
+        preferences = [[[1], [2]], [[1], [2]]]
+        sections = [1, 1]
+        section_capacity = [1, 2]
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity)
+
+        self.assertEqual(result['status'], 'NOT OPTIMAL')
+        self.assertEqual(result['conflicts'], [{'constraint': 'capacity', 'courses': [1], 'demand': 2, 'seats': 1}])
+        self.assertNotIn('build_time', result['statistics'])
+
+    def test_prescreen_student_conflict(self):
+        students = ["Alice", "Bob"]
+        courses = [1, 2, 3]
+        preferences = [[[1, 2, 3], [1, 2, 3], [1, 2, 3]], [[1], [2], [3]]]
+        sections = [1, 1, 1]
+        section_capacity = [5, 5, 5]
+        # Two blocks a week, Alice needs three courses at distinct blocks
+        grid = TimeGrid(days_per_week=1, blocks_per_day=2, lunch_block=None)
+
+        conflicts = screen_infeasibility(students, courses, preferences, sections, section_capacity, grid)
+
+        self.assertEqual(conflicts, [{'constraint': 'student', 'student': 'Alice', 'required': 3, 'courses': 3,
+                                      'blocks': 2},
+                                     {'constraint': 'student', 'student': 'Bob', 'required': 3, 'courses': 3,
+                                      'blocks': 2}])
+        self.assertEqual(screen_infeasibility(students, courses, preferences, sections, section_capacity), [])
+
+    def test_infeasible_model_explained(self):
+        students = ["Alice", "Bob"]
+        courses = [1, 2]
+        preferences = [[[1], [2]], [[1], [2]]]
+        sections = [1, 1]
+        section_capacity = [1, 2]
+
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                        prescreen=False, time_limit=30)
+
+        self.assertEqual(result['status'], 'NOT OPTIMAL')
+        self.assertEqual(result['conflicts'], [{'constraint': 'capacity', 'courses': [1], 'demand': 2, 'seats': 1}])
+        self.assertIn('explain_time', result['statistics'])
+
+    def test_different_schedule_solver_shares_dispatcher(self):
+        students = ["Alice", "Bob"]
+        courses = [1, 2]
+        preferences = [[[1], [2]], [[2], [1]]]
+        sections = [1, 1]
+        section_capacity = [2, 2]
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ScheduleCache(directory)
+            first = create_course_schedule(students, courses, preferences, sections, section_capacity, cache=cache)
+            same = DifferentScheduleSolver.create_course_schedule(1, students, courses, preferences, sections,
+                                                                  section_capacity, cache=cache)
+            self.assertEqual(same, first)
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('.result.pkl')]), 1)
+            DifferentScheduleSolver.create_course_schedule(2, students, courses, preferences, sections,
+                                                           section_capacity, cache=cache)
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('.result.pkl')]), 2)
+
+    def test_decomposition_places_whole_sets(self):
+        students = ["Alice", "Bob", "Carol"]
+        courses = [1, 2]
+        preferences = [[[1], [2]] for _ in students]
+        sections = [1, 1]
+        section_capacity = [2, 2]
+
+        cp_sat = create_course_schedule(students, courses, preferences, sections, section_capacity)
+        decomposed = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                            engine='decomposition')
+
+        self.assertEqual(cp_sat['status'], 'NOT OPTIMAL')
+        self.assertEqual(decomposed['status'], 'OPTIMAL')
+        self.assertEqual(sum(decomposed['preference_counts'].values()), 3)
+
+    def test_column_generation_engine(self):
+        problem = build_preference_store(*generate_school(30, num_courses=12, seed=1)).term_problem(1)
+
+        # Whole preference sets like the decomposition engine, and the same optimum for both objectives
+        for objective in ('first_choices', 'weighted'):
+            decomposed = create_course_schedule(*problem, engine='decomposition', objective=objective)
+            generated = create_course_schedule(*problem, engine='column_generation', objective=objective,
+                                               time_limit=60)
+            self.assertEqual(generated['status'], 'OPTIMAL')
+            self.assertEqual(generated['statistics']['objective'], decomposed['statistics']['objective'])
+            self.assertEqual(sum(generated['preference_counts'].values()), 30)
+            self.assertTrue(validate_schedule(generated, *problem, whole_sets=True)['valid'])
+            self.assertGreater(generated['statistics']['columns'], 0)
+
+        students = ["Alice", "Bob", "Carol"]
+        generated = create_course_schedule(students, [1, 2], [[[1], [2]] for _ in students], [1, 1], [2, 2],
+                                           engine='column_generation')
+        self.assertEqual(generated['status'], 'OPTIMAL')
+        self.assertEqual(generated['preference_counts'], {1: 2, 2: 1})
+        with self.assertRaises(ValueError):
+            create_course_schedule(students, [1, 2], [[[1], [2]] for _ in students], [1, 1], [2, 2],
+                                   engine='column_generation', objective='fewest_sections')
+
+    def test_weighted_objective_overflow(self):
+        # 15 students with 16 preference levels need weights of 16^16, beyond CP-SAT's integer range
+        students = ["Student " + str(i) for i in range(15)]
+        courses = list(range(1, 17))
+        preferences = [[[(k + j) % 16 + 1 for j in range(16)] for k in range(16)] for _ in students]
+        sections = [1] * 16
+        section_capacity = [15] * 16
+
+        self.assertFalse(weights_fit(2000, 6))
+        self.assertTrue(weights_fit(100, 4))
+        with self.assertRaises(ValueError):
+            build_course_schedule_model(students, courses, preferences, sections, section_capacity,
+                                        objective='weighted')
+        result = create_course_schedule(students, courses, preferences, sections, section_capacity,
+                                        engine='decomposition', objective='lexicographic')
+        self.assertEqual(result['status'], 'OPTIMAL')
+        self.assertEqual(result['preference_counts'][1], 15)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,72 @@
+import json
+import os
+
+
+class TimeGrid:
+    # Teachable time blocks of a school week. blocks[t] is the 1-based (day, block of the day) pair of the time
+    # block numbered t+1 in schedules. Lunch and any other unavailable block are left out of the domain
+    # entirely, so no section or student variable is ever created for them. Days start at day_start ('H:MM'),
+    # blocks last block_length minutes and the lunch block lunch_length, as in exported schedules.
+    def __init__(self, days_per_week=5, blocks_per_day=5, lunch_block=3, unavailable_blocks=(), day_start='8:30',
+                 block_length=90, lunch_length=60):
+        self.days_per_week = days_per_week
+        self.blocks_per_day = blocks_per_day
+        self.lunch_block = lunch_block
+        self.day_start = day_start
+        self.block_length = block_length
+        self.lunch_length = lunch_length
+        self.unavailable_blocks = sorted({tuple(block) for block in unavailable_blocks})
+        self.blocks = [(day, block) for day in range(1, days_per_week + 1) for block in range(1, blocks_per_day + 1)
+                       if block != lunch_block and (day, block) not in self.unavailable_blocks]
+
+    def block_times(self):
+        # ('H:MM' start, 'H:MM' end) of every block of a day, lunch included, blocks following each other
+        hours, minutes = map(int, self.day_start.split(':'))
+        start = hours * 60 + minutes
+        times = []
+        for block in range(1, self.blocks_per_day + 1):
+            end = start + (self.lunch_length if block == self.lunch_block else self.block_length)
+            times.append((f'{start // 60}:{start % 60:02d}', f'{end // 60}:{end % 60:02d}'))
+            start = end
+        return times
+
+
+def load_time_grid(constraints_file='constraints.json', unavailable_blocks=()):
+    # Grid described by constraints.json, an optional "unavailableBlocks" list of [day, block] pairs
+    # is removed from the domain along with the lunch block
+    with open(constraints_file, 'r') as file:
+        constraints = json.load(file)
+    return TimeGrid(constraints['schoolDaysPerWeek'], constraints['blocksPerDay'], constraints.get('lunchBlockNumber'),
+                    list(constraints.get('unavailableBlocks', [])) + list(unavailable_blocks),
+                    constraints.get('dayStartTime', '8:30'), constraints.get('blockLengthInMinuets', 90),
+                    constraints.get('lunchLengthInMinuets', 60))
+
+
+def default_time_grid(constraints_file='constraints.json'):
+    # Grid used when no time_grid is given: constraints.json when there is one, the same 5-day week with
+    # 5 blocks a day and lunch in block 3 otherwise
+    if os.path.exists(constraints_file):
+        return load_time_grid(constraints_file)
+    return TimeGrid()
+
+
+def course_block_domains(courses, time_grid, allowed_blocks=None):
+    # domains[c] lists the 0-based time blocks the c-th course can be scheduled in. allowed_blocks maps a course
+    # id to the time blocks (numbered as in schedules, from 1) it is restricted to, other courses may use any block.
+    allowed_blocks = allowed_blocks or {}
+    domains = []
+    for course in courses:
+        if course not in allowed_blocks:
+            domains.append(list(range(len(time_grid.blocks))))
+            continue
+        blocks = sorted(set(allowed_blocks[course]))
+        if blocks and not 1 <= blocks[0] <= blocks[-1] <= len(time_grid.blocks):
+            raise ValueError(f"Allowed blocks of course {course} must be between 1 and {len(time_grid.blocks)}")
+        domains.append([t - 1 for t in blocks])
+    return domains
+
+
+def time_domain_key(time_grid=None, allowed_blocks=None):
+    # Everything that changes the time block domains, in a JSON-friendly form for cache keys
+    time_grid = time_grid or default_time_grid()
+    return [time_grid.blocks, sorted([course, sorted(set(blocks))] for course, blocks in (allowed_blocks or {}).items())]
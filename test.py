@@ -1,50 +1,9 @@
 from ortools.sat.python import cp_model
-import json
 from Solver import create_course_schedule
+from DataLoader import load_students, load_courses
+from TimeGrid import load_time_grid
 # from simpleSolver import simple_course_schedule
 
-# classes to represent Student-preferences 
-class Student:
-    def __init__(self, studentId, terms):
-        self.studentId = studentId
-        self.terms = [Term(**term) for term in terms]
-
-class Term:
-    def __init__(self, termId, coursesPreferences):
-        self.termId = termId
-        self.coursesPreferences = coursesPreferences
-
-# classes to represent Courses
-class Course:
-    def __init__(self, id, name, code, maxSeats, maxSections):
-        self.id = id
-        self.name = name
-        self.code = code
-        self.maxSeats = maxSeats
-        self.maxSections = maxSections
-
-# each section of a course should be treated separately, 
-# just add a check so that no two sections of the same course are scheduled at the same time
-class Section:
-    def __init__(self, id, courseId, maxSeats):
-        self.id = id
-        self.courseId = courseId
-        self.maxSeats = maxSeats
-        self.currSeats = 0
-
-# Function to load students
-def load_students(filename):
-    with open(filename, 'r') as file:
-        data = json.load(file)
-    return [Student(**student) for student in data]
-
-# Function to load courses
-def load_courses(filename):
-    with open(filename, 'r') as file:
-        data = json.load(file)
-    return [Course(**course) for course in data]
-
-
 # Load the students' preferences from 'students.json'
 studentStructs = load_students('student-preferences.json')
 # Load the courses from 'courses.json'
@@ -87,7 +46,8 @@ section_capacity = []
 for i in range(num_courses):
     section_capacity.append(courseStructs[i].maxSeats)
 
-create_course_schedule(students, courses, preferences, num_sections, section_capacity)
+create_course_schedule(students, courses, preferences, num_sections, section_capacity, verbose=True,
+                       time_grid=load_time_grid('constraints.json'))
 # simple_course_schedule(students, courses, preferences, section_capacity)
 # print("Students: ", students)
 # print("Courses: ", courses)